@@ -0,0 +1,121 @@
+# accounts.py
+"""Several Gmail accounts per MailPilot user: linking, concurrent fan-out and date-ordered merging.
+
+A MailPilot user is the Google identity they signed in with (the primary
+account). Further Gmail accounts can be linked to it. Each account keeps its
+own rows, keyed by the account's address, so sync, caches and Gmail quota stay
+per account. Anything shown to the user is merged across their accounts.
+"""
+import contextvars
+import heapq
+import itertools
+import logging
+import secrets
+import threading
+import time
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, List, Optional, TypeVar
+
+from cold_storage import email_timestamp
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# How long a /accounts/link URL stays valid
+LINK_STATE_TTL_SECONDS = 600
+
+
+class LinkedAccounts:
+    """Tokens of the Gmail accounts linked to each owner (in memory, like user_tokens)"""
+
+    def __init__(self):
+        self._links: Dict[str, Dict[str, Dict]] = {}  # owner -> account -> token data
+        self._owners: Dict[str, str] = {}  # account -> owner
+        self._pending: Dict[str, tuple] = {}  # OAuth state -> (owner, expires_at)
+        self._lock = threading.Lock()
+
+    def start_link(self, owner: str) -> str:
+        """One-time OAuth state that makes the callback link the account to `owner`"""
+        state = "link-" + secrets.token_urlsafe(24)
+        now = time.time()
+        with self._lock:
+            self._pending = {s: p for s, p in self._pending.items() if p[1] > now}
+            self._pending[state] = (owner, now + LINK_STATE_TTL_SECONDS)
+        return state
+
+    def finish_link(self, state: Optional[str]) -> Optional[str]:
+        """Owner a link state was issued for, or None if it is unknown or expired"""
+        if not state:
+            return None
+        with self._lock:
+            pending = self._pending.pop(state, None)
+        if pending is None or pending[1] < time.time():
+            return None
+        return pending[0]
+
+    def link(self, owner: str, account: str, token_data: Dict):
+        with self._lock:
+            previous = self._owners.get(account)
+            if previous and previous != owner:
+                # An account belongs to one MailPilot user; linking it elsewhere moves it
+                self._links.get(previous, {}).pop(account, None)
+            self._links.setdefault(owner, {})[account] = token_data
+            self._owners[account] = owner
+
+    def unlink(self, owner: str, account: str) -> bool:
+        with self._lock:
+            if self._links.get(owner, {}).pop(account, None) is None:
+                return False
+            self._owners.pop(account, None)
+            return True
+
+    def drop_owner(self, owner: str):
+        with self._lock:
+            for account in self._links.pop(owner, {}):
+                self._owners.pop(account, None)
+
+    def tokens(self, owner: str) -> Dict[str, Dict]:
+        with self._lock:
+            return dict(self._links.get(owner, {}))
+
+    def owner_of(self, account: str) -> Optional[str]:
+        with self._lock:
+            return self._owners.get(account)
+
+
+def fan_out(executor: Executor, fn: Callable[[str], T], keys: Iterable[str]) -> Dict[str, Optional[T]]:
+    """fn(key) for every key at once; a key whose call raised maps to None.
+
+    Each call runs in a copy of the caller's context, so deadlines and the Gmail
+    priority class carry over to the pool threads. A single key runs inline.
+    """
+    keys = list(keys)
+    if len(keys) == 1:
+        return {keys[0]: _call(fn, keys[0])}
+    futures = {key: executor.submit(contextvars.copy_context().run, _call, fn, key) for key in keys}
+    return {key: future.result() for key, future in futures.items()}
+
+
+def _call(fn: Callable[[str], T], key: str) -> Optional[T]:
+    try:
+        return fn(key)
+    except Exception as e:
+        logger.error(f"[ACCOUNTS] {key}: {e}")
+        return None
+
+
+def merge_by_date(per_account: Dict[str, List[Dict]], limit: Optional[int] = None) -> List[Dict]:
+    """k-way merge of per-account email lists (each newest first) into one list, newest first.
+
+    Rows gain an `account` field. Only as many rows as `limit` are taken from
+    the merged streams.
+    """
+    streams = [_tagged(account, rows) for account, rows in per_account.items() if rows]
+    merged = heapq.merge(*streams, key=lambda row: email_timestamp(row.get("date")), reverse=True)
+    return list(itertools.islice(merged, limit))
+
+
+def _tagged(account: str, rows: List[Dict]) -> Iterable[Dict]:
+    for row in rows:
+        yield {**row, "account": account}
@@ -0,0 +1,330 @@
+# analytics.py
+"""Per-user sender rollups, maintained incrementally as emails are stored and trimmed.
+
+Rollups cover the hot emails table. Archived (cold-tier) mail is folded in on
+request, from a view rebuilt only when the user's archive changes.
+
+Changes reach the sender_rollups table as per-sender deltas, added in place by
+the apply_sender_deltas database function (supabase_schema.sql). Workers
+writing at once therefore never overwrite each other's counts.
+"""
+import heapq
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import parseaddr
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_TABLE = "sender_rollups"
+# Database functions in supabase_schema.sql
+APPLY_DELTAS_RPC = "apply_sender_deltas"
+SET_KEYWORD_RPC = "set_sender_keyword"
+
+
+def normalize_sender(from_email: Optional[str]) -> str:
+    """Return the display name of a From header, falling back to the bare address"""
+    if not from_email:
+        return "Unknown Sender"
+    if "<" not in from_email:
+        # Already a bare name or address (stored rows are normalized at sync time)
+        return from_email.strip()
+    name, address = parseaddr(from_email)
+    return name.strip() or address.strip() or from_email.strip()
+
+
+def _email_day(date_value: Optional[str]) -> Optional[str]:
+    # Stored dates are ISO strings, so the first 10 chars are the UTC day
+    if not date_value or len(date_value) < 10:
+        return None
+    return date_value[:10]
+
+
+def match_keywords(email: Dict, keywords: Iterable[str]) -> List[str]:
+    """Keywords found in the subject, snippet or sender of an email"""
+    subject = (email.get("subject") or "").lower()
+    snippet = (email.get("snippet") or "").lower()
+    from_email = (email.get("from_email") or "").lower()
+    matched = []
+    for keyword in keywords:
+        keyword_lower = keyword.lower()
+        if keyword_lower in subject or keyword_lower in snippet or keyword_lower in from_email:
+            matched.append(keyword)
+    return matched
+
+
+class SenderRollup:
+    __slots__ = ("sender", "count", "last_seen", "keywords", "days")
+
+    def __init__(self, sender: str, count: int = 0, last_seen: Optional[str] = None,
+                 keywords: Optional[Dict[str, int]] = None, days: Optional[Dict[str, int]] = None):
+        self.sender = sender
+        self.count = count
+        self.last_seen = last_seen
+        self.keywords = keywords or {}
+        self.days = days or {}
+
+    def add(self, email: Dict, matched: List[str]):
+        self.count += 1
+        date_value = email.get("date")
+        if date_value and (self.last_seen is None or date_value > self.last_seen):
+            self.last_seen = date_value
+        day = _email_day(date_value)
+        if day:
+            self.days[day] = self.days.get(day, 0) + 1
+        for keyword in matched:
+            self.keywords[keyword] = self.keywords.get(keyword, 0) + 1
+
+    def count_since(self, since_day: str) -> int:
+        return sum(n for day, n in self.days.items() if day >= since_day)
+
+    def to_delta(self, sign: int) -> Dict:
+        """apply_sender_deltas entry adding (sign 1) or subtracting (sign -1) these emails"""
+        return {
+            "sender": self.sender,
+            "count": sign * self.count,
+            # Subtracting cannot tell the new latest email; the database looks it up
+            "last_seen": self.last_seen if sign > 0 else None,
+            "keywords": {keyword: sign * n for keyword, n in self.keywords.items()},
+            "days": {day: sign * n for day, n in self.days.items()},
+        }
+
+    def to_row(self, user_id: str) -> Dict:
+        return {
+            "user_id": user_id,
+            "sender": self.sender,
+            "email_count": self.count,
+            "last_seen": self.last_seen,
+            "keywords": self.keywords,
+            "daily_counts": self.days,
+        }
+
+    @classmethod
+    def from_row(cls, row: Dict) -> "SenderRollup":
+        return cls(
+            row["sender"],
+            int(row.get("email_count") or 0),
+            row.get("last_seen"),
+            dict(row.get("keywords") or {}),
+            dict(row.get("daily_counts") or {}),
+        )
+
+    def merged(self, other: "SenderRollup") -> "SenderRollup":
+        """A new rollup counting the emails of both"""
+        days = dict(self.days)
+        for day, n in other.days.items():
+            days[day] = days.get(day, 0) + n
+        keywords = dict(self.keywords)
+        for keyword, n in other.keywords.items():
+            keywords[keyword] = keywords.get(keyword, 0) + n
+        last_seen = max(filter(None, (self.last_seen, other.last_seen)), default=None)
+        return SenderRollup(self.sender, self.count + other.count, last_seen, keywords, days)
+
+    def to_dict(self, window_count: Optional[int] = None) -> Dict:
+        result = {
+            "sender": self.sender,
+            "count": self.count,
+            "lastSeen": self.last_seen,
+            "keywords": sorted(self.keywords),
+            "daily": dict(sorted(self.days.items())),
+        }
+        if window_count is not None:
+            result["windowCount"] = window_count
+        return result
+
+
+def build_rollups(emails: Iterable[Dict], keywords: List[str]) -> Dict[str, SenderRollup]:
+    rollups: Dict[str, SenderRollup] = {}
+    for email in emails:
+        sender = normalize_sender(email.get("from_email"))
+        rollup = rollups.get(sender)
+        if rollup is None:
+            rollup = rollups[sender] = SenderRollup(sender)
+        rollup.add(email, match_keywords(email, keywords))
+    return rollups
+
+
+class SenderRollupStore:
+    """The sender_rollups table, with each worker's copy of the rows it read.
+
+    Inserts and deletes send deltas for the senders they touch, so reads never
+    have to scan the emails table. A worker's copy of a user's rows is stamped
+    with the data version it was read at and read again once the version moves
+    (another worker wrote) or this worker writes.
+    """
+
+    def __init__(self, client, keywords_for: Callable[[str], List[str]], archive=None):
+        self.client = client
+        self.keywords_for = keywords_for
+        # Cold tier (cold_storage.ColdStore) read for include_archived queries
+        self.archive = archive
+        self._users: Dict[str, Tuple[Optional[int], Dict[str, SenderRollup]]] = {}
+        self._archived: Dict[str, Tuple[Tuple, Dict[str, SenderRollup]]] = {}
+        # Users whose rollups are known to exist, so deltas have counts to add to
+        self._seeded: set = set()
+        self._lock = threading.Lock()
+
+    def _load(self, user_id: str, version: Optional[int]) -> Dict[str, SenderRollup]:
+        cached = self._users.get(user_id)
+        if cached is not None and version is not None and cached[0] == version:
+            return cached[1]
+        rollups = self._read(user_id)
+        if rollups is None:
+            return cached[1] if cached else {}
+        if not rollups:
+            rollups = self._rebuild(user_id)
+        self._seeded.add(user_id)
+        self._users[user_id] = (version, rollups)
+        return rollups
+
+    def _read(self, user_id: str) -> Optional[Dict[str, SenderRollup]]:
+        # None when the table could not be read, so a failed read never triggers a rebuild
+        try:
+            result = self.client.table(ROLLUP_TABLE).select("*").eq("user_id", user_id).execute()
+        except Exception as e:
+            logger.warning(f"[ANALYTICS] Could not load rollups for {user_id}: {e}")
+            return None
+        return {row["sender"]: SenderRollup.from_row(row) for row in result.data or []}
+
+    def _seed(self, user_id: str) -> bool:
+        """Make sure the user has rollups; True if they were just rebuilt (from the emails already stored)"""
+        if user_id in self._seeded:
+            return False
+        rollups = self._read(user_id)
+        if rollups is None:
+            return False
+        rebuilt = not rollups
+        if rebuilt:
+            self._rebuild(user_id)
+        self._seeded.add(user_id)
+        return rebuilt
+
+    def _rebuild(self, user_id: str) -> Dict[str, SenderRollup]:
+        # One-off scan for users whose emails predate the rollup table
+        rollups: Dict[str, SenderRollup] = {}
+        try:
+            result = (
+                self.client.table("emails")
+                .select("from_email, subject, snippet, date")
+                .eq("user_id", user_id)
+                .execute()
+            )
+        except Exception as e:
+            logger.warning(f"[ANALYTICS] Rollup rebuild failed for {user_id}: {e}")
+            return rollups
+
+        if not result.data:
+            return rollups
+
+        rollups = build_rollups(result.data, self.keywords_for(user_id))
+        try:
+            self.client.table(ROLLUP_TABLE).upsert(
+                [r.to_row(user_id) for r in rollups.values()], on_conflict="user_id,sender").execute()
+        except Exception as e:
+            logger.error(f"[ANALYTICS] Failed to persist rollups for {user_id}: {e}")
+        logger.info(f"[ANALYTICS] Rebuilt {len(rollups)} sender rollups for {user_id}")
+        return rollups
+
+    def _apply(self, user_id: str, emails: List[Dict], keywords: Optional[List[str]], sign: int):
+        if not emails:
+            return
+        if keywords is None:
+            keywords = self.keywords_for(user_id)
+        with self._lock:
+            rebuilt = self._seed(user_id)
+        if rebuilt:
+            return
+        deltas = build_rollups(emails, keywords)
+        try:
+            # Sorted, so concurrent calls lock the rows in the same order
+            self.client.rpc(APPLY_DELTAS_RPC, {
+                "p_user_id": user_id,
+                "p_deltas": [deltas[sender].to_delta(sign) for sender in sorted(deltas)],
+            }).execute()
+        except Exception as e:
+            logger.error(f"[ANALYTICS] Failed to persist rollups for {user_id}: {e}")
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def apply_inserts(self, user_id: str, emails: List[Dict], keywords: Optional[List[str]] = None):
+        """Fold newly stored emails into the sender rollups"""
+        self._apply(user_id, emails, keywords, 1)
+
+    def apply_deletes(self, user_id: str, emails: List[Dict], keywords: Optional[List[str]] = None):
+        """Remove deleted emails from the sender rollups"""
+        self._apply(user_id, emails, keywords, -1)
+
+    def recount_keyword(self, user_id: str, keyword: str, present: bool = True):
+        """Recount one keyword's matches per sender after it was added, or drop it after removal"""
+        counts: Dict[str, int] = {}
+        if present:
+            try:
+                result = (
+                    self.client.table("emails")
+                    .select("from_email, subject, snippet")
+                    .eq("user_id", user_id)
+                    .execute()
+                )
+            except Exception as e:
+                logger.warning(f"[ANALYTICS] Could not recount keyword for {user_id}: {e}")
+                return
+            for email in result.data or []:
+                if match_keywords(email, [keyword]):
+                    sender = normalize_sender(email.get("from_email"))
+                    counts[sender] = counts.get(sender, 0) + 1
+        try:
+            self.client.rpc(SET_KEYWORD_RPC, {"p_user_id": user_id, "p_keyword": keyword, "p_counts": counts}).execute()
+        except Exception as e:
+            logger.error(f"[ANALYTICS] Failed to persist keyword counts for {user_id}: {e}")
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def _archived_rollups(self, user_id: str) -> Dict[str, SenderRollup]:
+        keywords = self.keywords_for(user_id)
+        version = (self.archive.generation(user_id), tuple(keywords))
+        cached = self._archived.get(user_id)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        rollups = build_rollups(self.archive.scan(user_id), keywords)
+        self._archived[user_id] = (version, rollups)
+        return rollups
+
+    def top_senders(self, user_id: str, limit: int = 10, days: Optional[int] = None,
+                    include_archived: bool = False, version: Optional[int] = None) -> List[Dict]:
+        """Top senders by email count, optionally restricted to the last `days` days.
+
+        `version` is the user's current data version; without one the rows are read again.
+        """
+        with self._lock:
+            rollups = list(self._load(user_id, version).values())
+        if include_archived and self.archive is not None:
+            combined = {r.sender: r for r in rollups}
+            for sender, archived in self._archived_rollups(user_id).items():
+                hot = combined.get(sender)
+                combined[sender] = hot.merged(archived) if hot else archived
+            rollups = list(combined.values())
+
+        if days is None:
+            top = heapq.nlargest(limit, rollups, key=lambda r: (r.count, r.last_seen or ""))
+            return [r.to_dict() for r in top]
+
+        since_day = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+        windowed = [(r.count_since(since_day), r) for r in rollups]
+        top = heapq.nlargest(
+            limit,
+            (item for item in windowed if item[0] > 0),
+            key=lambda item: (item[0], item[1].last_seen or ""),
+        )
+        return [r.to_dict(window_count=n) for n, r in top]
+
+    def invalidate(self, user_id: Optional[str] = None):
+        with self._lock:
+            if user_id is None:
+                self._users.clear()
+                self._archived.clear()
+                self._seeded.clear()
+            else:
+                self._users.pop(user_id, None)
+                self._archived.pop(user_id, None)
+                self._seeded.discard(user_id)
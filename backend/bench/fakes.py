@@ -0,0 +1,726 @@
+# bench/fakes.py
+"""Local stand-ins for Gmail, Supabase (PostgREST) and Hugging Face used by the benchmarks.
+
+Each fake is a threaded HTTP server on 127.0.0.1 with configurable latency,
+jitter and error rate, speaking only the subset of the API that main.py uses.
+"""
+import base64
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+import requests
+
+
+class FaultProfile:
+    """Latency and error injection applied to every request a fake serves"""
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, error_rate: float = 0.0,
+                 error_status: int = 503, seed: Optional[int] = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def next(self) -> Tuple[float, bool]:
+        """(delay in seconds, whether to fail) for the next request"""
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+            fail = self._random.random() < self.error_rate
+        return max(self.latency_ms + jitter, 0.0) / 1000.0, fail
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake: "FakeServer" = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        parts = urlsplit(self.path)
+        query = parse_qsl(parts.query, keep_blank_values=True)
+
+        delay, fail = self.fake.faults.next()
+        if delay:
+            time.sleep(delay)
+        self.fake._count(self.command, parts.path, fail)
+        if fail:
+            status = self.fake.faults.error_status
+            self._send(status, {"error": {"code": status, "message": "injected failure"}}, {"Retry-After": "1"})
+            return
+
+        try:
+            status, payload, headers = self.fake.handle(self.command, parts.path, query, dict(self.headers), body)
+        except Exception as e:
+            status, payload, headers = 500, {"error": {"code": 500, "message": str(e)}}, {}
+        self._send(status, payload, headers)
+
+    def _send(self, status: int, payload, headers: Optional[Dict] = None):
+        headers = dict(headers or {})
+        if isinstance(payload, (bytes, str)):
+            data = payload.encode() if isinstance(payload, str) else payload
+            headers.setdefault("Content-Type", "text/plain")
+        else:
+            data = json.dumps(payload).encode() if payload is not None else b""
+            headers.setdefault("Content-Type", "application/json")
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        self.fake._sent(len(data))
+
+    do_GET = do_POST = do_PATCH = do_DELETE = do_PUT = _dispatch
+
+
+class FakeServer:
+    """Base class: runs handle() behind a ThreadingHTTPServer on an ephemeral port"""
+
+    name = "fake"
+
+    def __init__(self, faults: Optional[FaultProfile] = None):
+        self.faults = faults or FaultProfile()
+        self.requests: Dict[str, int] = {}
+        self.errors = 0
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+        handler = type(f"{type(self).__name__}Handler", (_Handler,), {"fake": self})
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=self.name, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeServer":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _route_key(self, method: str, path: str) -> str:
+        return f"{method} {path}"
+
+    def _count(self, method: str, path: str, failed: bool):
+        key = self._route_key(method, path)
+        with self._stats_lock:
+            self.requests[key] = self.requests.get(key, 0) + 1
+            if failed:
+                self.errors += 1
+
+    def _sent(self, size: int):
+        with self._stats_lock:
+            self.bytes_sent += size
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            return {"requests": dict(self.requests), "total": sum(self.requests.values()),
+                    "injected_errors": self.errors, "response_bytes": self.bytes_sent}
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.requests.clear()
+            self.errors = 0
+            self.bytes_sent = 0
+
+    def handle(self, method: str, path: str, query: List[Tuple[str, str]], headers: Dict, body: bytes):
+        raise NotImplementedError
+
+
+# --- Gmail ---
+
+SENDERS = [
+    "GitHub <noreply@github.com>", "Google <no-reply@accounts.google.com>", "Alice Smith <alice@example.com>",
+    "Bob Jones <bob@example.com>", "LinkedIn <jobs-noreply@linkedin.com>", "Stripe <receipts@stripe.com>",
+    "Medium Daily Digest <noreply@medium.com>", "Team Calendar <calendar@example.com>",
+]
+SUBJECT_WORDS = ["invoice", "meeting", "update", "weekly", "report", "security", "alert", "offer",
+                 "project", "deadline", "review", "welcome", "reminder", "order", "shipped"]
+
+
+_FIELD_NAME = re.compile(r"[A-Za-z0-9_]+")
+
+
+def _parse_fields(mask: str, pos: int = 0) -> Tuple[Dict, int]:
+    """Gmail `fields` syntax (a,b/c,d(e,f)) -> nested dict of kept keys, None meaning the whole value"""
+    tree: Dict = {}
+    while True:
+        path = []
+        while True:
+            m = _FIELD_NAME.match(mask, pos)
+            if not m:
+                raise ValueError(f"Bad fields mask at {pos}: {mask!r}")
+            path.append(m.group(0))
+            pos = m.end()
+            if not mask.startswith("/", pos):
+                break
+            pos += 1
+        sub = None
+        if mask.startswith("(", pos):
+            sub, pos = _parse_fields(mask, pos + 1)
+            if not mask.startswith(")", pos):
+                raise ValueError(f"Unclosed '(' in fields mask: {mask!r}")
+            pos += 1
+        for name in reversed(path[1:]):
+            sub = {name: sub}
+        _merge_fields(tree, path[0], sub)
+        if not mask.startswith(",", pos):
+            return tree, pos
+        pos += 1
+
+
+def _merge_fields(tree: Dict, name: str, sub: Optional[Dict]):
+    if name not in tree:
+        tree[name] = sub
+    elif tree[name] is None or sub is None:
+        tree[name] = None
+    else:
+        for key, value in sub.items():
+            _merge_fields(tree[name], key, value)
+
+
+def apply_fields(value, mask: str):
+    """Response trimmed to a `fields` mask, as Gmail does for partial responses"""
+    tree, pos = _parse_fields(mask)
+    if pos != len(mask):
+        raise ValueError(f"Trailing characters in fields mask: {mask!r}")
+    return _project_fields(value, tree)
+
+
+def _project_fields(value, tree: Optional[Dict]):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_project_fields(v, tree) for v in value]
+    if not isinstance(value, dict):
+        return value
+    return {k: _project_fields(value[k], sub) for k, sub in tree.items() if k in value}
+
+
+class FakeGmail(FakeServer):
+    """Gmail REST subset: messages list/get, labels, history, watch and the HTTP batch endpoint"""
+
+    name = "fake-gmail"
+
+    def __init__(self, mailbox_size: int = 500,
+                 faults: Optional[FaultProfile] = None, seed: int = 7):
+        super().__init__(faults)
+        self.history_id = 1000
+        rng = random.Random(seed)
+        now = datetime.now(timezone.utc)
+        self.messages: Dict[str, Dict] = {}
+        self.order: List[str] = []  # newest first
+        for i in range(mailbox_size):
+            mid = f"{0x18f000000000 + mailbox_size - i:x}"
+            sent = now - timedelta(minutes=37 * i)
+            subject = " ".join(rng.choice(SUBJECT_WORDS) for _ in range(rng.randint(2, 6))).capitalize()
+            labels = ["INBOX"] + (["UNREAD"] if rng.random() < 0.3 else []) + \
+                     [rng.choice(["CATEGORY_PERSONAL", "CATEGORY_UPDATES", "CATEGORY_PROMOTIONS", "CATEGORY_SOCIAL"])]
+            self.messages[mid] = {
+                "id": mid,
+                "threadId": f"{0x18f000000000 + (mailbox_size - i) // 3:x}",
+                "labelIds": labels,
+                "snippet": f"{subject} - " + " ".join(rng.choice(SUBJECT_WORDS) for _ in range(20)),
+                "historyId": str(self.history_id + i),
+                "internalDate": str(int(sent.timestamp() * 1000)),
+                "sizeEstimate": rng.randint(2000, 60000),
+                "payload": {"headers": [
+                    {"name": "From", "value": rng.choice(SENDERS)},
+                    {"name": "Subject", "value": subject},
+                    {"name": "Date", "value": sent.strftime("%a, %d %b %Y %H:%M:%S +0000")},
+                ]},
+            }
+            self.order.append(mid)
+        self.history_id += mailbox_size
+        self.threads: Dict[str, List[str]] = {}  # thread ID -> message IDs, newest first
+        for mid in self.order:
+            self.threads.setdefault(self.messages[mid]["threadId"], []).append(mid)
+        self.labels = {
+            "INBOX": "INBOX", "UNREAD": "UNREAD", "CATEGORY_PERSONAL": "CATEGORY_PERSONAL",
+            "CATEGORY_SOCIAL": "CATEGORY_SOCIAL", "CATEGORY_PROMOTIONS": "CATEGORY_PROMOTIONS",
+            "CATEGORY_UPDATES": "CATEGORY_UPDATES", "CATEGORY_FORUMS": "CATEGORY_FORUMS",
+            "Label_1": "Work", "Label_2": "Receipts",
+        }
+
+    def deliver(self, count: int = 1) -> int:
+        """Add `count` new inbox messages; returns the mailbox historyId after them"""
+        now = datetime.now(timezone.utc)
+        for _ in range(count):
+            self.history_id += 1
+            mid = f"{int(self.order[0], 16) + 1:x}" if self.order else f"{0x18f000000000:x}"
+            subject = f"New message {self.history_id}"
+            self.messages[mid] = {
+                "id": mid,
+                "threadId": mid,
+                "labelIds": ["INBOX", "UNREAD", "CATEGORY_PERSONAL"],
+                "snippet": f"{subject} - just arrived",
+                "historyId": str(self.history_id),
+                "internalDate": str(int(now.timestamp() * 1000)),
+                "sizeEstimate": 4000,
+                "payload": {"headers": [
+                    {"name": "From", "value": SENDERS[0]},
+                    {"name": "Subject", "value": subject},
+                    {"name": "Date", "value": now.strftime("%a, %d %b %Y %H:%M:%S +0000")},
+                ]},
+            }
+            self.order.insert(0, mid)
+            self.threads[mid] = [mid]
+        return self.history_id
+
+    def _route_key(self, method: str, path: str) -> str:
+        # Collapse IDs so per-route counts stay readable
+        path = re.sub(r"/messages/[0-9a-f]+$", "/messages/{id}", path)
+        path = re.sub(r"/labels/[^/]+$", "/labels/{id}", path)
+        path = re.sub(r"/threads/[0-9a-f]+$", "/threads/{id}", path)
+        return f"{method} {path}"
+
+    def _message(self, mid: str, fmt: str = "metadata") -> Optional[Dict]:
+        msg = self.messages.get(mid)
+        if msg is None:
+            return None
+        if fmt == "minimal":
+            return {k: v for k, v in msg.items() if k != "payload"}
+        if fmt == "full":
+            return {**msg, "payload": self._full_payload(msg)}
+        return msg
+
+    @staticmethod
+    def _full_payload(msg: Dict) -> Dict:
+        """multipart/alternative body built from the snippet, a few KB like a real message"""
+        text = "\n\n".join([msg["snippet"]] * 12)
+        html = "<html><head><style>p{margin:0}</style></head><body>" + \
+               "".join(f"<p>{msg['snippet']}</p>" for _ in range(12)) + "</body></html>"
+
+        def part(mime: str, data: str) -> Dict:
+            return {"mimeType": mime, "filename": "",
+                    "headers": [{"name": "Content-Type", "value": f"{mime}; charset=UTF-8"}],
+                    "body": {"size": len(data), "data": base64.urlsafe_b64encode(data.encode()).decode()}}
+
+        return {"mimeType": "multipart/alternative", "headers": msg["payload"]["headers"],
+                "body": {"size": 0}, "parts": [part("text/plain", text), part("text/html", html)]}
+
+    def _list(self, query: Dict) -> Dict:
+        ids = self.order
+        q = query.get("q", "")
+        m = re.search(r"after:(\d{4})/(\d{2})/(\d{2})", q)
+        if m:
+            after = datetime(int(m.group(1)), int(m.group(2)), int(m.group(3)), tzinfo=timezone.utc).timestamp() * 1000
+            ids = [i for i in ids if int(self.messages[i]["internalDate"]) >= after]
+        start = int(query.get("pageToken") or 0)
+        size = min(int(query.get("maxResults") or 100), 500)
+        page = ids[start:start + size]
+        result = {"messages": [{"id": i, "threadId": self.messages[i]["threadId"]} for i in page],
+                  "resultSizeEstimate": len(ids)}
+        if start + size < len(ids):
+            result["nextPageToken"] = str(start + size)
+        return result
+
+    def _get_thread(self, tid: str) -> Optional[Dict]:
+        mids = self.threads.get(tid)
+        if not mids:
+            return None
+        messages = [self.messages[mid] for mid in reversed(mids)]  # oldest first, like Gmail
+        return {"id": tid, "historyId": max(m["historyId"] for m in messages), "messages": messages}
+
+    def _list_threads(self, query: Dict) -> Dict:
+        tids = list(dict.fromkeys(self.messages[mid]["threadId"] for mid in self.order))
+        start = int(query.get("pageToken") or 0)
+        size = min(int(query.get("maxResults") or 100), 500)
+        page = tids[start:start + size]
+        result = {"threads": [{"id": t, "snippet": self.messages[self.threads[t][0]]["snippet"],
+                               "historyId": self._get_thread(t)["historyId"]} for t in page],
+                  "resultSizeEstimate": len(tids)}
+        if start + size < len(tids):
+            result["nextPageToken"] = str(start + size)
+        return result
+
+    def _label(self, label_id: str) -> Optional[Dict]:
+        if label_id not in self.labels:
+            return None
+        in_label = [m for m in self.messages.values() if label_id in m["labelIds"]]
+        return {
+            "id": label_id,
+            "name": self.labels[label_id],
+            "type": "user" if label_id.startswith("Label_") else "system",
+            "messagesTotal": len(in_label),
+            "messagesUnread": sum(1 for m in in_label if "UNREAD" in m["labelIds"]),
+            "threadsTotal": len({m["threadId"] for m in in_label}),
+        }
+
+    def _get(self, path: str, query: Dict):
+        if path.endswith("/users/me/messages"):
+            return 200, self._list(query)
+        m = re.search(r"/users/me/messages/([0-9a-f]+)$", path)
+        if m:
+            msg = self._message(m.group(1), query.get("format", "metadata"))
+            return (200, msg) if msg else (404, {"error": {"code": 404, "message": "Not Found"}})
+        if path.endswith("/users/me/threads"):
+            return 200, self._list_threads(query)
+        m = re.search(r"/users/me/threads/([0-9a-f]+)$", path)
+        if m:
+            thread = self._get_thread(m.group(1))
+            return (200, thread) if thread else (404, {"error": {"code": 404, "message": "Not Found"}})
+        if path.endswith("/users/me/labels"):
+            return 200, {"labels": [{"id": lid, "name": name, "type": "user" if lid.startswith("Label_") else "system"}
+                                    for lid, name in self.labels.items()]}
+        m = re.search(r"/users/me/labels/([^/]+)$", path)
+        if m:
+            label = self._label(m.group(1))
+            return (200, label) if label else (404, {"error": {"code": 404, "message": "Not Found"}})
+        if path.endswith("/users/me/history"):
+            start = int(query.get("startHistoryId") or 0)
+            if start and start < self.history_id - 100000:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            return 200, {"history": [], "historyId": str(self.history_id)}
+        if path.endswith("/users/me/profile"):
+            return 200, {"emailAddress": "bench@example.com", "messagesTotal": len(self.messages),
+                         "historyId": str(self.history_id)}
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+    @staticmethod
+    def _masked(status: int, payload, query: Dict):
+        """Apply a `fields` partial-response mask to a successful response"""
+        if status == 200 and query.get("fields"):
+            return status, apply_fields(payload, query["fields"])
+        return status, payload
+
+    def _batch(self, headers: Dict, body: bytes):
+        content_type = headers.get("Content-Type") or headers.get("content-type") or ""
+        boundary = content_type.split("boundary=")[-1].strip('"')
+        out_boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in body.decode().split(f"--{boundary}"):
+            part = part.strip()
+            if not part or part == "--":
+                continue
+            outer, _, http = part.replace("\r\n", "\n").partition("\n\n")
+            cid = ""
+            for line in outer.split("\n"):
+                if line.lower().startswith("content-id:"):
+                    cid = line.split(":", 1)[1].strip().strip("<>")
+            request_line = http.split("\n", 1)[0].strip()
+            method, target = request_line.split(" ", 1)
+            target = target.split(" ", 1)[0]
+            split = urlsplit(target)
+            part_query = dict(parse_qsl(split.query))
+            status, payload = self._masked(*self._get(split.path, part_query), part_query)
+            parts.append(
+                f"--{out_boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{cid}>\r\n\r\n"
+                f"HTTP/1.1 {status} OK\r\nContent-Type: application/json\r\n\r\n{json.dumps(payload)}\r\n"
+            )
+        parts.append(f"--{out_boundary}--")
+        return 200, "".join(parts), {"Content-Type": f"multipart/mixed; boundary={out_boundary}"}
+
+    def handle(self, method, path, query, headers, body):
+        q = dict(query)
+        if method == "GET":
+            status, payload = self._masked(*self._get(path, q), q)
+            return status, payload, {}
+        if method == "POST" and path.startswith("/batch/gmail"):
+            return self._batch(headers, body)
+        if method == "POST" and path.endswith("/users/me/watch"):
+            expiration = int((time.time() + 7 * 86400) * 1000)
+            return (*self._masked(200, {"historyId": str(self.history_id), "expiration": str(expiration)}, q), {})
+        return 404, {"error": {"code": 404, "message": "Not Found"}}, {}
+
+
+class PushStandIn:
+    """Plays Pub/Sub for POST /gmail/push: wraps Gmail notifications in push envelopes, HMAC-signed"""
+
+    def __init__(self, url: str, secret: str, subscription: str = "projects/bench/subscriptions/gmail-push"):
+        self.url = url
+        self.secret = secret
+        self.subscription = subscription
+        self.session = requests.Session()
+
+    def envelope(self, email_address: str, history_id: int) -> bytes:
+        data = json.dumps({"emailAddress": email_address, "historyId": history_id}).encode()
+        return json.dumps({
+            "message": {
+                "data": base64.b64encode(data).decode(),
+                "messageId": uuid.uuid4().hex,
+                "publishTime": datetime.now(timezone.utc).isoformat(),
+            },
+            "subscription": self.subscription,
+        }).encode()
+
+    def push(self, email_address: str, history_id: int) -> int:
+        """Deliver one notification; returns the HTTP status the app answered with"""
+        from gmail_watch import SIGNATURE_HEADER, sign
+        body = self.envelope(email_address, history_id)
+        r = self.session.post(self.url, data=body, timeout=10, headers={
+            "Content-Type": "application/json", SIGNATURE_HEADER: sign(self.secret, body)})
+        return r.status_code
+
+
+# --- Supabase / PostgREST ---
+
+def _parse_value(raw: str):
+    if raw.startswith('"') and raw.endswith('"'):
+        return raw[1:-1]
+    return raw
+
+
+def _split_in_list(raw: str) -> List[str]:
+    raw = raw.strip()[1:-1]  # strip ( )
+    values, current, quoted = [], "", False
+    for ch in raw:
+        if ch == '"':
+            quoted = not quoted
+        elif ch == "," and not quoted:
+            values.append(current)
+            current = ""
+        else:
+            current += ch
+    if current or raw:
+        values.append(current)
+    return values
+
+
+def _compare(value, op: str, raw: str) -> bool:
+    if op == "is":
+        return value is None if raw == "null" else str(value).lower() == raw
+    if value is None:
+        return op == "neq"
+    if op == "in":
+        return str(value) in _split_in_list(raw)
+    target = _parse_value(raw)
+    if isinstance(value, bool):
+        value = str(value).lower()
+    elif isinstance(value, (int, float)):
+        try:
+            target = type(value)(target)
+        except ValueError:
+            value = str(value)
+    else:
+        value = str(value)
+    return {
+        "eq": value == target, "neq": value != target, "lt": value < target, "lte": value <= target,
+        "gt": value > target, "gte": value >= target,
+        "like": re.fullmatch(str(target).replace("%", ".*"), str(value)) is not None,
+        "ilike": re.fullmatch(str(target).replace("%", ".*"), str(value), re.I) is not None,
+    }[op]
+
+
+def _add_counts(a: Dict, b: Dict) -> Dict:
+    out = dict(a or {})
+    for key, n in (b or {}).items():
+        out[key] = out.get(key, 0) + n
+    return {key: n for key, n in out.items() if n > 0}
+
+
+class FakePostgrest(FakeServer):
+    """In-memory PostgREST subset behind /rest/v1/<table> and /rest/v1/rpc/<function>,
+    as used through the supabase client. The functions mirror supabase_schema.sql."""
+
+    name = "fake-postgrest"
+    RESERVED = {"select", "order", "limit", "offset", "on_conflict", "columns"}
+    # Column defaults the schema fills in on insert (e.g. `created_at ... default now()`)
+    DEFAULTS = {"email_changes": lambda: {"created_at": datetime.now(timezone.utc).isoformat()}}
+
+    def __init__(self, faults: Optional[FaultProfile] = None):
+        super().__init__(faults)
+        self.tables: Dict[str, List[Dict]] = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def seed(self, table: str, rows: List[Dict]):
+        with self._lock:
+            for row in rows:
+                self.tables.setdefault(table, []).append({"id": self._next_id, **row})
+                self._next_id += 1
+
+    def _filters(self, query):
+        filters = []
+        for key, raw in query:
+            if key in self.RESERVED or "." not in raw:
+                continue
+            op, _, val = raw.partition(".")
+            negate = False
+            if op == "not":
+                negate = True
+                op, _, val = val.partition(".")
+            filters.append((key, op, val, negate))
+        return filters
+
+    def _matching(self, rows, query):
+        filters = self._filters(query)
+        return [r for r in rows if all(_compare(r.get(k), op, v) != neg for k, op, v, neg in filters)]
+
+    def _project(self, rows, query):
+        select = dict(query).get("select", "*")
+        if select in ("*", ""):
+            return [dict(r) for r in rows]
+        cols = [c.strip() for c in select.split(",")]
+        return [{c: r.get(c) for c in cols} for r in rows]
+
+    def _apply_sender_deltas(self, args: Dict):
+        rollups = self.tables.setdefault("sender_rollups", [])
+        user_id = args["p_user_id"]
+        for d in args["p_deltas"]:
+            row = next((r for r in rollups if r["user_id"] == user_id and r["sender"] == d["sender"]), None)
+            if row is None:
+                row = {"user_id": user_id, "sender": d["sender"], "email_count": 0, "last_seen": None,
+                       "keywords": {}, "daily_counts": {}}
+                rollups.append(row)
+            row["email_count"] = max(row["email_count"] + d["count"], 0)
+            row["last_seen"] = max(filter(None, (row["last_seen"], d.get("last_seen"))), default=None)
+            row["keywords"] = _add_counts(row["keywords"], d.get("keywords"))
+            row["daily_counts"] = _add_counts(row["daily_counts"], d.get("days"))
+            if d["count"] < 0:
+                dates = [e["date"] for e in self.tables.get("emails", [])
+                         if e["user_id"] == user_id and (e.get("from_email") or "").strip() == d["sender"] and e.get("date")]
+                row["last_seen"] = max(dates, default=None)
+        rollups[:] = [r for r in rollups if not (r["user_id"] == user_id and r["email_count"] <= 0)]
+
+    def _set_sender_keyword(self, args: Dict):
+        keyword, counts = args["p_keyword"], args["p_counts"]
+        for row in self.tables.get("sender_rollups", []):
+            if row["user_id"] != args["p_user_id"]:
+                continue
+            row["keywords"] = {k: n for k, n in row["keywords"].items() if k != keyword}
+            if row["sender"] in counts:
+                row["keywords"][keyword] = counts[row["sender"]]
+
+    def _email_changes_since(self, args: Dict) -> List[Dict]:
+        settled_before = (datetime.now(timezone.utc) - timedelta(seconds=args["p_settle_seconds"])).isoformat()
+        rows = [r for r in self.tables.get("email_changes", [])
+                if r["user_id"] == args["p_user_id"] and r["id"] > args["p_after"] and r["created_at"] < settled_before]
+        return [dict(r) for r in sorted(rows, key=lambda r: r["id"])[:args["p_limit"]]]
+
+    def _prune_email_changes(self, args: Dict) -> int:
+        user_id = args["p_user_id"]
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=args["p_retention_seconds"])).isoformat()
+        changes = self.tables.setdefault("email_changes", [])
+        pruned = [r["id"] for r in changes if r["user_id"] == user_id and r["created_at"] < cutoff]
+        if pruned:
+            changes[:] = [r for r in changes if not (r["user_id"] == user_id and r["created_at"] < cutoff)]
+            horizons = self.tables.setdefault("email_change_horizons", [])
+            row = next((r for r in horizons if r["user_id"] == user_id), None)
+            if row is None:
+                horizons.append({"user_id": user_id, "pruned_through": max(pruned)})
+            else:
+                row["pruned_through"] = max(row["pruned_through"], max(pruned))
+        return len(pruned)
+
+    def handle(self, method, path, query, headers, body):
+        rpc = re.match(r"^/rest/v1/rpc/([A-Za-z0-9_]+)$", path)
+        if rpc and method == "POST":
+            function = {"apply_sender_deltas": self._apply_sender_deltas,
+                        "set_sender_keyword": self._set_sender_keyword,
+                        "email_changes_since": self._email_changes_since,
+                        "prune_email_changes": self._prune_email_changes}.get(rpc.group(1))
+            if function is None:
+                return 404, {"code": "PGRST202", "message": f"Could not find the function {rpc.group(1)}"}, {}
+            with self._lock:
+                result = function(json.loads(body or b"{}"))
+            return (204, None, {}) if result is None else (200, result, {})
+        m = re.match(r"^/rest/v1/([A-Za-z0-9_]+)$", path)
+        if not m:
+            return 404, {"message": "not found"}, {}
+        table = m.group(1)
+        prefer = headers.get("Prefer") or headers.get("prefer") or ""
+        accept = headers.get("Accept") or headers.get("accept") or ""
+        qd = {}
+        for k, v in query:
+            qd[k] = v  # later values win (e.g. limit(1).range(...))
+
+        with self._lock:
+            rows = self.tables.setdefault(table, [])
+
+            if method == "GET":
+                result = self._matching(rows, query)
+                for spec in reversed((qd.get("order") or "").split(",")):
+                    if not spec:
+                        continue
+                    col, _, direction = spec.partition(".")
+                    desc = direction.startswith("desc")
+                    present = [r for r in result if r.get(col) is not None]
+                    missing = [r for r in result if r.get(col) is None]
+                    present.sort(key=lambda r: r[col], reverse=desc)
+                    result = present + missing
+                total = len(result)
+                offset = int(qd.get("offset") or 0)
+                limit = int(qd["limit"]) if "limit" in qd else None
+                result = result[offset:offset + limit if limit is not None else None]
+                result = self._project(result, query)
+                extra = {}
+                if "count=" in prefer:
+                    end = offset + len(result) - 1
+                    extra["Content-Range"] = f"{offset}-{end}/{total}" if result else f"*/{total}"
+                if "vnd.pgrst.object" in accept:
+                    if len(result) != 1:
+                        return 406, {"code": "PGRST116", "message": "JSON object requested, multiple (or no) rows returned",
+                                     "details": f"The result contains {len(result)} rows", "hint": None}, {}
+                    return 200, result[0], extra
+                return 200, result, extra
+
+            if method == "POST":
+                payload = json.loads(body or b"[]")
+                payload = payload if isinstance(payload, list) else [payload]
+                conflict = [c for c in (qd.get("on_conflict") or "").split(",") if c]
+                merge = "resolution=merge-duplicates" in prefer
+                ignore = "resolution=ignore-duplicates" in prefer
+                written = []
+                for item in payload:
+                    existing = None
+                    if (merge or ignore) and conflict:
+                        existing = next((r for r in rows if all(r.get(c) == item.get(c) for c in conflict)), None)
+                    if existing is not None:
+                        if ignore:
+                            continue
+                        existing.update(item)
+                        written.append(dict(existing))
+                    else:
+                        row = {"id": self._next_id, **self.DEFAULTS.get(table, dict)(), **item}
+                        self._next_id += 1
+                        rows.append(row)
+                        written.append(dict(row))
+                return 201, (self._project(written, query) if "return=representation" in prefer else None), {}
+
+            if method == "PATCH":
+                patch = json.loads(body or b"{}")
+                matched = self._matching(rows, query)
+                for r in matched:
+                    r.update(patch)
+                return 200, ([dict(r) for r in matched] if "return=representation" in prefer else None), {}
+
+            if method == "DELETE":
+                matched = self._matching(rows, query)
+                ids = {id(r) for r in matched}
+                self.tables[table] = [r for r in rows if id(r) not in ids]
+                return 200, ([dict(r) for r in matched] if "return=representation" in prefer else None), {}
+
+        return 405, {"message": "method not allowed"}, {}
+
+
+# --- Hugging Face inference ---
+
+class FakeHuggingFace(FakeServer):
+    """Summarization endpoint: returns the first sentence of the input as summary_text"""
+
+    name = "fake-hf"
+
+    def handle(self, method, path, query, headers, body):
+        if method != "POST":
+            return 405, {"error": "method not allowed"}, {}
+        inputs = json.loads(body or b"{}").get("inputs", "")
+        text = inputs.split("\n\n", 1)[-1]
+        return 200, [{"summary_text": text[:120]}], {}
@@ -0,0 +1,305 @@
+# bench/run.py
+"""End-to-end benchmarks for MailPilot's hot paths against local fakes.
+
+Usage (from backend/):
+    python -m bench.run --scenario sync --scenario dashboard --concurrency 8 --requests 200
+    python -m bench.run --gmail-latency-ms 40 --gmail-error-rate 0.02 --compare bench/results/<old>.json
+
+Results are written as JSON to bench/results/ (one file per run, named by time
+and git commit) so runs from different commits can be compared with --compare.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from bench.fakes import FakeGmail, FakeHuggingFace, FakePostgrest, FaultProfile
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+SCENARIOS = ["sync", "dashboard", "summaries"]
+
+# supabase-py only checks that the key looks like a JWT
+FAKE_SUPABASE_KEY = "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9.eyJyb2xlIjoiYW5vbiJ9.bench"
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, wall: float) -> Dict:
+    ordered = sorted(latencies)
+    ms = lambda s: round(s * 1000, 3)
+    return {
+        "operations": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "throughput_ops": round(len(latencies) / wall, 2) if wall else 0.0,
+        "mean_ms": ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+        "p50_ms": ms(percentile(ordered, 50)),
+        "p95_ms": ms(percentile(ordered, 95)),
+        "p99_ms": ms(percentile(ordered, 99)),
+        "max_ms": ms(ordered[-1]) if ordered else 0.0,
+    }
+
+
+def run_load(operation: Callable[[int], bool], requests: int, concurrency: int) -> Dict:
+    """Run operation(i) `requests` times across `concurrency` threads; it returns True on success"""
+    latencies: List[float] = [0.0] * requests
+    failed = [False] * requests
+
+    def one(i: int):
+        start = time.perf_counter()
+        try:
+            ok = operation(i)
+        except Exception:
+            ok = False
+        latencies[i] = time.perf_counter() - start
+        failed[i] = not ok
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    return summarize(latencies, sum(failed), time.perf_counter() - started)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(RESULTS_DIR)).decode().strip()
+    except Exception:
+        return None
+
+
+class Environment:
+    """Starts the fakes, points main.py at them and imports it"""
+
+    def __init__(self, args):
+        self.gmail = FakeGmail(
+            mailbox_size=args.mailbox_size,
+            faults=FaultProfile(args.gmail_latency_ms, args.gmail_jitter_ms, args.gmail_error_rate,
+                                error_status=args.gmail_error_status, seed=1),
+        ).start()
+        self.postgrest = FakePostgrest(
+            faults=FaultProfile(args.supabase_latency_ms, args.supabase_jitter_ms, args.supabase_error_rate, seed=2),
+        ).start()
+        self.hf = FakeHuggingFace(
+            faults=FaultProfile(args.hf_latency_ms, args.hf_jitter_ms, args.hf_error_rate, seed=3),
+        ).start()
+        self.state_dir = tempfile.mkdtemp(prefix="mailpilot-bench-")
+
+        os.environ.update({
+            "CLIENT_ID": "bench-client",
+            "CLIENT_SECRET": "bench-secret",
+            "REDIRECT_URI": "http://127.0.0.1:8000/oauth2callback",
+            "SUPABASE_URL": self.postgrest.url,
+            "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+            "GMAIL_API_BASE": self.gmail.url,
+            "HUGGINGFACE_API_URL": f"{self.hf.url}/models/facebook/bart-large-cnn",
+            "MAILPILOT_STATE_DIR": self.state_dir,
+        })
+        os.environ.pop("RECAPTCHA_SECRET_KEY", None)
+
+        import main
+        self.main = main
+
+    def login(self, user_id: str) -> Dict[str, str]:
+        """Sign a user in; returns the headers that authenticate their requests"""
+        self.main.user_tokens[user_id] = {
+            "access_token": f"bench-token-{user_id}",
+            "refresh_token": "bench-refresh",
+            "expires_at": None,
+            "scopes": self.main.SCOPES,
+        }
+        return {"Authorization": f"Bearer {self.main.sessions.create(user_id)}"}
+
+    def link(self, owner: str, account: str):
+        """Link another fake Gmail account to a logged-in user"""
+        self.main.linked_accounts.link(owner, account, {
+            "access_token": f"bench-token-{account}",
+            "refresh_token": "bench-refresh",
+            "expires_at": None,
+            "scopes": self.main.SCOPES,
+        })
+
+    def seed_emails(self, user_id: str, count: int) -> List[str]:
+        """Store the newest `count` fake Gmail messages for a user, as a sync would"""
+        rows = []
+        for mid in self.gmail.order[:count]:
+            msg = self.gmail.messages[mid]
+            headers = {h["name"]: h["value"] for h in msg["payload"]["headers"]}
+            rows.append({
+                "message_id": mid,
+                "from_email": headers["From"].split("<")[0].strip(),
+                "subject": headers["Subject"],
+                "date": datetime.fromtimestamp(int(msg["internalDate"]) / 1000, tz=timezone.utc).isoformat(),
+                "snippet": msg["snippet"],
+                "summary": None,
+                "user_id": user_id,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            })
+        self.postgrest.seed("emails", rows)
+        return [r["message_id"] for r in rows]
+
+    def upstream_stats(self) -> Dict:
+        return {"gmail": self.gmail.stats(), "supabase": self.postgrest.stats(), "huggingface": self.hf.stats()}
+
+    def reset_stats(self):
+        for fake in (self.gmail, self.postgrest, self.hf):
+            fake.reset_stats()
+
+    def close(self):
+        for fake in (self.gmail, self.postgrest, self.hf):
+            fake.stop()
+
+
+def scenario_sync(env: Environment, args) -> Dict:
+    """sync_emails_from_gmail for args.users distinct users, round-robin (all their accounts with --accounts)"""
+    users = [f"sync-user-{i}@bench.local" for i in range(args.users)]
+    for i, u in enumerate(users):
+        env.login(u)
+        for j in range(1, args.accounts):
+            env.link(u, f"sync-user-{i}-{j}@bench.local")
+
+    def op(i: int) -> bool:
+        user_id = users[i % len(users)]
+        accounts = list(env.main.account_tokens(user_id))
+        if args.cold:
+            for account in accounts:
+                env.main.metadata_cache.clear_user(account)
+        if len(accounts) == 1:
+            result = env.main.sync_emails_from_gmail(f"bench-token-{user_id}", user_id)
+        else:
+            result = env.main.sync_accounts(user_id, {a: f"bench-token-{a}" for a in accounts})
+        return "error" not in result
+
+    return run_load(op, args.requests, args.concurrency)
+
+
+def scenario_dashboard(env: Environment, args) -> Dict:
+    """GET /dashboard through the ASGI app for a user with a populated mailbox"""
+    from fastapi.testclient import TestClient
+
+    user_id = "dashboard-user@bench.local"
+    headers = env.login(user_id)
+    env.seed_emails(user_id, min(args.mailbox_size, env.main.MAX_EMAILS_PER_USER))
+    env.postgrest.seed("keywords", [{"user_id": user_id, "keyword": k} for k in ("invoice", "security", "deadline")])
+    client = TestClient(env.main.app)
+
+    def op(i: int) -> bool:
+        return client.get("/dashboard", headers=headers).status_code == 200
+
+    return run_load(op, args.requests, args.concurrency)
+
+
+def scenario_summaries(env: Environment, args) -> Dict:
+    """generate_summaries_in_background over batches of stored emails"""
+    user_id = "summary-user@bench.local"
+    ids = env.seed_emails(user_id, min(args.mailbox_size, env.main.MAX_EMAILS_PER_USER))
+    batch = args.summary_batch
+
+    def op(i: int) -> bool:
+        start = (i * batch) % max(len(ids), 1)
+        env.main.generate_summaries_in_background(user_id, ids[start:start + batch])
+        return True
+
+    return run_load(op, args.requests, args.concurrency)
+
+
+SCENARIO_FUNCS = {"sync": scenario_sync, "dashboard": scenario_dashboard, "summaries": scenario_summaries}
+
+
+def compare(current: Dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} (commit {baseline['meta'].get('commit')}):")
+    for name, stats in current["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for key in ("throughput_ops", "p50_ms", "p95_ms", "p99_ms"):
+            before, after = old["latency"][key], stats["latency"][key]
+            change = ((after - before) / before * 100) if before else 0.0
+            print(f"  {name:10s} {key:15s} {before:10.2f} -> {after:10.2f} ({change:+.1f}%)")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="MailPilot end-to-end benchmarks against local fakes")
+    p.add_argument("--scenario", action="append", choices=SCENARIOS, help="scenario to run (repeatable; default: all)")
+    p.add_argument("--requests", type=int, default=100, help="operations per scenario")
+    p.add_argument("--concurrency", type=int, default=4, help="concurrent callers")
+    p.add_argument("--users", type=int, default=4, help="distinct users for the sync scenario")
+    p.add_argument("--accounts", type=int, default=1, help="Gmail accounts per user for the sync scenario")
+    p.add_argument("--mailbox-size", type=int, default=500, help="messages in the fake Gmail mailbox")
+    p.add_argument("--summary-batch", type=int, default=10, help="emails per summaries operation")
+    p.add_argument("--cold", action="store_true", help="clear the metadata cache before every sync")
+    for dep, latency in (("gmail", 20.0), ("supabase", 5.0), ("hf", 150.0)):
+        p.add_argument(f"--{dep}-latency-ms", type=float, default=latency)
+        p.add_argument(f"--{dep}-jitter-ms", type=float, default=latency / 4)
+        p.add_argument(f"--{dep}-error-rate", type=float, default=0.0)
+    p.add_argument("--gmail-error-status", type=int, default=503,
+                   help="status of injected Gmail failures (429 simulates quota throttling)")
+    p.add_argument("--output", help="result file (default: bench/results/<time>-<commit>.json)")
+    p.add_argument("--compare", help="earlier result file to compare against")
+    p.add_argument("--log-level", default="WARNING")
+    return p.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.getLogger().setLevel(args.log_level)
+
+    env = Environment(args)
+    # main.py configures logging on import, so apply the level again afterwards
+    logging.getLogger().setLevel(args.log_level)
+    for name in ("httpx", "main"):
+        logging.getLogger(name).setLevel(args.log_level)
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in args.scenario or SCENARIOS:
+            env.reset_stats()
+            latency = SCENARIO_FUNCS[name](env, args)
+            results["scenarios"][name] = {"latency": latency, "upstream": env.upstream_stats()}
+            print(f"{name:10s} ops={latency['operations']:5d} err={latency['errors']:4d} "
+                  f"thr={latency['throughput_ops']:8.2f}/s p50={latency['p50_ms']:8.2f}ms "
+                  f"p95={latency['p95_ms']:8.2f}ms p99={latency['p99_ms']:8.2f}ms")
+    finally:
+        env.close()
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{results['meta']['commit'] or 'nogit'}.json")
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+# bench/startup.py
+"""Cold-start benchmark: time to import main.py and time to the first /healthz response.
+
+Usage (from backend/):
+    python -m bench.startup --runs 5
+
+Every run uses a fresh interpreter, so nothing is shared between runs. Both
+timings include interpreter start-up, which is reported separately as the
+baseline.
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from typing import Dict, List
+
+from bench.run import FAKE_SUPABASE_KEY
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def bench_env(state_dir: str) -> Dict[str, str]:
+    # Nothing listens on these URLs; startup must not need Supabase or Google
+    env = dict(os.environ)
+    env.update({
+        "CLIENT_ID": "bench-client",
+        "CLIENT_SECRET": "bench-secret",
+        "REDIRECT_URI": "http://127.0.0.1:8000/oauth2callback",
+        "SUPABASE_URL": "http://127.0.0.1:9",
+        "SUPABASE_KEY": FAKE_SUPABASE_KEY,
+        "MAILPILOT_STATE_DIR": state_dir,
+    })
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_interpreter(env) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"], env=env, cwd=BACKEND_DIR, check=True)
+    return time.perf_counter() - start
+
+
+def time_import(env) -> float:
+    out = subprocess.run([sys.executable, "-c", IMPORT_SNIPPET], env=env, cwd=BACKEND_DIR,
+                         check=True, capture_output=True, text=True)
+    return float(out.stdout.strip().splitlines()[-1])
+
+
+def time_first_healthz(env, timeout: float = 30.0) -> float:
+    """Seconds from spawning uvicorn until /healthz first answers 200"""
+    port = free_port()
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, cwd=BACKEND_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with code {proc.returncode}")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1) as r:
+                    if r.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError("timed out waiting for /healthz")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def stats(values: List[float]) -> Dict:
+    ms = lambda s: round(s * 1000, 1)
+    return {"min_ms": ms(min(values)), "median_ms": ms(statistics.median(values)), "max_ms": ms(max(values))}
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description="MailPilot cold-start benchmark")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--output", help="write results as JSON to this file")
+    args = p.parse_args(argv)
+
+    env = bench_env(tempfile.mkdtemp(prefix="mailpilot-startup-"))
+    results = {
+        "interpreter": stats([time_interpreter(env) for _ in range(args.runs)]),
+        "import_main": stats([time_import(env) for _ in range(args.runs)]),
+        "first_healthz": stats([time_first_healthz(env) for _ in range(args.runs)]),
+    }
+    for name, s in results.items():
+        print(f"{name:14s} min={s['min_ms']:8.1f}ms median={s['median_ms']:8.1f}ms max={s['max_ms']:8.1f}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"runs": args.runs, "results": results}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,152 @@
+# change_log.py
+"""Per-user email change log behind GET /emails/changes (delta sync for clients)."""
+import base64
+import binascii
+import json
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+CHANGES_TABLE = "email_changes"
+HORIZONS_TABLE = "email_change_horizons"
+CHANGES_SINCE_RPC = "email_changes_since"
+PRUNE_RPC = "prune_email_changes"
+EMAIL_FIELDS = "message_id,from_email,subject,date,snippet,summary"
+
+OP_INSERT = "insert"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(change_id: int) -> str:
+    raw = json.dumps({"i": change_id}, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """Last change id a cursor has seen (cursors from older releases also carry a timestamp)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(padded.encode()))["i"])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise InvalidCursor("Malformed cursor")
+
+
+class ChangeLog:
+    """Append-only log of inserts, summary updates and deletes per user.
+
+    Rows carry a table-wide identity id, so a user's changes are ordered by id;
+    the cursor is the last id a client has seen. Pruning records the highest id
+    it dropped per user, and a cursor below that has missed changes, so its
+    client has to start over. Timestamps come from the database clock only.
+    """
+
+    def __init__(self, client, retention_days: int = 14, settle_seconds: float = 2.0):
+        self.client = client
+        self.retention = timedelta(days=retention_days)
+        # Identity ids are handed out before commit, so a just-written row with a lower id can
+        # still appear after a higher one; reads stop short of the newest rows to not skip it
+        self.settle = timedelta(seconds=settle_seconds)
+
+    def record(self, user_id: str, op: str, message_ids: Iterable[str]):
+        # created_at defaults to the database's now(), the clock the settle window is measured on
+        rows = [{"user_id": user_id, "message_id": mid, "op": op} for mid in message_ids]
+        if not rows:
+            return
+        try:
+            self.client.table(CHANGES_TABLE).insert(rows).execute()
+        except Exception as e:
+            logger.error(f"[CHANGES] Could not record {len(rows)} {op} changes for {user_id}: {e}")
+
+    def head(self, user_id: str) -> str:
+        """Cursor positioned after the newest change, for clients that have just loaded everything"""
+        result = (
+            self.client.table(CHANGES_TABLE)
+            .select("id")
+            .eq("user_id", user_id)
+            .order("id", desc=True)
+            .limit(1)
+            .execute()
+        )
+        # With every change pruned, the cursor starts at the horizon so it does not read as expired
+        return encode_cursor(result.data[0]["id"] if result.data else self._pruned_through(user_id))
+
+    def _pruned_through(self, user_id: str) -> int:
+        """Highest change id pruned for the user (0 if none was)"""
+        result = self.client.table(HORIZONS_TABLE).select("pruned_through").eq("user_id", user_id).execute()
+        return result.data[0]["pruned_through"] if result.data else 0
+
+    def changes_since(self, user_id: str, cursor: str, limit: int) -> Dict:
+        """One page of changes after `cursor`, collapsed to the latest operation per message"""
+        after = decode_cursor(cursor)
+        if after < self._pruned_through(user_id):
+            # Changes after the cursor were pruned; the client has to reload in full
+            return {"changes": [], "cursor": self.head(user_id), "has_more": False, "reset": True}
+
+        result = self.client.rpc(CHANGES_SINCE_RPC, {
+            "p_user_id": user_id,
+            "p_after": after,
+            "p_limit": limit + 1,
+            "p_settle_seconds": self.settle.total_seconds(),
+        }).execute()
+        rows = result.data or []
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if not rows:
+            return {"changes": [], "cursor": cursor, "has_more": False, "reset": False}
+
+        # Latest operation per message; an insert followed by updates is still an insert
+        ops: Dict[str, str] = {}
+        for row in rows:
+            previous = ops.get(row["message_id"])
+            if row["op"] == OP_UPDATE and previous == OP_INSERT:
+                continue
+            ops[row["message_id"]] = row["op"]
+
+        live = [mid for mid, op in ops.items() if op != OP_DELETE]
+        emails = self._emails(user_id, live)
+        changes = []
+        for mid, op in ops.items():
+            if op == OP_DELETE:
+                changes.append({"op": op, "message_id": mid})
+            elif mid in emails:
+                changes.append({"op": op, "message_id": mid, "email": emails[mid]})
+            # A message missing from the table was deleted later; that delete is in a later page
+
+        last = rows[-1]
+        return {
+            "changes": changes,
+            "cursor": encode_cursor(last["id"]),
+            "has_more": has_more,
+            "reset": False,
+        }
+
+    def _emails(self, user_id: str, message_ids: List[str]) -> Dict[str, Dict]:
+        if not message_ids:
+            return {}
+        result = (
+            self.client.table("emails")
+            .select(EMAIL_FIELDS)
+            .eq("user_id", user_id)
+            .in_("message_id", message_ids)
+            .execute()
+        )
+        return {row["message_id"]: row for row in result.data or []}
+
+    def prune(self, user_id: str) -> int:
+        """Drop a user's changes older than the retention window and move their horizon past them"""
+        try:
+            result = self.client.rpc(PRUNE_RPC, {
+                "p_user_id": user_id,
+                "p_retention_seconds": self.retention.total_seconds(),
+            }).execute()
+            return result.data or 0
+        except Exception as e:
+            logger.warning(f"[CHANGES] Prune failed for {user_id}: {e}")
+            return 0
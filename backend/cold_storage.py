@@ -0,0 +1,282 @@
+# cold_storage.py
+"""Local cold tier for emails trimmed out of the hot Supabase table.
+
+Each user has a directory of append-only segment files holding zlib-compressed
+blocks of JSON lines, plus index.jsonl. The index has one line per block with:
+- its offset and length
+- its date range
+- a small bloom filter of its message IDs
+
+Readers use the index to skip blocks. They memory-map segments and decompress
+only the blocks a query needs. A block is written and synced before its index
+line, so a crash between the two leaves unreferenced bytes rather than a
+broken index.
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import threading
+import zlib
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not on Windows; appends are then only serialized within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.jsonl"
+BLOCK_ROWS = 256
+SEGMENT_MAX_BYTES = 8 * 1024 * 1024
+BLOOM_BITS_PER_ID = 10
+BLOOM_HASHES = 4
+# Columns that describe the row's place in the hot table rather than the email
+DROPPED_COLUMNS = ("id", "user_id")
+
+
+def email_timestamp(date_value: Optional[str]) -> float:
+    """Epoch seconds of a stored ISO date (0 when missing or unparseable)"""
+    if not date_value:
+        return 0.0
+    try:
+        parsed = datetime.fromisoformat(date_value.replace("Z", "+00:00"))
+    except ValueError:
+        return 0.0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def _bloom_positions(message_id: str, size_bits: int) -> List[int]:
+    digest = hashlib.sha1(message_id.encode()).digest()
+    return [int.from_bytes(digest[i * 4:i * 4 + 4], "big") % size_bits for i in range(BLOOM_HASHES)]
+
+
+def _bloom(message_ids: List[str]) -> bytes:
+    size_bits = max(64, len(message_ids) * BLOOM_BITS_PER_ID)
+    bits = bytearray((size_bits + 7) // 8)
+    for mid in message_ids:
+        for pos in _bloom_positions(mid, len(bits) * 8):
+            bits[pos // 8] |= 1 << (pos % 8)
+    return bytes(bits)
+
+
+def _bloom_may_contain(bits: bytes, message_id: str) -> bool:
+    return all(bits[pos // 8] & (1 << (pos % 8)) for pos in _bloom_positions(message_id, len(bits) * 8))
+
+
+class _UserIndex:
+    """Parsed index.jsonl of one user, reloaded when the file grows"""
+
+    __slots__ = ("size", "blocks")
+
+    def __init__(self, size: int, blocks: List[Dict]):
+        self.size = size
+        self.blocks = blocks
+
+
+class ColdStore:
+    """Append-only per-user archive of evicted emails, readable without loading it whole"""
+
+    def __init__(self, directory: str, max_open_segments: int = 64, max_cached_indexes: int = 1000):
+        self.directory = directory
+        self.max_open_segments = max_open_segments
+        self.max_cached_indexes = max_cached_indexes
+        self._indexes: "OrderedDict[str, _UserIndex]" = OrderedDict()
+        self._maps: "OrderedDict[str, mmap.mmap]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._append_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _user_dir(self, user_id: str) -> str:
+        # User IDs are email addresses; keep them out of file names
+        return os.path.join(self.directory, hashlib.sha1(user_id.encode()).hexdigest()[:20])
+
+    # --- Writing ---
+
+    def append(self, user_id: str, rows: List[Dict]) -> int:
+        """Archive rows (newest first within each block); returns how many were written"""
+        if not rows:
+            return 0
+        user_dir = self._user_dir(user_id)
+        os.makedirs(user_dir, exist_ok=True)
+        records = [{k: v for k, v in row.items() if k not in DROPPED_COLUMNS} for row in rows]
+        records.sort(key=lambda r: email_timestamp(r.get("date")), reverse=True)
+
+        with self._append_lock, open(os.path.join(user_dir, ".lock"), "a") as lock_file:
+            if fcntl is not None:
+                # Other workers on this host may trim the same user
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            segment = self._active_segment(user_dir)
+            index_lines = []
+            for start in range(0, len(records), BLOCK_ROWS):
+                block = records[start:start + BLOCK_ROWS]
+                payload = zlib.compress(
+                    "\n".join(json.dumps(r, separators=(",", ":")) for r in block).encode(), 6)
+                path = os.path.join(user_dir, segment)
+                with open(path, "ab") as f:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(payload)
+                    f.flush()
+                    os.fsync(f.fileno())
+                timestamps = [email_timestamp(r.get("date")) for r in block]
+                index_lines.append(json.dumps({
+                    "s": segment, "o": offset, "n": len(payload), "c": len(block),
+                    "lo": min(timestamps), "hi": max(timestamps), "crc": zlib.crc32(payload),
+                    "bloom": b64encode(_bloom([r["message_id"] for r in block])).decode(),
+                }, separators=(",", ":")))
+                if offset + len(payload) >= SEGMENT_MAX_BYTES:
+                    segment = self._next_segment(segment)
+            with open(os.path.join(user_dir, INDEX_FILE), "a") as f:
+                f.write("".join(line + "\n" for line in index_lines))
+                f.flush()
+                os.fsync(f.fileno())
+        return len(records)
+
+    def _active_segment(self, user_dir: str) -> str:
+        segments = sorted(name for name in os.listdir(user_dir) if name.startswith("seg-"))
+        if not segments:
+            return "seg-000001.zl"
+        last = segments[-1]
+        if os.path.getsize(os.path.join(user_dir, last)) >= SEGMENT_MAX_BYTES:
+            return self._next_segment(last)
+        return last
+
+    @staticmethod
+    def _next_segment(name: str) -> str:
+        return f"seg-{int(name[4:10]) + 1:06d}.zl"
+
+    # --- Reading ---
+
+    def _index(self, user_id: str) -> List[Dict]:
+        path = os.path.join(self._user_dir(user_id), INDEX_FILE)
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return []
+        with self._lock:
+            cached = self._indexes.get(user_id)
+            if cached is not None and cached.size == size:
+                self._indexes.move_to_end(user_id)
+                return cached.blocks
+        blocks = []
+        with open(path, "rb") as f:
+            data = f.read(size)
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+                entry["bloom"] = b64decode(entry["bloom"])
+                blocks.append(entry)
+            except (ValueError, KeyError):
+                # A torn last line from a crash mid-append; the block it described is ignored
+                continue
+        with self._lock:
+            self._indexes[user_id] = _UserIndex(size, blocks)
+            self._indexes.move_to_end(user_id)
+            while len(self._indexes) > self.max_cached_indexes:
+                self._indexes.popitem(last=False)
+        return blocks
+
+    def _read_range(self, path: str, offset: int, length: int) -> bytes:
+        """Bytes of a segment, copied out under the lock so no other thread can close the map mid-read"""
+        with self._lock:
+            mapped = self._maps.get(path)
+            if mapped is None or len(mapped) < offset + length:
+                # First use, or the active segment has grown since it was mapped
+                with open(path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                old = self._maps.pop(path, None)
+                if old is not None:
+                    old.close()
+                self._maps[path] = mapped
+                while len(self._maps) > self.max_open_segments:
+                    self._maps.popitem(last=False)[1].close()
+            self._maps.move_to_end(path)
+            return mapped[offset:offset + length]
+
+    def _read_block(self, user_id: str, entry: Dict) -> List[Dict]:
+        path = os.path.join(self._user_dir(user_id), entry["s"])
+        try:
+            payload = self._read_range(path, entry["o"], entry["n"])
+        except OSError as e:
+            logger.error(f"[COLD] Could not read {entry['s']} for {user_id}: {e}")
+            return []
+        if zlib.crc32(payload) != entry["crc"]:
+            logger.error(f"[COLD] Checksum mismatch in {entry['s']}@{entry['o']} for {user_id}")
+            return []
+        return [json.loads(line) for line in zlib.decompress(payload).splitlines()]
+
+    def scan(self, user_id: str, after: Optional[float] = None, before: Optional[float] = None) -> Iterator[Dict]:
+        """Archived emails newest first, optionally within [after, before) epoch seconds.
+
+        Blocks are decompressed only once the scan reaches their date range, so
+        a reader that stops early touches only the newest blocks.
+        """
+        blocks = [
+            b for b in self._index(user_id)
+            if (after is None or b["hi"] >= after) and (before is None or b["lo"] < before)
+        ]
+        blocks.sort(key=lambda b: b["hi"], reverse=True)
+        heap, seq, seen = [], itertools.count(), set()
+        i = 0
+        while i < len(blocks) or heap:
+            # Open every block that could hold something newer than the best row so far
+            while i < len(blocks) and (not heap or blocks[i]["hi"] >= -heap[0][0]):
+                for row in self._read_block(user_id, blocks[i]):
+                    heapq.heappush(heap, (-email_timestamp(row.get("date")), next(seq), row))
+                i += 1
+            if not heap:
+                break
+            neg_ts, _, row = heapq.heappop(heap)
+            ts = -neg_ts
+            if before is not None and ts >= before:
+                continue
+            if after is not None and ts < after:
+                # Everything left is older still
+                if i >= len(blocks):
+                    break
+                continue
+            if row["message_id"] in seen:
+                continue  # archived twice (e.g. a retried trim); one copy is enough
+            seen.add(row["message_id"])
+            yield row
+
+    def get_many(self, user_id: str, message_ids: Iterable[str]) -> Dict[str, Dict]:
+        """Archived emails by message ID, reading only blocks whose bloom filter may hold them"""
+        wanted = set(message_ids)
+        found: Dict[str, Dict] = {}
+        for entry in self._index(user_id):
+            if not any(_bloom_may_contain(entry["bloom"], mid) for mid in wanted - found.keys()):
+                continue
+            for row in self._read_block(user_id, entry):
+                if row["message_id"] in wanted:
+                    found[row["message_id"]] = row
+            if len(found) == len(wanted):
+                break
+        return found
+
+    def generation(self, user_id: str) -> int:
+        """Number of archived blocks; changes whenever the user's archive does"""
+        return len(self._index(user_id))
+
+    def stats(self, user_id: str) -> Dict:
+        blocks = self._index(user_id)
+        return {
+            "blocks": len(blocks),
+            "emails": sum(b["c"] for b in blocks),
+            "compressed_bytes": sum(b["n"] for b in blocks),
+        }
+
+    def close(self):
+        with self._lock:
+            for mapped in self._maps.values():
+                mapped.close()
+            self._maps.clear()
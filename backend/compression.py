@@ -0,0 +1,128 @@
+# compression.py
+"""Response compression negotiated from Accept-Encoding: brotli when installed, otherwise gzip."""
+import gzip
+from typing import List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is always available
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/", "application/javascript")
+
+
+def _accepted(accept_encoding: str) -> List[str]:
+    codings = []
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        codings.append(name.strip().lower())
+    return codings
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = _accepted(accept_encoding)
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+def _add_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    for i, (k, v) in enumerate(headers):
+        if k.lower() == b"vary":
+            if b"accept-encoding" not in v.lower() and v.strip() != b"*":
+                headers[i] = (k, v + b", Accept-Encoding")
+            return headers
+    return headers + [(b"vary", b"Accept-Encoding")]
+
+
+def _coded_etag(etag: bytes, encoding: str) -> bytes:
+    # A strong ETag has to differ per content coding
+    return etag[:-1] + f"-{encoding}".encode() + b'"' if etag.endswith(b'"') else etag
+
+
+class CompressionMiddleware:
+    """Compresses complete (non-streaming) responses; streamed bodies such as SSE pass through.
+
+    Every complete response of a compressible type, and every 304, is marked
+    `Vary: Accept-Encoding`, compressed or not, so shared caches keep one copy
+    per coding. A 304 repeats the coded ETag the client revalidated with.
+    """
+
+    def __init__(self, app, minimum_size: int = 500):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept, if_none_match = "", b""
+        for name, value in scope.get("headers", []):
+            if name == b"accept-encoding":
+                accept = value.decode("latin-1")
+            elif name == b"if-none-match":
+                if_none_match = value
+        encoding = choose_encoding(accept)
+
+        start_message = None
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+            start, start_message = start_message, None
+            body = message.get("body", b"")
+            headers: List[Tuple[bytes, bytes]] = list(start.get("headers", []))
+            names = {k.lower(): v for k, v in headers}
+            content_type = names.get(b"content-type", b"").decode("latin-1")
+
+            if start["status"] == 304:
+                if encoding:
+                    headers = [
+                        (k, _coded_etag(v, encoding)) if k.lower() == b"etag"
+                        and _coded_etag(v, encoding) in if_none_match else (k, v)
+                        for k, v in headers
+                    ]
+                await send({**start, "headers": _add_vary(headers)})
+                await send(message)
+                return
+            if message.get("more_body") or b"content-encoding" in names or not content_type.startswith(COMPRESSIBLE_TYPES):
+                await send(start)
+                await send(message)
+                return
+            if encoding is None or len(body) < self.minimum_size:
+                await send({**start, "headers": _add_vary(headers)})
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            new_headers = []
+            for k, v in headers:
+                lower = k.lower()
+                if lower == b"content-length":
+                    continue
+                if lower == b"etag":
+                    v = _coded_etag(v, encoding)
+                new_headers.append((k, v))
+            new_headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+            ]
+            await send({**start, "headers": _add_vary(new_headers)})
+            await send({**message, "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,94 @@
+# data_versions.py
+"""Per-user data versions for conditional GETs, shared by all workers on a host through SQLite."""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Content codings appended to an ETag by CompressionMiddleware
+ETAG_CODING_SUFFIXES = ("-gzip", "-br")
+
+
+class DataVersionStore:
+    """Monotonic version per user, bumped by anything that changes what the user sees"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS data_versions ("
+                " user_id TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _reader(self) -> sqlite3.Connection:
+        # Version checks sit in front of every replica read; reuse one connection per thread for them
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def get(self, user_id: str) -> Optional[int]:
+        """Current version, or None if it cannot be read (callers then skip conditional handling)"""
+        try:
+            row = self._reader().execute("SELECT version FROM data_versions WHERE user_id = ?", (user_id,)).fetchone()
+        except sqlite3.Error as e:
+            self._local.conn = None
+            logger.warning(f"[ETAG] Version store unavailable: {e}")
+            return None
+        return row[0] if row else 0
+
+    def bump(self, user_id: str) -> Optional[int]:
+        """The new version, or None if it could not be bumped"""
+        try:
+            with self._connect() as conn:
+                # One write transaction, so the version read back is the one this bump produced
+                conn.execute("BEGIN IMMEDIATE")
+                conn.execute(
+                    "INSERT INTO data_versions (user_id, version, updated_at) VALUES (?, 1, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at",
+                    (user_id, time.time()),
+                )
+                row = conn.execute("SELECT version FROM data_versions WHERE user_id = ?", (user_id,)).fetchone()
+                conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logger.warning(f"[ETAG] Could not bump version for {user_id}: {e}")
+            return None
+        return row[0] if row else None
+
+
+def make_etag(*parts) -> str:
+    """Strong ETag from the given parts"""
+    digest = hashlib.sha1("|".join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'"{digest}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match check that also accepts our ETag with a content-coding suffix"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.strip('"')
+    for candidate in if_none_match.split(","):
+        tag = candidate.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        for suffix in ETAG_CODING_SUFFIXES:
+            if tag.endswith(suffix):
+                tag = tag[: -len(suffix)]
+                break
+        if tag == bare:
+            return True
+    return False
@@ -0,0 +1,249 @@
+# email_bodies.py
+"""Full message bodies, fetched only when something needs them, and a size-bounded local cache for them.
+
+Sync reads messages in format=metadata, which carries only headers and a short
+snippet. A body is fetched (format=full) the first time a summary or the detail
+view asks for it. The text extracted from its MIME tree is then kept on disk.
+
+Cached text is content-addressed: the file name is the SHA-256 of the text, so
+a newsletter sent to many users is stored once. A SQLite index maps (user,
+message) to a digest and records each blob's size and last use. When the total
+passes the byte budget, the least recently used blobs are evicted. Reads
+memory-map the file instead of copying it through a read buffer.
+"""
+import base64
+import hashlib
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+from html import unescape
+from html.parser import HTMLParser
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Longest text kept per message; anything past this never reaches a summary or the detail view
+MAX_BODY_CHARS = 200_000
+
+_BLOCK_TAGS = frozenset({"br", "p", "div", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6",
+                         "blockquote", "pre", "table", "hr"})
+_SKIPPED_TAGS = frozenset({"script", "style", "head", "title"})
+
+
+class _HtmlText(HTMLParser):
+    """Visible text of an HTML part, with line breaks at block boundaries"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts: List[str] = []
+        self._skipping = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in _SKIPPED_TAGS:
+            self._skipping += 1
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in _SKIPPED_TAGS:
+            self._skipping = max(0, self._skipping - 1)
+        elif tag in _BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skipping:
+            self.parts.append(data)
+
+
+def html_to_text(html: str) -> str:
+    parser = _HtmlText()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception as e:
+        # Malformed markup: keep what was parsed, or fall back to stripping tags
+        logger.debug(f"[BODY] HTML parse error: {e}")
+        if not parser.parts:
+            return unescape(re.sub(r"<[^>]+>", " ", html))
+    return "".join(parser.parts)
+
+
+def _normalize(text: str) -> str:
+    lines = (re.sub(r"[ \t\u00a0]+", " ", line).strip() for line in text.replace("\r\n", "\n").split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()[:MAX_BODY_CHARS]
+
+
+def _charset(part: Dict) -> str:
+    for header in part.get("headers") or []:
+        if header.get("name", "").lower() == "content-type":
+            m = re.search(r'charset="?([\w.:-]+)"?', header.get("value", ""), re.I)
+            if m:
+                return m.group(1)
+    return "utf-8"
+
+
+def _decode_part(part: Dict) -> Optional[str]:
+    data = (part.get("body") or {}).get("data")
+    if not data:
+        return None
+    raw = base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+    try:
+        return raw.decode(_charset(part), errors="replace")
+    except LookupError:
+        return raw.decode("utf-8", errors="replace")
+
+
+def extract_text(payload: Dict) -> str:
+    """Readable text of a messages.get (format=full) payload.
+
+    text/plain parts are used when the message has any, otherwise text/html
+    parts converted to text. Attachments are skipped.
+    """
+    plain: List[str] = []
+    html: List[str] = []
+    stack = [payload or {}]
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            # Depth-first, in document order
+            stack.extend(reversed(children))
+            continue
+        if part.get("filename"):
+            continue
+        mime = (part.get("mimeType") or "").lower()
+        if mime not in ("text/plain", "text/html"):
+            continue
+        text = _decode_part(part)
+        if text:
+            (plain if mime == "text/plain" else html).append(text)
+    if plain:
+        return _normalize("\n\n".join(plain))
+    return _normalize("\n\n".join(html_to_text(h) for h in html))
+
+
+class BodyCache:
+    """Content-addressed body texts on disk, evicted least recently used once over `max_bytes`"""
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path = os.path.join(directory, "index.db")
+        self._evict_lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "objects"), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " digest TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS refs ("
+                " user_key TEXT NOT NULL, message_id TEXT NOT NULL, digest TEXT NOT NULL,"
+                " PRIMARY KEY (user_key, message_id))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS refs_digest_idx ON refs (digest)")
+            conn.execute("CREATE INDEX IF NOT EXISTS blobs_access_idx ON blobs (last_access)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    @staticmethod
+    def _user_key(user_id: str) -> str:
+        # User IDs are email addresses; keep them out of the index
+        return hashlib.sha1(user_id.encode()).hexdigest()[:20]
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def get(self, user_id: str, message_id: str) -> Optional[str]:
+        """Cached text, or None on a miss (including a blob evicted or removed underneath the index)"""
+        try:
+            with self._connect() as conn:
+                row = conn.execute(
+                    "SELECT digest FROM refs WHERE user_key = ? AND message_id = ?",
+                    (self._user_key(user_id), message_id),
+                ).fetchone()
+                if row is None:
+                    return None
+                conn.execute("UPDATE blobs SET last_access = ? WHERE digest = ?", (time.time(), row[0]))
+        except sqlite3.Error as e:
+            logger.warning(f"[BODY] Cache index unavailable: {e}")
+            return None
+        try:
+            with open(self._blob_path(row[0]), "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return ""
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    return mapped[:].decode("utf-8")
+        except (OSError, ValueError) as e:
+            logger.debug(f"[BODY] Blob {row[0][:12]} unreadable: {e}")
+            return None
+
+    def put(self, user_id: str, message_id: str, text: str) -> str:
+        """Store text for a message; returns its digest"""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            # Atomic: readers see the whole blob or none of it
+            os.replace(tmp, path)
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO blobs (digest, size, last_access) VALUES (?, ?, ?) "
+                    "ON CONFLICT(digest) DO UPDATE SET last_access = excluded.last_access",
+                    (digest, len(data), time.time()),
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO refs (user_key, message_id, digest) VALUES (?, ?, ?)",
+                    (self._user_key(user_id), message_id, digest),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"[BODY] Could not index body of {message_id}: {e}")
+            return digest
+        self._evict()
+        return digest
+
+    def _evict(self):
+        with self._evict_lock:
+            try:
+                with self._connect() as conn:
+                    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+                    if total <= self.max_bytes:
+                        return
+                    victims = []
+                    for digest, size in conn.execute("SELECT digest, size FROM blobs ORDER BY last_access"):
+                        if total <= self.max_bytes:
+                            break
+                        victims.append(digest)
+                        total -= size
+                    for digest in victims:
+                        conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+                        conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+            except sqlite3.Error as e:
+                logger.warning(f"[BODY] Eviction failed: {e}")
+                return
+        for digest in victims:
+            try:
+                os.remove(self._blob_path(digest))
+            except OSError:
+                pass
+        logger.debug(f"[BODY] Evicted {len(victims)} bodies")
+
+    def stats(self) -> Dict:
+        try:
+            with self._connect() as conn:
+                blobs, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+                refs = conn.execute("SELECT COUNT(*) FROM refs").fetchone()[0]
+        except sqlite3.Error:
+            return {}
+        return {"blobs": blobs, "messages": refs, "bytes": size, "max_bytes": self.max_bytes}
@@ -0,0 +1,127 @@
+# email_export.py
+"""Row source and formats behind GET /emails/export: hot rows by keyset pages, then the cold tier."""
+import csv
+import io
+import json
+import logging
+from typing import Dict, Iterator, List, Optional
+
+from analytics import match_keywords
+from cold_storage import email_timestamp
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = ["message_id", "thread_id", "date", "from_email", "subject", "snippet", "summary", "category", "archived"]
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8"}
+
+
+class ExportFilters:
+    """Date range (ISO strings, inclusive after / exclusive before), keyword and category"""
+
+    __slots__ = ("after", "before", "keyword", "category")
+
+    def __init__(self, after: Optional[str] = None, before: Optional[str] = None,
+                 keyword: Optional[str] = None, category: Optional[str] = None):
+        self.after = after
+        self.before = before
+        self.keyword = keyword
+        self.category = category
+
+    def matches(self, row: Dict) -> bool:
+        # Server-side filters already applied to hot rows; archived rows are checked here in full
+        ts = email_timestamp(row.get("date"))
+        if self.after and ts < email_timestamp(self.after):
+            return False
+        if self.before and ts >= email_timestamp(self.before):
+            return False
+        if self.category and row.get("category") != self.category:
+            return False
+        return not self.keyword or bool(match_keywords(row, [self.keyword]))
+
+
+class EmailExporter:
+    """Yields a user's emails page by page, so memory stays flat however large the mailbox is.
+
+    Hot rows are read with keyset pagination on the identity id (WHERE id > last
+    ORDER BY id LIMIT n), which stays an index range scan at any depth, unlike
+    OFFSET. Archived rows follow, read block by block from the cold tier.
+    """
+
+    def __init__(self, client, archive=None, page_size: int = 500):
+        self.client = client
+        self.archive = archive
+        self.page_size = page_size
+
+    def _hot_page(self, user_id: str, after_id: int, filters: ExportFilters) -> List[Dict]:
+        query = (
+            self.client.table("emails")
+            .select("id," + ",".join(c for c in EXPORT_COLUMNS if c != "archived"))
+            .eq("user_id", user_id)
+            .gt("id", after_id)
+        )
+        if filters.after:
+            query = query.gte("date", filters.after)
+        if filters.before:
+            query = query.lt("date", filters.before)
+        if filters.category:
+            query = query.eq("category", filters.category)
+        return query.order("id").limit(self.page_size).execute().data or []
+
+    def pages(self, user_id: str, filters: ExportFilters, include_archived: bool = True) -> Iterator[List[Dict]]:
+        """Lists of export rows; each next() issues at most one Supabase query"""
+        # Hot rows are capped per user, so remembering their IDs to skip archive duplicates stays small
+        hot_ids = set()
+        last_id = 0
+        while True:
+            rows = self._hot_page(user_id, last_id, filters)
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            page = []
+            for row in rows:
+                hot_ids.add(row["message_id"])
+                if filters.keyword and not match_keywords(row, [filters.keyword]):
+                    continue
+                page.append({c: row.get(c) for c in EXPORT_COLUMNS if c != "archived"} | {"archived": False})
+            if page:
+                yield page
+            if len(rows) < self.page_size:
+                break
+
+        if not include_archived or self.archive is None:
+            return
+        page = []
+        after = email_timestamp(filters.after) if filters.after else None
+        before = email_timestamp(filters.before) if filters.before else None
+        for row in self.archive.scan(user_id, after=after, before=before):
+            if row["message_id"] in hot_ids or not filters.matches(row):
+                continue
+            page.append({c: row.get(c) for c in EXPORT_COLUMNS if c != "archived"} | {"archived": True})
+            if len(page) >= self.page_size:
+                yield page
+                page = []
+        if page:
+            yield page
+
+
+def ndjson_chunk(rows: List[Dict]) -> bytes:
+    return "".join(json.dumps(row, separators=(",", ":"), default=str) + "\n" for row in rows).encode()
+
+
+class CsvFormatter:
+    """CSV chunks sharing one header; the buffer is reused so each chunk costs only its own rows"""
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.DictWriter(self._buffer, fieldnames=EXPORT_COLUMNS, extrasaction="ignore")
+        self._header_sent = False
+
+    def chunk(self, rows: List[Dict]) -> bytes:
+        if not self._header_sent:
+            self._writer.writeheader()
+            self._header_sent = True
+        self._writer.writerows(rows)
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
@@ -0,0 +1,162 @@
+# email_threads.py
+"""Conversation-level sync: Gmail threads rolled up into one row each, summarized once per revision."""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional
+
+from analytics import normalize_sender
+from metadata_cache import MessageMeta
+
+logger = logging.getLogger(__name__)
+
+THREADS_TABLE = "email_threads"
+# Latest messages fed to the summarizer, oldest first
+SUMMARY_MESSAGES = 3
+
+
+def _iso(internal_date_ms: int) -> str:
+    return datetime.fromtimestamp(internal_date_ms / 1000, tz=timezone.utc).isoformat()
+
+
+class ThreadRollup:
+    """One Gmail thread (threads.get, format=metadata) reduced to what the app shows.
+
+    history_id is the thread's revision: it moves whenever a message is added to
+    the thread or relabeled, so it decides both refetching and re-summarizing.
+    """
+    __slots__ = ("id", "history_id", "messages")
+
+    def __init__(self, id: str, history_id: int, messages: List[MessageMeta]):
+        self.id = id
+        self.history_id = history_id
+        self.messages = sorted(messages, key=lambda m: m.internal_date)
+
+    @classmethod
+    def from_gmail(cls, thread: Dict) -> "ThreadRollup":
+        messages = [MessageMeta.from_gmail(m) for m in thread.get("messages", [])]
+        if not messages:
+            raise ValueError(f"Thread {thread.get('id')} has no messages")
+        return cls(thread["id"], int(thread.get("historyId", 0) or 0), messages)
+
+    @property
+    def latest(self) -> MessageMeta:
+        return self.messages[-1]
+
+    def participants(self) -> List[str]:
+        return list(dict.fromkeys(normalize_sender(m.from_header) for m in self.messages))
+
+    def to_row(self, user_id: str) -> Dict:
+        latest = self.latest
+        return {
+            "user_id": user_id,
+            "thread_id": self.id,
+            "history_id": self.history_id,
+            "subject": self.messages[0].subject,
+            "participants": self.participants(),
+            "message_count": len(self.messages),
+            "unread_count": sum(1 for m in self.messages if m.label_ids and "UNREAD" in m.label_ids),
+            "first_date": _iso(self.messages[0].internal_date),
+            "last_date": _iso(latest.internal_date),
+            "last_message_id": latest.id,
+            "snippet": latest.snippet,
+            "category": latest.category,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def email_row(self, user_id: str) -> Dict:
+        """Row for the emails table: the thread's latest message stands for the conversation"""
+        latest = self.latest
+        return {
+            "message_id": latest.id,
+            "thread_id": self.id,
+            "from_email": normalize_sender(latest.from_header),
+            "subject": latest.subject,
+            "date": _iso(latest.internal_date),
+            "snippet": latest.snippet,
+            "summary": None,
+            "category": latest.category,
+            "user_id": user_id,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def summary_input(self, latest_body: Optional[str] = None) -> str:
+        """The latest few messages (the newest in full when its body is given), for one summary of the conversation"""
+        recent = self.messages[-SUMMARY_MESSAGES:]
+        lines = [f"{normalize_sender(m.from_header)}: {m.snippet}" for m in recent]
+        if latest_body:
+            lines[-1] = f"{normalize_sender(self.latest.from_header)}: {latest_body}"
+        if len(self.messages) > len(recent):
+            lines.insert(0, f"({len(self.messages) - len(recent)} earlier messages)")
+        return "\n".join(lines)
+
+
+class ThreadStore:
+    """email_threads table access for thread-granularity sync"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def revisions(self, user_id: str, thread_ids: List[str]) -> Dict[str, Dict]:
+        """Stored history_id and summary_history_id per thread"""
+        if not thread_ids:
+            return {}
+        result = (
+            self.client.table(THREADS_TABLE)
+            .select("thread_id,history_id,summary_history_id")
+            .eq("user_id", user_id)
+            .in_("thread_id", thread_ids)
+            .execute()
+        )
+        return {row["thread_id"]: row for row in result.data or []}
+
+    def upsert(self, user_id: str, rollups: Iterable[ThreadRollup]):
+        rows = [t.to_row(user_id) for t in rollups]
+        if rows:
+            self.client.table(THREADS_TABLE).upsert(rows, on_conflict="user_id,thread_id").execute()
+
+    def needing_summary(self, user_id: str, thread_ids: List[str]) -> List[str]:
+        """Threads whose current revision has not been summarized yet"""
+        return [
+            tid for tid, row in self.revisions(user_id, thread_ids).items()
+            if row.get("summary_history_id") != row.get("history_id")
+        ]
+
+    def set_summary(self, user_id: str, thread_id: str, summary: str, history_id: int):
+        (
+            self.client.table(THREADS_TABLE)
+            .update({"summary": summary, "summary_history_id": history_id})
+            .eq("user_id", user_id)
+            .eq("thread_id", thread_id)
+            .execute()
+        )
+
+    def get(self, user_id: str, thread_id: str) -> Optional[Dict]:
+        result = (
+            self.client.table(THREADS_TABLE)
+            .select("*")
+            .eq("user_id", user_id)
+            .eq("thread_id", thread_id)
+            .limit(1)
+            .execute()
+        )
+        return result.data[0] if result.data else None
+
+    def delete_orphans(self, user_id: str, thread_ids: List[str]) -> int:
+        """Drop rollups of threads that no longer have a row in the hot emails table"""
+        if not thread_ids:
+            return 0
+        try:
+            remaining = (
+                self.client.table("emails")
+                .select("thread_id")
+                .eq("user_id", user_id)
+                .in_("thread_id", thread_ids)
+                .execute()
+            )
+            orphans = sorted(set(thread_ids) - {row["thread_id"] for row in remaining.data or []})
+            if orphans:
+                self.client.table(THREADS_TABLE).delete().eq("user_id", user_id).in_("thread_id", orphans).execute()
+            return len(orphans)
+        except Exception as e:
+            logger.warning(f"[THREADS] Could not drop orphaned threads for {user_id}: {e}")
+            return 0
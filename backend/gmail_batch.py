@@ -0,0 +1,103 @@
+# gmail_batch.py
+"""Minimal client for the Gmail HTTP batch endpoint (many GETs in one round trip)."""
+import json
+import logging
+import os
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+from http_client import gmail_quota, http_session
+from quota import user_key
+
+logger = logging.getLogger(__name__)
+
+MAX_BATCH_SIZE = 50  # Gmail accepts up to 100, but recommends 50 to avoid rate limiting
+
+
+def gmail_api_base() -> str:
+    """Gmail API root; overridable (GMAIL_API_BASE) so benchmarks can point at a local fake"""
+    return os.getenv("GMAIL_API_BASE", "https://gmail.googleapis.com").rstrip("/")
+
+
+def _build_body(paths: List[str], boundary: str) -> str:
+    parts = []
+    for i, path in enumerate(paths):
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item{i}>\r\n\r\n"
+            f"GET {path}\r\n\r\n"
+        )
+    parts.append(f"--{boundary}--")
+    return "".join(parts)
+
+
+def _parse_response(content_type: str, body: str) -> Dict[int, Tuple[int, Optional[dict]]]:
+    """Map Content-ID index -> (status, json body) from a multipart/mixed response"""
+    boundary = None
+    for piece in content_type.split(";"):
+        piece = piece.strip()
+        if piece.startswith("boundary="):
+            boundary = piece[len("boundary="):].strip('"')
+    if not boundary:
+        raise ValueError("Batch response has no multipart boundary")
+
+    results: Dict[int, Tuple[int, Optional[dict]]] = {}
+    for part in body.split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == "--":
+            continue
+        # Outer part headers, then the embedded HTTP response
+        outer, _, http = part.replace("\r\n", "\n").partition("\n\n")
+        index = None
+        for line in outer.split("\n"):
+            if line.lower().startswith("content-id:"):
+                cid = line.split(":", 1)[1].strip().strip("<>")
+                # Responses echo the request ID as "response-item<N>"
+                index = int(cid.rsplit("item", 1)[-1])
+        if index is None:
+            continue
+        status_line, _, rest = http.partition("\n")
+        try:
+            status = int(status_line.split()[1])
+        except (IndexError, ValueError):
+            continue
+        # Prefix a newline so a response with no headers still splits on the blank line
+        _, _, payload = ("\n" + rest).partition("\n\n")
+        try:
+            data = json.loads(payload) if payload.strip() else None
+        except ValueError:
+            data = None
+        results[index] = (status, data)
+    return results
+
+
+def batch_get(access_token: str, paths: List[str], timeout: int = 15) -> List[Tuple[int, Optional[dict]]]:
+    """GET each Gmail API path (e.g. /gmail/v1/users/me/labels/INBOX) via the batch endpoint.
+
+    Returns (status, json) per path, in input order. Parts missing from the
+    response come back as (0, None) so callers can retry them individually.
+    """
+    results: List[Tuple[int, Optional[dict]]] = []
+    for start in range(0, len(paths), MAX_BATCH_SIZE):
+        chunk = paths[start:start + MAX_BATCH_SIZE]
+        boundary = f"batch_{uuid.uuid4().hex}"
+        r = http_session.post(
+            f"{gmail_api_base()}/batch/gmail/v1",
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": f"multipart/mixed; boundary={boundary}",
+            },
+            data=_build_body(chunk, boundary),
+            timeout=timeout,
+        )
+        if r.status_code != 200:
+            logger.warning(f"[BATCH] Batch request failed: {r.status_code}")
+            results.extend((r.status_code, None) for _ in chunk)
+            continue
+        parsed = _parse_response(r.headers.get("Content-Type", ""), r.text)
+        if any(status == 429 for status, _ in parsed.values()):
+            # Throttled parts come back inside a 200, so the session never sees them
+            gmail_quota.throttled(user_key(f"Bearer {access_token}"), "batch_429")
+        results.extend(parsed.get(i, (0, None)) for i in range(len(chunk)))
+    return results
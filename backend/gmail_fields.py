@@ -0,0 +1,35 @@
+# gmail_fields.py
+"""Partial-response masks (the `fields` parameter) for the Gmail calls MailPilot makes.
+
+Each mask names exactly what the code reads from that response. Anything else
+(payload MIME structure, sizeEstimate, unused headers, label colours) is never
+serialized by Gmail, sent over the wire or decoded here. When code starts
+reading a new field, it has to be added to the mask too, or it comes back
+missing.
+"""
+
+# messages.get in format=metadata: what MessageMeta keeps, plus historyId for history-based
+# invalidation. metadataHeaders already limits the headers to From, Subject and Date.
+MESSAGE_FIELDS = "id,threadId,labelIds,snippet,historyId,internalDate,payload/headers(name,value)"
+
+# messages.list when only the IDs are used
+MESSAGE_IDS_FIELDS = "messages/id,nextPageToken"
+# messages.list when only the count is used
+RESULT_SIZE_FIELDS = "resultSizeEstimate"
+
+# messages.get in format=full: only the MIME tree that extract_text walks
+BODY_FIELDS = "payload(mimeType,filename,headers,body/data,parts)"
+
+THREAD_LIST_FIELDS = "threads(id,historyId),nextPageToken"
+THREAD_FIELDS = f"id,historyId,messages({MESSAGE_FIELDS})"
+
+HISTORY_FIELDS = (
+    "history(messagesDeleted/message/id,labelsAdded/message/id,labelsRemoved/message/id),"
+    "historyId,nextPageToken"
+)
+
+LABEL_LIST_FIELDS = "labels(id,name,type)"
+LABEL_COUNT_FIELDS = "id,name,messagesUnread,messagesTotal"
+LABEL_UNREAD_FIELDS = "messagesUnread"
+
+WATCH_FIELDS = "historyId,expiration"
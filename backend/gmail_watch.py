@@ -0,0 +1,227 @@
+# gmail_watch.py
+"""Push-triggered sync: Gmail users.watch registrations and the Pub/Sub push notifications they produce.
+
+Gmail publishes a message to a Pub/Sub topic whenever a watched mailbox
+changes, and Pub/Sub pushes it to POST /gmail/push. Each message carries the
+mailbox address and its new historyId. For every notification:
+1. The push is verified.
+2. It is dropped if the historyId is not ahead of the one the last sync reached.
+3. Otherwise it is debounced per account, so a burst of new mail triggers one
+   sync rather than one per message.
+
+Watches expire after at most seven days, so they are renewed ahead of time.
+"""
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Header carrying the HMAC of the body when pushes are verified with a shared secret
+SIGNATURE_HEADER = "x-mailpilot-push-signature"
+
+PUSH_NOTIFICATIONS = registry.counter(
+    "mailpilot_gmail_push_total", "Gmail push notifications by outcome", ["outcome"])
+
+
+class PushRejected(Exception):
+    """A push request that did not come from our Pub/Sub subscription"""
+
+
+def sign(secret: str, body: bytes) -> str:
+    return "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify_push(body: bytes, headers: Dict[str, str], secret: Optional[str] = None,
+                audience: Optional[str] = None, service_account: Optional[str] = None):
+    """Accept a push signed with the shared secret, or carrying a Google-signed OIDC token for `audience`.
+
+    Pub/Sub push subscriptions attach the OIDC token when configured with a
+    service account. The shared-secret signature is what the local stand-in
+    (and any relay in front of the app) sends. With neither configured, every
+    push is rejected.
+    """
+    signature = headers.get(SIGNATURE_HEADER)
+    if secret and signature:
+        if hmac.compare_digest(signature, sign(secret, body)):
+            return
+        raise PushRejected("bad signature")
+    authorization = headers.get("authorization", "")
+    if audience and authorization.startswith("Bearer "):
+        from google.oauth2 import id_token
+        from google.auth.transport import requests as google_requests
+        try:
+            claims = id_token.verify_oauth2_token(authorization[7:], google_requests.Request(), audience)
+        except ValueError as e:
+            raise PushRejected(f"bad token: {e}")
+        if service_account and claims.get("email") != service_account:
+            raise PushRejected("token from an unexpected service account")
+        return
+    raise PushRejected("unsigned push")
+
+
+def parse_push(body: bytes) -> Tuple[str, int]:
+    """(email address, historyId) from a Pub/Sub push envelope"""
+    envelope = json.loads(body)
+    data = json.loads(base64.b64decode(envelope["message"]["data"]))
+    return data["emailAddress"], int(data["historyId"])
+
+
+class WatchStore:
+    """Per-account watch expiry and the historyId the last sync reached, shared by all workers through SQLite"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS gmail_watches ("
+                " account TEXT PRIMARY KEY, expiration REAL, synced_history_id INTEGER NOT NULL DEFAULT 0,"
+                " updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def watched(self, account: str, history_id: int, expiration: float):
+        """Record a (re)registered watch; its historyId is where notifications start"""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO gmail_watches (account, expiration, synced_history_id, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(account) DO UPDATE SET expiration = excluded.expiration, "
+                " synced_history_id = MAX(synced_history_id, excluded.synced_history_id), "
+                " updated_at = excluded.updated_at",
+                (account, expiration, history_id, time.time()),
+            )
+
+    def synced(self, account: str, history_id: int):
+        """The account has been synced up to history_id"""
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE gmail_watches SET synced_history_id = MAX(synced_history_id, ?), updated_at = ? "
+                "WHERE account = ?",
+                (history_id, time.time(), account),
+            )
+
+    def synced_history_id(self, account: str) -> Optional[int]:
+        """None when the account has no watch (pushes for it are ignored)"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT synced_history_id FROM gmail_watches WHERE account = ?", (account,)).fetchone()
+        return row[0] if row else None
+
+    def expiring(self, before: float) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT account FROM gmail_watches WHERE expiration IS NULL OR expiration < ?", (before,)).fetchall()
+        return [r[0] for r in rows]
+
+    def remove(self, account: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM gmail_watches WHERE account = ?", (account,))
+
+
+class PushDebouncer:
+    """Coalesces notifications per account: one sync `delay` seconds after the first of a burst.
+
+    Notifications arriving while an account's sync is pending only raise the
+    historyId it will be run for.
+    """
+
+    def __init__(self, fire: Callable[[str, int], None], delay: float = 2.0):
+        self.fire = fire
+        self.delay = delay
+        self._pending: Dict[str, List] = {}  # account -> [due, history_id]
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+
+    def notify(self, account: str, history_id: int) -> bool:
+        """Returns False when the notification joined an already pending sync"""
+        with self._cond:
+            pending = self._pending.get(account)
+            if pending is not None:
+                pending[1] = max(pending[1], history_id)
+                return False
+            self._pending[account] = [time.monotonic() + self.delay, history_id]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="push-debounce", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+            return True
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closing:
+                        return
+                    now = time.monotonic()
+                    due = [(a, p[1]) for a, p in self._pending.items() if p[0] <= now]
+                    if due:
+                        for account, _ in due:
+                            del self._pending[account]
+                        break
+                    next_due = min((p[0] for p in self._pending.values()), default=None)
+                    self._cond.wait(None if next_due is None else next_due - now)
+            for account, history_id in due:
+                try:
+                    self.fire(account, history_id)
+                except Exception as e:
+                    logger.error(f"[PUSH] Could not start sync for {account}: {e}")
+
+    def pending(self) -> int:
+        with self._cond:
+            return len(self._pending)
+
+    def close(self):
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+
+
+class WatchRenewer:
+    """Re-registers watches that expire within `margin` seconds, checking every `interval` seconds"""
+
+    def __init__(self, store: WatchStore, renew: Callable[[str], bool], interval: float = 3600.0,
+                 margin: float = 86400.0):
+        self.store = store
+        self.renew = renew
+        self.interval = interval
+        self.margin = margin
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="watch-renewer", daemon=True)
+            self._thread.start()
+
+    def run_once(self) -> int:
+        renewed = 0
+        for account in self.store.expiring(time.time() + self.margin):
+            try:
+                if self.renew(account):
+                    renewed += 1
+            except Exception as e:
+                logger.warning(f"[WATCH] Renewal failed for {account}: {e}")
+        return renewed
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            renewed = self.run_once()
+            if renewed:
+                logger.info(f"[WATCH] Renewed {renewed} Gmail watches")
+
+    def stop(self):
+        self._stop.set()
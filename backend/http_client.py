@@ -0,0 +1,285 @@
+# http_client.py
+"""Shared outbound HTTP session (connection pooling) with upstream metrics, retries, circuit breakers and Gmail quota."""
+import os
+import re
+import time
+from typing import List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+import requests
+
+from metrics import GMAIL_QUOTA_UNITS, UPSTREAM_REQUESTS, UPSTREAM_SECONDS, registry
+from profiling import record_span
+from quota import FAILED, GMAIL_THROTTLED, OK, THROTTLED, QuotaController, rate_limit_reason, user_key
+from resilience import (
+    IDEMPOTENT_METHODS, RETRYABLE_STATUSES, RETRIES, Dependency, RetryPolicy, bounded_timeout,
+    parse_retry_after, register_dependency, sleep_before_retry,
+)
+
+# Gmail API quota units per method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_METHOD_COSTS = [
+    ("GET", re.compile(r"/users/me/messages/[^/]+/attachments/[^/]+$"), "messages.attachments.get", 5),
+    ("GET", re.compile(r"/users/me/messages/[^/]+$"), "messages.get", 5),
+    ("GET", re.compile(r"/users/me/messages$"), "messages.list", 5),
+    ("GET", re.compile(r"/users/me/threads/[^/]+$"), "threads.get", 10),
+    ("GET", re.compile(r"/users/me/threads$"), "threads.list", 10),
+    ("GET", re.compile(r"/users/me/labels/[^/]+$"), "labels.get", 1),
+    ("GET", re.compile(r"/users/me/labels$"), "labels.list", 1),
+    ("GET", re.compile(r"/users/me/history$"), "history.list", 2),
+    ("GET", re.compile(r"/users/me/profile$"), "getProfile", 1),
+    ("POST", re.compile(r"/users/me/watch$"), "watch", 100),
+    ("POST", re.compile(r"/users/me/stop$"), "stop", 50),
+]
+
+_BATCH_PART = re.compile(r"^(GET|POST) (\S+)", re.MULTILINE)
+
+
+def gmail_method(method: str, path: str) -> Optional[Tuple[str, int]]:
+    """(method name, quota units) for a Gmail API call, or None if it is not one"""
+    for verb, pattern, name, cost in GMAIL_METHOD_COSTS:
+        if verb == method and pattern.search(path):
+            return name, cost
+    return None
+
+
+def gmail_quota_costs(method: str, path: str, body=None) -> List[Tuple[str, int]]:
+    """(method name, quota units) for each Gmail call a request makes"""
+    if path.startswith("/batch/"):
+        # A batch costs the sum of the calls inside it
+        text = body.decode() if isinstance(body, bytes) else (body or "")
+        costs = []
+        for verb, inner in _BATCH_PART.findall(text):
+            costs.extend(gmail_quota_costs(verb, urlsplit(inner).path))
+        return costs
+    found = gmail_method(method, path)
+    if not found:
+        return []
+    return [found]
+
+
+def record_gmail_quota(method: str, path: str, body=None):
+    for name, cost in gmail_quota_costs(method, path, body):
+        GMAIL_QUOTA_UNITS.inc(cost, method=name)
+
+
+def _is_gmail(host: str, path: str) -> bool:
+    return host.endswith("googleapis.com") or path.startswith("/gmail/") or path.startswith("/batch/gmail")
+
+
+# --- Per-dependency retry policies and circuit breakers ---
+
+BREAKER_THRESHOLD = int(os.getenv("UPSTREAM_BREAKER_THRESHOLD", "5"))
+BREAKER_RESET_SECONDS = float(os.getenv("UPSTREAM_BREAKER_RESET_SECONDS", "30"))
+
+# Gmail batch and Hugging Face inference are POSTs but read-only, so safe to repeat;
+# reCAPTCHA tokens are single-use and are never retried
+GMAIL = register_dependency("gmail", RetryPolicy(max_attempts=4, retry_methods={"GET", "POST"}),
+                            BREAKER_THRESHOLD, BREAKER_RESET_SECONDS)
+HUGGINGFACE = register_dependency("huggingface", RetryPolicy(max_attempts=2, base_delay=1.0, retry_methods={"POST"}),
+                                  BREAKER_THRESHOLD, BREAKER_RESET_SECONDS * 2)
+RECAPTCHA = register_dependency("recaptcha", RetryPolicy(max_attempts=1), BREAKER_THRESHOLD, BREAKER_RESET_SECONDS)
+SUPABASE = register_dependency("supabase", RetryPolicy(max_attempts=3, retry_methods=IDEMPOTENT_METHODS),
+                               BREAKER_THRESHOLD, BREAKER_RESET_SECONDS)
+OTHER = register_dependency("other", RetryPolicy(max_attempts=1), BREAKER_THRESHOLD, BREAKER_RESET_SECONDS)
+
+
+# Gmail allows 250 quota units per user per second and 1,200,000 per project per minute
+gmail_quota = QuotaController(
+    user_rate=float(os.getenv("GMAIL_USER_QUOTA_PER_SECOND", "250")),
+    project_rate=float(os.getenv("GMAIL_PROJECT_QUOTA_PER_SECOND", "20000")),
+    max_concurrency=int(os.getenv("GMAIL_MAX_CONCURRENCY", "32")),
+    initial_concurrency=int(os.getenv("GMAIL_INITIAL_CONCURRENCY", "8")),
+)
+registry.gauge(
+    "mailpilot_gmail_concurrency_limit", "Current adaptive limit on concurrent Gmail calls",
+    callback=lambda: {(): gmail_quota.limiter.limit},
+)
+
+
+def dependency_for(url: str) -> Dependency:
+    parts = urlsplit(url)
+    if _is_gmail(parts.netloc, parts.path):
+        return GMAIL
+    if "huggingface" in parts.netloc or parts.path.startswith("/models/"):
+        return HUGGINGFACE
+    if parts.path.endswith("/recaptcha/api/siteverify"):
+        return RECAPTCHA
+    return OTHER
+
+
+def _bounded(timeout, dependency: str):
+    # requests accepts a single timeout or a (connect, read) pair
+    if isinstance(timeout, tuple):
+        return tuple(bounded_timeout(t, dependency) for t in timeout)
+    return bounded_timeout(timeout, dependency)
+
+
+def _gmail_admission(method: str, url: str, kwargs) -> Optional[Tuple[str, int]]:
+    """(user key, quota units) a Gmail request is admitted with"""
+    body = kwargs.get("json") if kwargs.get("json") is not None else kwargs.get("data")
+    units = sum(cost for _, cost in gmail_quota_costs(method.upper(), urlsplit(url).path, body))
+    if not units:
+        return None
+    return user_key((kwargs.get("headers") or {}).get("Authorization")), units
+
+
+def _gmail_throttle(response: requests.Response) -> Optional[str]:
+    if response.status_code not in (403, 429):
+        return None
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = None
+    reason = rate_limit_reason(response.status_code, payload)
+    if reason:
+        GMAIL_THROTTLED.inc(reason=reason)
+    return reason
+
+
+class ResilientSession(requests.Session):
+    """requests.Session whose calls go through the dependency's breaker, retry policy and the request deadline"""
+
+    def request(self, method, url, *args, **kwargs):
+        dep = dependency_for(url)
+        quota = _gmail_admission(method, url, kwargs) if dep is GMAIL else None
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response, throttle = self._attempt(dep, quota, method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if not dep.policy.can_retry(method, attempt) or not sleep_before_retry(dep.policy.backoff(attempt)):
+                    raise
+                RETRIES.inc(dependency=dep.name, reason=type(e).__name__)
+                continue
+            if ((response.status_code in RETRYABLE_STATUSES or throttle)
+                    and dep.policy.can_retry(method, attempt)):
+                delay = dep.policy.backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                if sleep_before_retry(delay):
+                    RETRIES.inc(dependency=dep.name, reason=str(response.status_code))
+                    # Drain the (small) error body so the connection goes back to the pool
+                    response.content
+                    response.close()
+                    continue
+            return response
+
+    def _attempt(self, dep: Dependency, quota: Optional[Tuple[str, int]], method, url, *args, **kwargs):
+        """One call: (response, throttle reason). The breaker and the quota slot are settled however it ends."""
+        # Both can raise DeadlineExceeded, so they run before the breaker hands out a probe slot
+        kwargs["timeout"] = _bounded(kwargs.get("timeout", dep.policy.timeout), dep.name)
+        if quota:
+            # Every attempt spends quota, retries included
+            gmail_quota.acquire(*quota)
+        outcome = FAILED
+        try:
+            dep.breaker.before_call()
+            try:
+                response = super().request(method, url, *args, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                dep.breaker.record_failure()
+                raise
+            except BaseException:
+                dep.breaker.release()
+                raise
+            # Throttling (429) says nothing about upstream health; only 5xx trips the breaker
+            if response.status_code >= 500:
+                dep.breaker.record_failure()
+            else:
+                dep.breaker.record_success()
+            throttle = _gmail_throttle(response) if quota else None
+            outcome = THROTTLED if throttle else OK if response.status_code < 500 else FAILED
+            return response, throttle
+        finally:
+            if quota:
+                gmail_quota.release(quota[0], outcome)
+
+
+class ResilientTransport(httpx.BaseTransport):
+    """httpx transport wrapper applying a dependency's breaker, retries and the request deadline"""
+
+    def __init__(self, inner: httpx.BaseTransport, dependency: Dependency):
+        self.inner = inner
+        self.dependency = dependency
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        dep = self.dependency
+        attempt = 0
+        while True:
+            attempt += 1
+            left = bounded_timeout(None, dep.name)
+            if left is not None:
+                timeouts = request.extensions.get("timeout") or {}
+                request.extensions["timeout"] = {
+                    key: left if timeouts.get(key) is None else min(timeouts[key], left)
+                    for key in ("connect", "read", "write", "pool")
+                }
+            dep.breaker.before_call()
+            try:
+                response = self.inner.handle_request(request)
+            except httpx.TransportError as e:
+                dep.breaker.record_failure()
+                if not dep.policy.can_retry(request.method, attempt) or not sleep_before_retry(dep.policy.backoff(attempt)):
+                    raise
+                RETRIES.inc(dependency=dep.name, reason=type(e).__name__)
+                continue
+            except BaseException:
+                dep.breaker.release()
+                raise
+
+            if response.status_code >= 500:
+                dep.breaker.record_failure()
+            else:
+                dep.breaker.record_success()
+            if response.status_code in RETRYABLE_STATUSES and dep.policy.can_retry(request.method, attempt):
+                delay = dep.policy.backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                if sleep_before_retry(delay):
+                    RETRIES.inc(dependency=dep.name, reason=str(response.status_code))
+                    response.read()
+                    response.close()
+                    continue
+            return response
+
+    def close(self):
+        self.inner.close()
+
+
+def _record_requests_response(response: requests.Response, *args, **kwargs):
+    url = urlsplit(response.request.url)
+    host = url.netloc
+    UPSTREAM_REQUESTS.inc(host=host, status=str(response.status_code))
+    UPSTREAM_SECONDS.observe(response.elapsed.total_seconds(), host=host)
+    record_span("http", response.request.method, host, url.path, response.status_code,
+                response.elapsed.total_seconds())
+    if _is_gmail(host, url.path):
+        record_gmail_quota(response.request.method, url.path, response.request.body)
+
+
+def _httpx_request_started(request):
+    request.extensions["mailpilot_started"] = time.perf_counter()
+
+
+def _httpx_response_finished(response):
+    request = response.request
+    host = request.url.netloc.decode() if isinstance(request.url.netloc, bytes) else str(request.url.netloc)
+    UPSTREAM_REQUESTS.inc(host=host, status=str(response.status_code))
+    started = request.extensions.get("mailpilot_started")
+    if started is not None:
+        elapsed = time.perf_counter() - started
+        UPSTREAM_SECONDS.observe(elapsed, host=host)
+        record_span("http", request.method, host, request.url.path, response.status_code, elapsed)
+
+
+def instrument_httpx_client(client, dependency: Dependency = SUPABASE):
+    """Add upstream metrics hooks and resilience to an httpx.Client (e.g. the Supabase PostgREST session)"""
+    hooks = client.event_hooks
+    hooks.setdefault("request", []).append(_httpx_request_started)
+    hooks.setdefault("response", []).append(_httpx_response_finished)
+    client.event_hooks = hooks
+    # httpx has no public hook for retries, so wrap the client's default transport
+    client._transport = ResilientTransport(client._transport, dependency)
+
+
+# Shared pooled session for Gmail, Hugging Face and reCAPTCHA calls
+http_session = ResilientSession()
+http_session.hooks["response"].append(_record_requests_response)
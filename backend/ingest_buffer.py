@@ -0,0 +1,176 @@
+# ingest_buffer.py
+"""Write-behind buffer that coalesces email inserts from concurrent syncs into bulk writes."""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from metrics import registry
+from resilience import UpstreamUnavailable, deadline
+
+logger = logging.getLogger(__name__)
+
+FLUSH_ROWS = registry.histogram(
+    "mailpilot_ingest_flush_rows", "Rows written per ingest flush", [],
+    buckets=(1, 10, 25, 50, 100, 250, 500, 1000, 2500))
+FLUSH_SECONDS = registry.histogram(
+    "mailpilot_ingest_flush_seconds", "Time to write one ingest flush, splits and retries included")
+FLUSH_SPLITS = registry.counter(
+    "mailpilot_ingest_flush_splits_total", "Failed ingest writes split in half and retried")
+FAILED_ROWS = registry.counter(
+    "mailpilot_ingest_failed_rows_total", "Rows an ingest flush could not write")
+
+
+class _Pending:
+    """Rows handed in by one caller, and the outcome it is waiting for"""
+
+    __slots__ = ("rows", "done", "failed", "inserted")
+
+    def __init__(self, rows: List[Dict]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.failed: set = set()
+        self.inserted: set = set()
+
+
+class IngestBuffer:
+    """Collects rows from any number of callers and writes them in large batches.
+
+    A flush starts once `max_rows` rows are queued or the oldest queued row has
+    waited `max_delay` seconds. submit() returns only after the flush holding
+    its rows has been written, so callers report success only for rows that
+    are in the database. A batch that fails is split in half and each half
+    retried, down to single rows, so one bad row costs only itself. `write`
+    must be idempotent (an upsert that ignores duplicates), because a batch
+    whose response was lost may be written again. It returns the `key` of
+    each row it inserted, so rows that were already stored are not reported
+    as new.
+    """
+
+    def __init__(self, write: Callable[[List[Dict]], Iterable[Hashable]], key: Callable[[Dict], Hashable],
+                 max_rows: int = 500, max_delay: float = 0.02,
+                 max_batch_rows: int = 1000, flush_timeout: float = 30.0):
+        self.write = write
+        self.key = key
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_batch_rows = max_batch_rows
+        self.flush_timeout = flush_timeout
+        self._queue: List[_Pending] = []
+        self._queued_rows = 0
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._closing = False
+
+    def submit(self, rows: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """Queue rows and wait for their flush; returns (inserted, failed).
+
+        Rows in neither list were already stored.
+        """
+        if not rows:
+            return [], []
+        pending = _Pending(rows)
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("Ingest buffer is closed")
+            self._queue.append(pending)
+            self._queued_rows += len(rows)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._flush_loop, name="ingest-flush", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        pending.done.wait()
+        return ([row for row in rows if id(row) in pending.inserted],
+                [row for row in rows if id(row) in pending.failed])
+
+    def queued(self) -> int:
+        with self._cond:
+            return self._queued_rows
+
+    def close(self):
+        """Flush whatever is queued and stop the flusher"""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout=self.flush_timeout)
+
+    def _take_batch(self) -> Optional[List[_Pending]]:
+        with self._cond:
+            while not self._queue:
+                if self._closing:
+                    return None
+                self._cond.wait()
+            # Give other syncs a moment to add their rows, unless there is already enough
+            while self._queued_rows < self.max_rows and not self._closing:
+                left = self._oldest + self.max_delay - time.monotonic()
+                if left <= 0:
+                    break
+                self._cond.wait(left)
+            batch, self._queue = self._queue, []
+            self._queued_rows = 0
+            self._oldest = None
+            return batch
+
+    def _flush_loop(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            try:
+                self._flush(batch)
+            except Exception as e:
+                logger.error(f"[INGEST] Flush failed: {e}")
+                for pending in batch:
+                    pending.failed.update(id(row) for row in pending.rows)
+            finally:
+                for pending in batch:
+                    pending.done.set()
+
+    def _flush(self, batch: List[_Pending]):
+        rows = [row for pending in batch for row in pending.rows]
+        started = time.perf_counter()
+        failed: set = set()
+        inserted: set = set()
+        # The flusher thread has no request context, so each flush gets its own deadline
+        with deadline(self.flush_timeout, detach=True):
+            for start in range(0, len(rows), self.max_batch_rows):
+                failed.update(self._write_split(rows[start:start + self.max_batch_rows], inserted))
+        FLUSH_SECONDS.observe(time.perf_counter() - started)
+        FLUSH_ROWS.observe(len(inserted))
+        if failed:
+            FAILED_ROWS.inc(len(failed))
+        for pending in batch:
+            for row in pending.rows:
+                if id(row) in failed:
+                    pending.failed.add(id(row))
+                    continue
+                key = self.key(row)
+                if key in inserted:
+                    # Once only, should two callers hand in the same row
+                    inserted.discard(key)
+                    pending.inserted.add(id(row))
+        logger.debug(f"[INGEST] Flushed {len(rows) - len(failed)} rows from {len(batch)} callers")
+
+    def _write_split(self, rows: List[Dict], inserted: set) -> List[int]:
+        """Write rows, halving on failure; adds the keys of new rows to `inserted` and returns
+        id() of the rows that could not be written"""
+        try:
+            inserted.update(self.write(rows))
+            return []
+        except UpstreamUnavailable as e:
+            # Supabase is down or out of time; smaller batches would fail the same way
+            logger.warning(f"[INGEST] Could not flush {len(rows)} rows: {e}")
+            return [id(row) for row in rows]
+        except Exception as e:
+            if len(rows) == 1:
+                logger.error(f"[INGEST] Could not write row {rows[0].get('message_id')}: {e}")
+                return [id(rows[0])]
+            FLUSH_SPLITS.inc()
+            logger.warning(f"[INGEST] Write of {len(rows)} rows failed, splitting: {e}")
+            middle = len(rows) // 2
+            return self._write_split(rows[:middle], inserted) + self._write_split(rows[middle:], inserted)
@@ -0,0 +1,171 @@
+# live_events.py
+"""Per-user live events (new mail, summaries, keyword matches) pushed to open dashboards over SSE.
+
+Every event goes through a small SQLite table in STATE_DIR, which stands in for
+a pub/sub service: each worker publishes there and runs one poller thread that
+delivers rows to its own subscribers. The row id doubles as the SSE event id,
+so reconnecting clients can resume with Last-Event-ID.
+"""
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+class Subscriber:
+    """One open event stream; events are handed to its asyncio loop from the poller thread"""
+
+    def __init__(self, user_id: str, loop: asyncio.AbstractEventLoop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def _put(self, event: Dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A stalled client gets a single resync instead of an unbounded backlog
+            self.overflowed = True
+
+    def deliver(self, event: Dict):
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # loop already closed; the stream is going away
+
+
+class EventBus:
+    """SQLite-backed pub/sub shared by the workers on a host, with in-process fan-out"""
+
+    def __init__(self, path: str, poll_interval: float = 0.25, retention_seconds: float = 300.0):
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self._subscribers: Dict[str, List[Subscriber]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._last_id = 0  # highest event id already delivered (or skipped) by this worker
+        self._last_prune = 0.0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS live_events ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,"
+                " type TEXT NOT NULL, data TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS live_events_user_idx ON live_events (user_id, id)")
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def publish(self, user_id: str, event_type: str, data: Dict):
+        """Queue an event for every open stream of this user, on any worker"""
+        try:
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT INTO live_events (user_id, type, data, created_at) VALUES (?, ?, ?, ?)",
+                    (user_id, event_type, json.dumps(data, separators=(",", ":")), time.time()),
+                )
+        except sqlite3.Error as e:
+            logger.warning(f"[LIVE] Could not publish {event_type} for {user_id}: {e}")
+            return
+        # Local subscribers should not wait for the next poll
+        self._wake.set()
+
+    def subscribe(self, user_id: str, loop: asyncio.AbstractEventLoop) -> Subscriber:
+        sub = Subscriber(user_id, loop)
+        with self._lock:
+            if not self._subscribers:
+                # Nothing was polled while nobody listened; start from now, not from the backlog
+                self._last_id = max(self._last_id, self._max_id())
+            self._subscribers.setdefault(user_id, []).append(sub)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll_loop, name="live-events", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        with self._lock:
+            subs = self._subscribers.get(sub.user_id, [])
+            if sub in subs:
+                subs.remove(sub)
+            if not subs:
+                self._subscribers.pop(sub.user_id, None)
+
+    def _max_id(self) -> int:
+        try:
+            with self._connect() as conn:
+                return conn.execute("SELECT MAX(id) FROM live_events").fetchone()[0] or 0
+        except sqlite3.Error:
+            return self._last_id
+
+    def replay(self, user_id: str, after_id: int) -> List[Dict]:
+        """Retained events after `after_id`, for clients reconnecting with Last-Event-ID"""
+        try:
+            with self._connect() as conn:
+                rows = conn.execute(
+                    "SELECT id, type, data FROM live_events WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (user_id, after_id, SUBSCRIBER_QUEUE_SIZE),
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.warning(f"[LIVE] Replay failed for {user_id}: {e}")
+            return []
+        return [{"id": r[0], "type": r[1], "data": json.loads(r[2])} for r in rows]
+
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return sum(len(subs) for subs in self._subscribers.values())
+
+    def _poll_loop(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            with self._lock:
+                users = list(self._subscribers)
+            if not users:
+                continue
+            try:
+                self._deliver_new(users)
+                self._prune()
+            except Exception as e:
+                logger.error(f"[LIVE] Event poll failed: {e}")
+
+    def _deliver_new(self, users: List[str]):
+        placeholders = ",".join("?" * len(users))
+        with self._connect() as conn:
+            # Read up to a fixed high-water mark so other users' events are skipped in one step
+            latest = conn.execute("SELECT MAX(id) FROM live_events").fetchone()[0] or 0
+            if latest <= self._last_id:
+                return
+            rows = conn.execute(
+                f"SELECT id, user_id, type, data FROM live_events WHERE id > ? AND id <= ? "
+                f"AND user_id IN ({placeholders}) ORDER BY id",
+                (self._last_id, latest, *users),
+            ).fetchall()
+        self._last_id = latest
+        for event_id, user_id, event_type, data in rows:
+            event = {"id": event_id, "type": event_type, "data": json.loads(data)}
+            with self._lock:
+                subs = list(self._subscribers.get(user_id, []))
+            for sub in subs:
+                sub.deliver(event)
+
+    def _prune(self):
+        now = time.time()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        with self._connect() as conn:
+            conn.execute("DELETE FROM live_events WHERE created_at < ?", (now - self.retention_seconds,))
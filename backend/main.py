@@ -1,8 +1,8 @@
 
 def get_inbox_unread_count(access_token: str) -> int:
-    url = "https://gmail.googleapis.com/gmail/v1/users/me/labels/INBOX"
+    url = f"{gmail_api_base()}/gmail/v1/users/me/labels/INBOX"
     headers = {"Authorization": f"Bearer {access_token}"}
-    r = requests.get(url, headers=headers)
+    r = http_session.get(url, headers=headers, params={"fields": gmail_fields.LABEL_UNREAD_FIELDS})
     if r.ok:
         data = r.json()
         # Exact unread message count in the Inbox
@@ -14,21 +14,58 @@ def get_inbox_unread_count(access_token: str) -> int:
 import os
 import json
 import time
+import asyncio
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
-from fastapi import FastAPI, HTTPException, Request, BackgroundTasks
+from urllib.parse import urlencode
+from fastapi import APIRouter, Body, Depends, FastAPI, HTTPException, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, JSONResponse
-from google_auth_oauthlib.flow import Flow
-from google.auth.transport.requests import Request as GoogleRequest
-from google.oauth2.credentials import Credentials
+from fastapi.responses import (
+    FileResponse, ORJSONResponse, RedirectResponse, JSONResponse, Response, StreamingResponse,
+)
 from dotenv import load_dotenv
 import requests
-from typing import Dict, Optional, List
-from supabase import create_client, Client
+from typing import TYPE_CHECKING, Callable, Dict, Generic, Optional, List, TypeVar
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
+from analytics import SenderRollupStore, match_keywords, normalize_sender
+from gmail_batch import batch_get, gmail_api_base
+import gmail_fields
+from metadata_cache import CATEGORY_NAMES, MessageMeta, MessageMetadataCache
+from unread_counters import UnreadCounters
+from sync_jobs import SYNC_STAGES, AccountsProgress, SyncJob, SyncJobManager, SyncProgress
+from sync_coordinator import SyncCoordinator, SyncLeaseStore
+from http_client import gmail_quota, http_session, instrument_httpx_client
+from quota import BACKFILL as GMAIL_BACKFILL, SYNC, charged_to, gmail_account, priority
+from scheduler import BACKFILL, SCHEDULED, FairScheduler
+from profiling import ProfileStore, ProfilingMiddleware, instrument_routes
+from data_versions import DataVersionStore, etag_matches, make_etag
+from read_replica import EMAILS as REPLICA_EMAILS, KEYWORDS as REPLICA_KEYWORDS, ReadReplica
+from compression import CompressionMiddleware
+from change_log import ChangeLog, InvalidCursor, OP_DELETE, OP_INSERT, OP_UPDATE
+from live_events import EventBus
+from cold_storage import ColdStore, email_timestamp
+from ingest_buffer import IngestBuffer
+from email_threads import ThreadRollup, ThreadStore
+from email_bodies import BodyCache, extract_text
+from accounts import LinkedAccounts, fan_out, merge_by_date
+from sessions import SessionStore, load_secret
+from gmail_watch import (
+    PUSH_NOTIFICATIONS, PushDebouncer, PushRejected, WatchRenewer, WatchStore, parse_push, verify_push,
+)
+from email_export import FORMATS as EXPORT_FORMATS, CsvFormatter, EmailExporter, ExportFilters, ndjson_chunk
+from resilience import DeadlineMiddleware, UpstreamUnavailable, breaker_states, deadline
+if TYPE_CHECKING:
+    from google.oauth2.credentials import Credentials as GoogleCredentials
+    from supabase import Client
+from metrics import (
+    BODY_CACHE, CONTENT_TYPE as METRICS_CONTENT_TYPE, DASHBOARD_SOURCE_SECONDS, METADATA_FETCH_SECONDS,
+    SUMMARY_CACHE, SUMMARY_INFERENCE_SECONDS, registry as metrics_registry,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -37,24 +74,265 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 load_dotenv()  # loads CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, SUPABASE_URL, SUPABASE_KEY
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173").rstrip("/")
 logger.info(f"FRONTEND_URL = {FRONTEND_URL}")
 
+# Local state shared by all workers on this host (leases, caches)
+STATE_DIR = os.getenv("MAILPILOT_STATE_DIR", ".mailpilot")
+
 # Validate required environment variables
 required_env_vars = ["CLIENT_ID", "CLIENT_SECRET", "REDIRECT_URI", "SUPABASE_URL", "SUPABASE_KEY"]
-for var in required_env_vars:
-    if not os.getenv(var):
-        raise ValueError(f"Missing required environment variable: {var}")
 
-# Initialize Supabase client
-supabase: Client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+
+def validate_env():
+    for var in required_env_vars:
+        if not os.getenv(var):
+            raise ValueError(f"Missing required environment variable: {var}")
+
+
+class Lazy(Generic[T]):
+    """Object built by `factory` on first use, so importing main.py opens no clients, files or databases.
+
+    Attribute access goes to the object; `instance()` and `built()` are the only names of its own.
+    """
+
+    def __init__(self, factory: Callable[[], T], name: str):
+        self._factory = factory
+        self._name = name
+        self._value: Optional[T] = None
+        self._lock = threading.Lock()
+
+    def instance(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self._factory()
+                    logger.info(f"[STARTUP] {self._name} created")
+        return self._value
+
+    def built(self) -> bool:
+        return self._value is not None
+
+    def __getattr__(self, name):
+        return getattr(self.instance(), name)
+
+
+def create_supabase() -> "Client":
+    # Importing the supabase stack is a large share of cold start
+    from supabase import create_client
+    client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    instrument_httpx_client(client.postgrest.session)
+    return client
+
+
+supabase = Lazy(create_supabase, "Supabase client")
+
+# Emails trimmed from the hot table are archived here instead of being dropped
+cold_store = Lazy(
+    lambda: ColdStore(os.getenv("COLD_STORAGE_DIR", os.path.join(STATE_DIR, "cold"))), "Cold store")
+
+# Full bodies are fetched on demand (summaries, detail view) and kept here, never during sync
+body_cache = Lazy(lambda: BodyCache(
+    os.getenv("BODY_CACHE_DIR", os.path.join(STATE_DIR, "bodies")),
+    max_bytes=int(os.getenv("BODY_CACHE_MAX_MB", "256")) * 1024 * 1024,
+), "Body cache")
+
+def email_row_key(row: Dict) -> tuple:
+    return row["user_id"], row["message_id"]
+
+
+def write_email_rows(rows: List[Dict]) -> List[tuple]:
+    """Bulk write for the ingest buffer; returns the keys of the rows it inserted.
+
+    Ignoring duplicates makes a retried flush harmless. PostgREST returns only the rows an
+    ignore-duplicates upsert actually inserted, and only their key columns are asked for.
+    """
+    query = supabase.table("emails").upsert(rows, on_conflict="user_id,message_id", ignore_duplicates=True)
+    query.params = query.params.add("select", "user_id,message_id")
+    return [email_row_key(row) for row in query.execute().data or []]
+
+
+# Conversation rollups for thread-granularity sync (SYNC_GRANULARITY=thread)
+thread_store = ThreadStore(supabase)
+
+# New emails from all concurrent syncs are written through one buffer, in large batches
+ingest_buffer = IngestBuffer(
+    write_email_rows,
+    email_row_key,
+    max_rows=int(os.getenv("INGEST_FLUSH_ROWS", "500")),
+    max_delay=float(os.getenv("INGEST_FLUSH_DELAY_MS", "20")) / 1000,
+)
+
+# Streams GET /emails/export from Supabase (keyset pages) and then the cold tier
+email_exporter = EmailExporter(supabase, cold_store, page_size=int(os.getenv("EXPORT_PAGE_ROWS", "500")))
+
+# Sender analytics, updated incrementally by sync and trim; linked accounts count their owner's keywords
+sender_rollups = SenderRollupStore(supabase, lambda uid: get_user_keywords(owner_of(uid)), archive=cold_store)
+
+# Per-user change log for GET /emails/changes, written by sync, summaries and trim
+change_log = ChangeLog(supabase, retention_days=int(os.getenv("CHANGE_LOG_RETENTION_DAYS", "14")))
+
+GMAIL_MESSAGES_URL = f"{gmail_api_base()}/gmail/v1/users/me/messages"
+GMAIL_HISTORY_URL = f"{gmail_api_base()}/gmail/v1/users/me/history"
+METADATA_HEADERS = ["From", "Subject", "Date"]
+MESSAGE_METADATA_QUERY = urlencode(
+    [("format", "metadata")] + [("metadataHeaders", h) for h in METADATA_HEADERS]
+    + [("fields", gmail_fields.MESSAGE_FIELDS)]
+)
+
+# Shared Gmail metadata cache (message metadata never changes for a given ID)
+metadata_cache = MessageMetadataCache(
+    max_entries=int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "5000")),
+    max_bytes=int(os.getenv("METADATA_CACHE_MAX_BYTES", str(8 * 1024 * 1024))),
+)
+
+# Unread/total counts per label, refreshed at most once per TTL unless a sync sees changes
+unread_counters = UnreadCounters(ttl=float(os.getenv("UNREAD_CACHE_TTL", "60")))
+
+# Latest Gmail historyId observed per user, used to invalidate cached label data
+user_history_ids: Dict[str, int] = {}
+
+def parse_messages(user_id: str, messages: List[Dict]) -> List[MessageMeta]:
+    """Slotted records for decoded messages.get bodies, noting the newest historyId seen.
+
+    The dicts are dropped as soon as they are parsed, so only the records outlive the response.
+    """
+    records = []
+    for msg in messages:
+        try:
+            records.append(MessageMeta.from_gmail(msg))
+        except Exception as e:
+            logger.error(f"[META] Could not parse message {msg.get('id')}: {e}")
+            continue
+        history_id = int(msg.get("historyId", 0) or 0)
+        if history_id > user_history_ids.get(user_id, 0):
+            user_history_ids[user_id] = history_id
+    return records
+
+@charged_to("user_id")
+def fetch_message_metadata(access_token: str, user_id: str, message_ids: List[str]) -> List[MessageMeta]:
+    """Return metadata for message_ids (in order), fetching only cache misses from Gmail"""
+    cached, missing = metadata_cache.get_many(user_id, message_ids)
+    if missing:
+        logger.debug(f"[META] {len(cached)} cached, fetching {len(missing)} from Gmail")
+        headers = {"Authorization": f"Bearer {access_token}"}
+        records: List[MessageMeta] = []
+        batch_started = time.perf_counter()
+        # messages.get for every miss, packed into HTTP batch requests (Gmail has no messages.batchGet)
+        paths = [f"/gmail/v1/users/me/messages/{mid}?{MESSAGE_METADATA_QUERY}" for mid in missing]
+        try:
+            records.extend(parse_messages(
+                user_id, [data for status, data in batch_get(access_token, paths) if status == 200 and data]
+            ))
+        except Exception as e:
+            logger.warning(f"[META] Batch fetch error, falling back to individual requests: {e}")
+        METADATA_FETCH_SECONDS.observe(time.perf_counter() - batch_started, phase="batch")
+
+        # Individual requests for any part the batch did not return
+        still_missing = set(missing) - {meta.id for meta in records}
+        fallback_started = time.perf_counter()
+        for mid in missing:
+            if mid not in still_missing:
+                continue
+            try:
+                r_one = http_session.get(
+                    f"{GMAIL_MESSAGES_URL}/{mid}",
+                    headers=headers,
+                    params={"format": "metadata", "metadataHeaders": METADATA_HEADERS,
+                            "fields": gmail_fields.MESSAGE_FIELDS},
+                    timeout=10
+                )
+                if r_one.status_code == 200:
+                    records.extend(parse_messages(user_id, [r_one.json()]))
+                else:
+                    logger.warning(f"[META] Individual fetch failed for {mid}: {r_one.status_code}")
+            except UpstreamUnavailable as e:
+                # Gmail is failing fast or the deadline is spent; the rest would fail the same way
+                logger.warning(f"[META] Stopping individual fetches: {e}")
+                break
+            except Exception as e:
+                logger.error(f"[META] Error fetching {mid}: {e}")
+        if still_missing:
+            METADATA_FETCH_SECONDS.observe(time.perf_counter() - fallback_started, phase="fallback")
+
+        metadata_cache.put_many(user_id, records)
+        cached.update((meta.id, meta) for meta in records)
+
+    return [cached[mid] for mid in message_ids if mid in cached]
+
+@charged_to("user_id")
+def fetch_email_body(access_token: str, user_id: str, message_id: str) -> Optional[str]:
+    """Plain text of a message's body from the disk cache, or from Gmail (format=full) on a miss.
+
+    None when Gmail does not have the message. Never called on the sync path.
+    """
+    text = body_cache.get(user_id, message_id)
+    if text is not None:
+        BODY_CACHE.inc(result="hit")
+        return text
+    BODY_CACHE.inc(result="miss")
+    r = http_session.get(
+        f"{GMAIL_MESSAGES_URL}/{message_id}",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"format": "full", "fields": gmail_fields.BODY_FIELDS},
+        timeout=15
+    )
+    if r.status_code == 404:
+        return None
+    if r.status_code != 200:
+        raise RuntimeError(f"Body fetch failed for {message_id}: {r.status_code}")
+    text = extract_text(r.json().get("payload") or {})
+    body_cache.put(user_id, message_id, text)
+    return text
+
+@charged_to("user_id")
+def refresh_metadata_from_history(access_token: str, user_id: str) -> int:
+    """Drop cached label data for messages Gmail history says have changed.
+
+    Returns the number of messages touched (-1 if the history was too old to read).
+    """
+    start_history_id = user_history_ids.get(user_id)
+    if not start_history_id:
+        return 0
+    touched = 0
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {
+        "startHistoryId": start_history_id,
+        "historyTypes": ["labelAdded", "labelRemoved", "messageDeleted"],
+        "fields": gmail_fields.HISTORY_FIELDS,
+    }
+    try:
+        while True:
+            r = http_session.get(GMAIL_HISTORY_URL, headers=headers, params=params, timeout=10)
+            if r.status_code == 404:
+                # startHistoryId is too old; we can no longer tell what changed
+                metadata_cache.clear_user(user_id)
+                user_history_ids.pop(user_id, None)
+                return -1
+            if r.status_code != 200:
+                logger.warning(f"[META] History fetch failed: {r.status_code}")
+                return touched
+            data = r.json()
+            touched += metadata_cache.apply_history(user_id, data.get("history", []))
+            if data.get("historyId"):
+                user_history_ids[user_id] = int(data["historyId"])
+            if not data.get("nextPageToken"):
+                break
+            params["pageToken"] = data["nextPageToken"]
+    except Exception as e:
+        logger.warning(f"[META] History refresh error: {e}")
+    if touched:
+        logger.debug(f"[META] History invalidated {touched} cached messages for {user_id}")
+    return touched
 
 def get_label_unread(access_token, label_id):
-    url = f"https://gmail.googleapis.com/gmail/v1/users/me/labels/{label_id}"
+    url = f"{gmail_api_base()}/gmail/v1/users/me/labels/{label_id}"
     headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(url, headers=headers)
+    resp = http_session.get(url, headers=headers, params={"fields": gmail_fields.LABEL_UNREAD_FIELDS})
     if resp.ok:
         return resp.json().get("messagesUnread", 0)
     else:
@@ -69,14 +347,16 @@ def get_weekly_email_count(access_token: str) -> int:
         date_str = one_week_ago.strftime("%Y/%m/%d")
         
         # Search for emails received in the last week
-        url = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
+        url = f"{gmail_api_base()}/gmail/v1/users/me/messages"
         headers = {"Authorization": f"Bearer {access_token}"}
         params = {
             "q": f"after:{date_str}",
-            "maxResults": 1000  # Gmail API limit
+            "maxResults": 1000,  # Gmail API limit
+            # Only the estimate is read; without the mask Gmail also sends up to 1000 message IDs
+            "fields": gmail_fields.RESULT_SIZE_FIELDS,
         }
         
-        resp = requests.get(url, headers=headers, params=params)
+        resp = http_session.get(url, headers=headers, params=params)
         if resp.ok:
             data = resp.json()
             # Get the total count from resultSizeEstimate
@@ -88,7 +368,8 @@ def get_weekly_email_count(access_token: str) -> int:
         logger.error(f"Exception getting weekly email count: {e}")
         return 0
 
-def get_todays_emails(access_token: str) -> List[Dict]:
+@charged_to("user_id")
+def get_todays_emails(access_token: str, user_id: str = "demo_user") -> List[Dict]:
     """Get all emails received in the last 2 days with full details"""
     try:
         # Calculate today's date and yesterday for more inclusive search
@@ -97,14 +378,15 @@ def get_todays_emails(access_token: str) -> List[Dict]:
         yesterday = (datetime.now() - timedelta(days=1)).strftime("%Y/%m/%d")
         
         # Search for emails received in the last 2 days to be more inclusive
-        url = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
+        url = f"{gmail_api_base()}/gmail/v1/users/me/messages"
         headers = {"Authorization": f"Bearer {access_token}"}
         params = {
             "q": f"after:{yesterday}",
-            "maxResults": 50  # Limit to 50 emails for summary
+            "maxResults": 50,  # Limit to 50 emails for summary
+            "fields": gmail_fields.MESSAGE_IDS_FIELDS,
         }
         
-        resp = requests.get(url, headers=headers, params=params)
+        resp = http_session.get(url, headers=headers, params=params)
         if not resp.ok:
             logger.error(f"Error getting today's emails: {resp.status_code} - {resp.text}")
             return []
@@ -115,36 +397,16 @@ def get_todays_emails(access_token: str) -> List[Dict]:
         if not message_ids:
             return []
         
-        # Get full details for each email
+        # Get details for each email (cached records first, misses in one batch)
         emails = []
-        for msg_id in message_ids:
-            try:
-                msg_url = f"https://gmail.googleapis.com/gmail/v1/users/me/messages/{msg_id}"
-                msg_resp = requests.get(msg_url, headers=headers, params={"format": "metadata", "metadataHeaders": ["From", "Subject", "Date"]})
-                
-                if msg_resp.ok:
-                    msg_data = msg_resp.json()
-                    headers_map = {h["name"]: h["value"] for h in msg_data.get("payload", {}).get("headers", [])}
-                    
-                    from_email = headers_map.get("From", "Unknown Sender")
-                    subject = headers_map.get("Subject", "No Subject")
-                    date = headers_map.get("Date", "")
-                    snippet = msg_data.get("snippet", "")
-                    
-                    # Clean up from email
-                    if "<" in from_email and ">" in from_email:
-                        from_email = from_email.split("<")[0].strip()
-                    
-                    emails.append({
-                        "from_email": from_email,
-                        "subject": subject,
-                        "date": date,
-                        "snippet": snippet,
-                        "message_id": msg_id
-                    })
-            except Exception as e:
-                logger.error(f"Error processing email {msg_id}: {e}")
-                continue
+        for meta in fetch_message_metadata(access_token, user_id, message_ids):
+            emails.append({
+                "from_email": normalize_sender(meta.from_header),
+                "subject": meta.subject,
+                "date": meta.date_header,
+                "snippet": meta.snippet,
+                "message_id": meta.id
+            })
         
         logger.info(f"Retrieved {len(emails)} emails from today")
         return emails
@@ -153,8 +415,15 @@ def get_todays_emails(access_token: str) -> List[Dict]:
         logger.error(f"Exception getting today's emails: {e}")
         return []
 
+# Time budgets for upstream calls; see resilience.py
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "25"))
+SYNC_DEADLINE_SECONDS = float(os.getenv("SYNC_DEADLINE_SECONDS", "180"))
+SUMMARY_DEADLINE_SECONDS = float(os.getenv("SUMMARY_DEADLINE_SECONDS", "300"))
+# Summarize from the full body (one extra Gmail call per email, cached on disk) rather than the snippet
+SUMMARIZE_FROM_BODY = os.getenv("SUMMARIZE_FROM_BODY", "true").lower() in ("1", "true", "yes")
+
 # Hugging Face API configuration
-HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/facebook/bart-large-cnn"
+HUGGINGFACE_API_URL = os.getenv("HUGGINGFACE_API_URL", "https://api-inference.huggingface.co/models/facebook/bart-large-cnn")
 HUGGINGFACE_API_TOKEN = os.getenv("HUGGINGFACE_API_TOKEN")  # Optional, for higher rate limits
 
 # reCAPTCHA configuration
@@ -165,40 +434,161 @@ logger.info("Hugging Face API integration ready!")
 
 # Initialize rate limiter
 limiter = Limiter(key_func=get_remote_address)
-app = FastAPI(title="MailPilot Backend")
-app.state.limiter = limiter
-app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+
+# Routes are collected on a router; create_app() at the bottom of this file builds the app
+router = APIRouter()
+
+# Opt-in request profiling: send the X-MailPilot-Profile header or set a sample rate
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "").lower() in ("1", "true", "yes")
+profile_store = None
+if PROFILING_ENABLED:
+    profile_store = Lazy(lambda: ProfileStore(
+        os.getenv("PROFILE_DIR", os.path.join(STATE_DIR, "profiles")),
+        max_bytes=int(os.getenv("PROFILE_MAX_BYTES", str(50 * 1024 * 1024))),
+    ), "Profile store")
 # --- Health & Root endpoints ---
-@app.get("/")
+@router.get("/")
 def root():
     return {"ok": True, "service": "MailPilot"}
 
-@app.get("/healthz")
+@router.get("/healthz")
 def healthz():
     return {"ok": True}
 
 
+@router.get("/debug/upstreams")
+def debug_upstreams():
+    """Circuit breaker state for each upstream dependency, plus Gmail quota admission"""
+    return {"dependencies": breaker_states(), "gmail_quota": gmail_quota.snapshot(), "body_cache": body_cache.stats(),
+            "scheduler": work_scheduler.snapshot(), "push_pending": push_debouncer.pending(),
+            "read_replica": read_replica.stats()}
+
+
+@router.get("/metrics")
+def metrics():
+    """Prometheus text exposition of stage latencies, upstream calls and queue depths"""
+    return Response(metrics_registry.exposition(), media_type=METRICS_CONTENT_TYPE)
+
+
 # CORS - Load from environment or use defaults
 CORS_ORIGINS = os.getenv("CORS_ORIGINS", "http://localhost:5173,http://127.0.0.1:5173,https://mail-pilot-eight.vercel.app").split(",")
 CORS_ORIGINS = [origin.strip() for origin in CORS_ORIGINS]  # Clean up whitespace
 
 logger.info(f"CORS origins configured: {CORS_ORIGINS}")
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=CORS_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],   # allow all HTTP methods, including OPTIONS
-    allow_headers=["*"],   # allow all headers
-)
-
 
 SCOPES = ["https://www.googleapis.com/auth/gmail.readonly"]
 
 # In-memory storage for demo purposes (use proper database in production)
 user_tokens: Dict[str, Dict] = {}
+# Further Gmail accounts linked to a signed-in user (GET /accounts/link)
+linked_accounts = LinkedAccounts()
+
+# Per-account work for users with linked accounts runs concurrently on these pools;
+# syncs and dashboard reads get separate pools so long syncs cannot hold up a dashboard
+account_sync_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ACCOUNT_SYNC_WORKERS", "8")), thread_name_prefix="account-sync")
+account_read_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv("ACCOUNT_READ_WORKERS", "8")), thread_name_prefix="account-read")
+
+
+# Sessions map each request to its user: an HttpOnly cookie from /oauth2callback, or the same token as
+# `Authorization: Bearer`. SESSION_SECRET signs them; without it a secret is generated in STATE_DIR.
+SESSION_COOKIE = "mailpilot_session"
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", str(30 * 86400)))
+# A frontend on another site (the default deployment) only sends the cookie when it is SameSite=None; Secure
+SESSION_COOKIE_SECURE = os.getenv(
+    "SESSION_COOKIE_SECURE", str((os.getenv("REDIRECT_URI") or "").startswith("https://"))).lower() == "true"
+# Stream tokens only need to outlive the gap between minting one and opening the stream
+STREAM_TOKEN_TTL = int(os.getenv("STREAM_TOKEN_TTL_SECONDS", "60"))
+# Login codes in the sign-in redirect only need to outlive the frontend's exchange request
+LOGIN_CODE_TTL = int(os.getenv("LOGIN_CODE_TTL_SECONDS", "60"))
+SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "none" if SESSION_COOKIE_SECURE else "lax")
+
+
+def create_session_store() -> SessionStore:
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return SessionStore(
+        os.path.join(STATE_DIR, "sessions.db"),
+        os.getenv("SESSION_SECRET", "").encode() or load_secret(os.path.join(STATE_DIR, "session_secret")),
+        ttl=SESSION_TTL,
+        cache_size=int(os.getenv("SESSION_CACHE_SIZE", "10000")),
+        cache_ttl=float(os.getenv("SESSION_CACHE_TTL", "60")),
+    )
+
+
+sessions = Lazy(create_session_store, "Session store")
+
+
+def session_token(request: Request) -> Optional[str]:
+    """Session token from the Authorization header, else from the session cookie"""
+    authorization = request.headers.get("authorization", "")
+    if authorization[:7].lower() == "bearer ":
+        return authorization[7:].strip()
+    return request.cookies.get(SESSION_COOKIE)
+
+
+def session_user(request: Request) -> Optional[str]:
+    """Signed-in user making the request, or None"""
+    user_id = sessions.resolve(session_token(request))
+    # OAuth tokens are held in memory, so a session outliving a restart has to sign in again
+    return user_id if user_id in user_tokens else None
+
+
+def current_user(request: Request) -> str:
+    """Dependency for endpoints that need a signed-in user"""
+    user_id = session_user(request)
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    return user_id
+
+
+def stream_user(request: Request, stream_token: Optional[str] = None) -> str:
+    """Dependency for event streams: a session like current_user, or a token from POST /events/token
+    in the query string (EventSource cannot send an Authorization header)"""
+    user_id = session_user(request)
+    if user_id is None and stream_token:
+        user_id = sessions.resolve_stream(stream_token)
+        user_id = user_id if user_id in user_tokens else None
+    if user_id is None:
+        raise HTTPException(status_code=401, detail="User not authenticated")
+    return user_id
+
+
+def set_session_cookie(response: Response, token: str):
+    response.set_cookie(SESSION_COOKIE, token, max_age=SESSION_TTL, path="/", httponly=True,
+                        secure=SESSION_COOKIE_SECURE, samesite=SESSION_COOKIE_SAMESITE)
+
+
+def account_tokens(user_id: str) -> Dict[str, Dict]:
+    """Token data of every Gmail account of a user, the account they signed in with first"""
+    return {user_id: user_tokens[user_id], **linked_accounts.tokens(user_id)}
+
+
+def account_token_data(account: str) -> Optional[Dict]:
+    """Stored tokens of any account, signed-in or linked"""
+    if account in user_tokens:
+        return user_tokens[account]
+    owner = linked_accounts.owner_of(account)
+    return linked_accounts.tokens(owner).get(account) if owner else None
+
+
+def owner_of(account: str) -> str:
+    """MailPilot user an account's data belongs to (itself unless it is a linked account)"""
+    return linked_accounts.owner_of(account) or account
+
+
+def user_account(user_id: str, account: Optional[str]) -> str:
+    """Mailbox a single-account endpoint reads: the signed-in account by default, or one the user linked"""
+    if account is None or account == user_id:
+        return user_id
+    if account not in linked_accounts.tokens(user_id):
+        raise HTTPException(status_code=404, detail="Account not linked")
+    return account
 
 def create_flow():
+    # Only /login and /oauth2callback need the OAuth flow, so import it on demand
+    from google_auth_oauthlib.flow import Flow
     return Flow.from_client_config(
         {
             "web": {
@@ -212,10 +602,17 @@ def create_flow():
         redirect_uri=os.getenv("REDIRECT_URI")
     )
 
-def refresh_token_if_needed(credentials: Credentials) -> Optional[str]:
+def google_credentials(**kwargs) -> "GoogleCredentials":
+    """google.oauth2 Credentials; google-auth is imported on first use to keep cold starts short"""
+    from google.oauth2.credentials import Credentials
+    return Credentials(**kwargs)
+
+
+def refresh_token_if_needed(credentials: "GoogleCredentials") -> Optional[str]:
     """Refresh token if expired and return new access token"""
     try:
         if credentials.expired and credentials.refresh_token:
+            from google.auth.transport.requests import Request as GoogleRequest
             credentials.refresh(GoogleRequest())
             return credentials.token
         return credentials.token
@@ -223,6 +620,18 @@ def refresh_token_if_needed(credentials: Credentials) -> Optional[str]:
         logger.error(f"Token refresh failed: {e}")
         return None
 
+def access_token_for(token_data: Dict) -> Optional[str]:
+    """Current access token for stored token data, refreshed if it has expired"""
+    credentials = google_credentials(
+        token=token_data["access_token"],
+        refresh_token=token_data["refresh_token"],
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id=os.getenv("CLIENT_ID"),
+        client_secret=os.getenv("CLIENT_SECRET"),
+        scopes=token_data["scopes"]
+    )
+    return refresh_token_if_needed(credentials)
+
 def verify_recaptcha(recaptcha_response: str, remote_ip: str) -> bool:
     """Verify reCAPTCHA response with Google"""
     if not RECAPTCHA_SECRET_KEY:
@@ -236,7 +645,7 @@ def verify_recaptcha(recaptcha_response: str, remote_ip: str) -> bool:
             'remoteip': remote_ip
         }
         
-        response = requests.post(RECAPTCHA_VERIFY_URL, data=data, timeout=10)
+        response = http_session.post(RECAPTCHA_VERIFY_URL, data=data, timeout=10)
         result = response.json()
         
         logger.debug(f"reCAPTCHA verification result: {result}")
@@ -249,8 +658,107 @@ def verify_recaptcha(recaptcha_response: str, remote_ip: str) -> bool:
 # Rate limiting storage (in production, use Redis)
 sync_attempts = {}
 
-def trim_old_emails(user_id: str):
-    """Keep only the last MAX_EMAILS_PER_USER emails for a user"""
+# Background work (sync jobs, deferred summaries) shares one pool, scheduled fairly across users:
+# each user gets an equal turn within a class however much work they have queued
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "8"))
+work_scheduler = FairScheduler(SCHEDULER_WORKERS, caps={
+    "interactive": int(os.getenv("SYNC_JOB_WORKERS", "4")),
+    "scheduled": int(os.getenv("SCHEDULED_WORKERS", "4")),
+    "backfill": int(os.getenv("BACKFILL_WORKERS", "2")),
+}, name="work")
+# Emails per deferred summary task; a user's first task is scheduled work, the rest backfill
+SUMMARY_TASK_EMAILS = int(os.getenv("SUMMARY_TASK_EMAILS", "10"))
+
+# Gmail push: users.watch publishes mailbox changes to GMAIL_WATCH_TOPIC (projects/<p>/topics/<t>),
+# and Pub/Sub pushes them to POST /gmail/push. Off unless a topic is configured.
+GMAIL_WATCH_TOPIC = os.getenv("GMAIL_WATCH_TOPIC")
+# Pushes are accepted when HMAC-signed with PUSH_SHARED_SECRET (local stand-in, relays) or when they
+# carry a Google OIDC token for PUSH_AUDIENCE (a Pub/Sub push subscription with authentication)
+PUSH_SHARED_SECRET = os.getenv("PUSH_SHARED_SECRET")
+PUSH_AUDIENCE = os.getenv("PUSH_AUDIENCE")
+PUSH_SERVICE_ACCOUNT = os.getenv("PUSH_SERVICE_ACCOUNT")
+watch_store = Lazy(lambda: WatchStore(os.path.join(STATE_DIR, "gmail_watches.db")), "Watch store")
+push_debouncer = PushDebouncer(
+    lambda account, history_id: work_scheduler.submit(owner_of(account), SCHEDULED, run_push_sync, account, history_id),
+    delay=float(os.getenv("PUSH_DEBOUNCE_SECONDS", "2")),
+)
+watch_renewer = WatchRenewer(watch_store, lambda account: renew_watch(account),
+                             interval=float(os.getenv("WATCH_RENEW_INTERVAL_SECONDS", "3600")))
+
+# Manual syncs run as background jobs so requests return immediately
+# Gmail calls from jobs go through the quota controller, so several can run at once safely
+sync_jobs = SyncJobManager(work_scheduler)
+
+# Queue depths and cache sizes are read at scrape time
+metrics_registry.gauge("mailpilot_scheduler_queued", "Tasks waiting in the fair scheduler by class", ["priority"],
+                       callback=lambda: {(k,): v["queued"] for k, v in work_scheduler.snapshot().items()})
+metrics_registry.gauge("mailpilot_scheduler_running", "Tasks running in the fair scheduler by class", ["priority"],
+                       callback=lambda: {(k,): v["running"] for k, v in work_scheduler.snapshot().items()})
+metrics_registry.gauge("mailpilot_sync_jobs", "Unfinished sync jobs by status", ["status"],
+                       callback=lambda: {(k,): v for k, v in sync_jobs.counts().items()})
+metrics_registry.gauge("mailpilot_live_event_subscribers", "Open /events streams in this worker",
+                       callback=lambda: {(): live_events.subscriber_count() if live_events.built() else 0})
+metrics_registry.gauge("mailpilot_syncs_in_flight", "Syncs currently running in this process",
+                       callback=lambda: {(): sync_coordinator.in_flight()})
+metrics_registry.gauge("mailpilot_metadata_cache", "Message metadata cache size", ["unit"],
+                       callback=lambda: {("entries",): metadata_cache.stats()["entries"],
+                                         ("bytes",): metadata_cache.stats()["bytes"]})
+
+# One sync per user at a time, in this process and across workers
+sync_coordinator = SyncCoordinator(
+    Lazy(lambda: SyncLeaseStore(os.path.join(STATE_DIR, "sync_leases.db")), "Sync lease store"),
+    lease_ttl=float(os.getenv("SYNC_LEASE_TTL", "300")),
+)
+
+# Per-user data version behind the ETags of /dashboard, /keywords and /analytics/senders;
+# bumped by syncs, trims, summaries and keyword writes
+data_versions = Lazy(
+    lambda: DataVersionStore(os.path.join(STATE_DIR, "data_versions.db")), "Data version store")
+# This worker's in-memory copy of its users' emails and keywords (READ_REPLICA_MAX_USERS=0 turns it off)
+read_replica = ReadReplica(
+    max_users=int(os.getenv("READ_REPLICA_MAX_USERS", "200")),
+    max_rows=int(os.getenv("READ_REPLICA_MAX_ROWS", "1000")),
+)
+
+
+def record_change(user_id: str, **changes):
+    """Bump the user's data version and replay the change into this worker's read replica.
+
+    `changes` are ReadReplica.apply arguments; none means nothing replicated changed.
+    """
+    read_replica.apply(user_id, data_versions.bump(user_id), **changes)
+
+# Live events for open dashboards (GET /events), fanned out across workers through STATE_DIR
+live_events = Lazy(lambda: EventBus(
+    os.path.join(STATE_DIR, "live_events.db"),
+    poll_interval=float(os.getenv("LIVE_EVENTS_POLL_INTERVAL", "0.25")),
+), "Live event bus")
+LIVE_EVENT_MAX_EMAILS = 20
+
+
+def publish_new_emails(user_id: str, emails: List[Dict]):
+    """Push compact events for freshly stored emails, plus the ones matching the user's keywords"""
+    live_events.publish(owner_of(user_id), "emails.inserted", {
+        "count": len(emails),
+        "emails": [
+            {"id": e["message_id"], "from": e["from_email"], "subject": e["subject"], "date": e["date"]}
+            for e in emails[:LIVE_EVENT_MAX_EMAILS]
+        ],
+    })
+    keywords = get_user_keywords(user_id)
+    matches = []
+    for email in emails:
+        matched = match_keywords(email, keywords) if keywords else []
+        if matched:
+            matches.append({"id": email["message_id"], "subject": email["subject"], "keywords": matched})
+    if matches:
+        live_events.publish(owner_of(user_id), "keywords.matched", {"matches": matches[:LIVE_EVENT_MAX_EMAILS]})
+
+TRIM_DELETE_CHUNK = 200
+
+
+def trim_old_emails(user_id: str) -> int:
+    """Move all but the last MAX_EMAILS_PER_USER emails of a user to the cold tier; returns how many moved"""
     try:
         # Get the cutoff email date (the N-th newest)
         result = (
@@ -264,23 +772,51 @@ def trim_old_emails(user_id: str):
         )
 
         if not result.data:
-            return  # nothing to trim
+            return 0  # nothing to trim
 
         cutoff_date = result.data[0]["date"]
 
-        # Delete all emails older than cutoff
-        (
+        # Archive first, then delete exactly the archived rows: a failure in between
+        # leaves a row in both tiers (readers dedupe) rather than in neither
+        evicted = (
             supabase.table("emails")
-            .delete()
+            .select("*")
             .eq("user_id", user_id)
             .lt("date", cutoff_date)
             .execute()
-        )
+        ).data or []
+        if not evicted:
+            change_log.prune(user_id)
+            return 0
+        cold_store.append(user_id, evicted)
+
+        deleted = []
+        ids = [row["message_id"] for row in evicted]
+        for start in range(0, len(ids), TRIM_DELETE_CHUNK):
+            chunk = (
+                supabase.table("emails")
+                .delete()
+                .eq("user_id", user_id)
+                .in_("message_id", ids[start:start + TRIM_DELETE_CHUNK])
+                .execute()
+            )
+            deleted.extend(chunk.data or [])
+
+        if deleted:
+            sender_rollups.apply_deletes(user_id, deleted)
+            if SYNC_GRANULARITY == "thread":
+                thread_store.delete_orphans(user_id, sorted({r["thread_id"] for r in deleted if r.get("thread_id")}))
+            change_log.record(user_id, OP_DELETE, [row["message_id"] for row in deleted])
+            record_change(user_id, deleted=[row["message_id"] for row in deleted])
+            live_events.publish(owner_of(user_id), "emails.deleted", {"ids": [row["message_id"] for row in deleted]})
+        change_log.prune(user_id)
 
-        logger.info(f"Trimmed old emails for {user_id}, kept {MAX_EMAILS_PER_USER}")
+        logger.info(f"Archived {len(evicted)} old emails for {user_id}, kept {MAX_EMAILS_PER_USER}")
+        return len(deleted)
 
     except Exception as e:
         logger.error(f"Trim error for {user_id}: {e}")
+        return 0
 
 
 def check_sync_rate_limit(user_id: str) -> bool:
@@ -307,78 +843,53 @@ from email.utils import parsedate_to_datetime
 
 MAX_EMAILS_PER_USER = 500   # how many emails to keep per user
 TARGET_FETCH = 10           # how many emails to fetch each sync
+# "message" stores every message; "thread" stores one row per conversation and summarizes per thread revision
+SYNC_GRANULARITY = os.getenv("SYNC_GRANULARITY", "message")
 BATCH_SIZE = 10
 
 
-def sync_emails_from_gmail(access_token: str, user_id: str = "demo_user", background_tasks: BackgroundTasks = None) -> dict:
-    """Fast Gmail sync: insert/update emails quickly, summaries filled later in background."""
+@charged_to("user_id")
+def sync_emails_from_gmail(access_token: str, user_id: str = "demo_user", background_tasks: BackgroundTasks = None,
+                           progress: Optional[SyncProgress] = None, summarize_inline: bool = False) -> dict:
+    """Fast Gmail sync: insert/update emails quickly, summaries filled later in background.
+
+    Sync jobs already run off the request path, so they pass summarize_inline
+    to summarize newly inserted emails before reporting completion.
+    """
+    if SYNC_GRANULARITY == "thread":
+        return sync_threads_from_gmail(access_token, user_id, background_tasks, progress, summarize_inline)
+
     headers = {"Authorization": f"Bearer {access_token}"}
-    base_url = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
+    base_url = f"{gmail_api_base()}/gmail/v1/users/me/messages"
+    progress = progress or SyncProgress()
 
     try:
         # --- Step 1: List message IDs ---
-        r = requests.get(
+        progress.begin("list")
+        r = http_session.get(
             base_url,
             headers=headers,
-            params={"maxResults": TARGET_FETCH, "q": "in:inbox"},
+            params={"maxResults": TARGET_FETCH, "q": "in:inbox", "fields": gmail_fields.MESSAGE_IDS_FIELDS},
             timeout=10
         )
         if r.status_code != 200:
             return {"error": f"Failed to fetch Gmail messages: {r.text}"}
 
         ids = [m["id"] for m in r.json().get("messages", [])]
+        progress.done("list", len(ids))
         if not ids:
             return {"error": "No emails found"}
 
         logger.info(f"[SYNC] Collected {len(ids)} message IDs from Gmail")
 
-        # --- Step 2: Batch metadata fetch ---
-        r = requests.post(
-            f"{base_url}/batchGet",
-            headers={**headers, "Content-Type": "application/json"},
-            json={"ids": ids, "format": "metadata", "metadataHeaders": ["From", "Subject", "Date"]},
-            timeout=15
-        )
-
-        messages_full = []
-        if r.status_code == 200:
-            messages_full = r.json().get("messages", []) or []
-            logger.debug(f"[SYNC] BatchGet returned {len(messages_full)} messages")
-
-            # Fallback for missing messages
-            if len(messages_full) < len(ids):
-                missing_ids = list(set(ids) - {m.get("id") for m in messages_full})
-                logger.info(f"[SYNC] BatchGet missed {len(missing_ids)} messages, fetching individually...")
-                for mid in missing_ids:
-                    try:
-                        r_one = requests.get(
-                            f"{base_url}/{mid}",
-                            headers=headers,
-                            params={"format": "metadata", "metadataHeaders": ["From", "Subject", "Date"]},
-                            timeout=10
-                        )
-                        if r_one.status_code == 200:
-                            messages_full.append(r_one.json())
-                        else:
-                            logger.warning(f"[SYNC] Individual fetch failed for {mid}: {r_one.status_code}")
-                    except Exception as e:
-                        logger.error(f"[SYNC] Error fetching {mid}: {e}")
-        else:
-            logger.warning(f"[SYNC] Batch fetch failed with {r.status_code}, falling back to individual requests")
-            for i, mid in enumerate(ids):
-                if i % 10 == 0:
-                    logger.debug(f"[SYNC] Fallback progress: {i}/{len(ids)}")
-                try:
-                    r_one = requests.get(
-                        f"{base_url}/{mid}",
-                        headers=headers,
-                        params={"format": "metadata", "metadataHeaders": ["From", "Subject", "Date"]},
-                        timeout=10
-                    )
-                    if r_one.status_code == 200:
-                        messages_full.append(r_one.json())
-                except Exception as e:
-                    logger.error(f"[SYNC] Error fetching {mid}: {e}")
+        # --- Step 2: Metadata fetch (cache first, misses in one batch) ---
+        progress.begin("fetch")
+        if refresh_metadata_from_history(access_token, user_id):
+            # Labels changed since the last sync, so cached unread counts are out of date
+            unread_counters.mark_stale(user_id)
+            record_change(user_id)
+        messages_full = fetch_message_metadata(access_token, user_id, ids)
+        progress.done("fetch", len(messages_full))
 
         logger.info(f"[SYNC] Retrieved {len(messages_full)} messages from Gmail")
 
@@ -387,43 +898,38 @@ def sync_emails_from_gmail(access_token: str, user_id: str = "demo_user", backgr
 
         # Log first few email subjects
         logger.debug(f"[SYNC] Sample of fetched emails:")
-        for i, msg in enumerate(messages_full[:5]):
-            headers_map = {h["name"]: h["value"] for h in msg.get("payload", {}).get("headers", [])}
-            subject = headers_map.get("Subject", "No Subject")
-            from_email = headers_map.get("From", "Unknown Sender")
-            logger.debug(f"  {i+1}. {from_email} | {subject}")
+        for i, meta in enumerate(messages_full[:5]):
+            logger.debug(f"  {i+1}. {meta.from_header} | {meta.subject}")
         
 
         # --- Step 3: Normalize ---
+        progress.begin("normalize")
         emails_to_store = []
-        for msg in messages_full:
-            msg_id = msg["id"]
-            headers_map = {h["name"]: h["value"] for h in msg.get("payload", {}).get("headers", [])}
-            from_email = headers_map.get("From", "Unknown Sender")
-            subject = headers_map.get("Subject", "No Subject")
-            snippet = msg.get("snippet", "")
-            internal_ts = int(msg.get("internalDate", 0)) / 1000
-            parsed_date = datetime.fromtimestamp(internal_ts, tz=timezone.utc)
-
-            if "<" in from_email and ">" in from_email:
-                from_email = from_email.split("<")[0].strip()
+        for meta in messages_full:
+            parsed_date = datetime.fromtimestamp(meta.internal_date / 1000, tz=timezone.utc)
 
             emails_to_store.append({
-                "message_id": msg_id,
-                "from_email": from_email,
-                "subject": subject,
+                "message_id": meta.id,
+                "from_email": normalize_sender(meta.from_header),
+                "subject": meta.subject,
                 "date": parsed_date.isoformat(),
-                "snippet": snippet,
+                "snippet": meta.snippet,
                 "summary": None,  # fill later
+                "category": meta.category,
+                "thread_id": meta.thread_id,
                 "user_id": user_id,
                 "created_at": datetime.now(timezone.utc).isoformat(),
             })
 
+        progress.done("normalize", len(emails_to_store))
         logger.debug(f"[SYNC] Normalized {len(emails_to_store)} messages")
 
         # --- Step 4: Insert into Supabase (with manual dedup) ---
+        progress.begin("insert")
+        inserted = []
         if emails_to_store:
             # First, get existing message IDs to avoid duplicates
+            progress.begin("dedup")
             existing_ids = set()
             try:
                 existing_result = supabase.table("emails").select("message_id, subject").eq("user_id", user_id).execute()
@@ -441,6 +947,7 @@ def sync_emails_from_gmail(access_token: str, user_id: str = "demo_user", backgr
             
             # Filter out emails that already exist
             new_emails = [email for email in emails_to_store if email["message_id"] not in existing_ids]
+            progress.done("dedup", len(new_emails))
             logger.info(f"[SYNC] {len(new_emails)} new emails to insert (filtered from {len(emails_to_store)})")
             
             # Log which emails are being filtered out
@@ -458,39 +965,48 @@ def sync_emails_from_gmail(access_token: str, user_id: str = "demo_user", backgr
             
             
             if new_emails:
-                # Insert new emails in batches
-                batch_size = 10
-                for i in range(0, len(new_emails), batch_size):
-                    batch = new_emails[i:i + batch_size]
-                    try:
-                        supabase.table("emails").insert(batch).execute()
-                        logger.info(f"[SYNC] Inserted batch {i//batch_size + 1}: {len(batch)} emails")
-                    except Exception as e:
-                        logger.error(f"[SYNC] Error inserting batch {i//batch_size + 1}: {e}")
-                        # Try inserting one by one if batch fails
-                        for email in batch:
-                            try:
-                                supabase.table("emails").insert([email]).execute()
-                                logger.debug(f"[SYNC] Inserted individual email: {email['subject'][:30]}...")
-                            except Exception as e2:
-                                logger.error(f"[SYNC] Failed to insert individual email: {e2}")
+                # Shared with concurrent syncs; returns once our rows are written (or have failed)
+                inserted, failed = ingest_buffer.submit(new_emails)
+                logger.info(f"[SYNC] Inserted {len(inserted)} emails")
+                if failed:
+                    logger.error(f"[SYNC] {len(failed)} emails could not be inserted")
+                if len(inserted) + len(failed) < len(new_emails):
+                    logger.info(f"[SYNC] {len(new_emails) - len(inserted) - len(failed)} emails were already stored")
+
+                sender_rollups.apply_inserts(user_id, inserted)
+                if inserted:
+                    change_log.record(user_id, OP_INSERT, [email["message_id"] for email in inserted])
+                    unread_counters.mark_stale(user_id)
+                    record_change(user_id, inserted=inserted)
+                    publish_new_emails(user_id, inserted)
             else:
                 logger.debug(f"[SYNC] No new emails to insert")
 
+        progress.done("insert", len(inserted))
+
         # --- Step 5: Background summaries ---
         if background_tasks and emails_to_store:
-            background_tasks.add_task(
-                generate_summaries_in_background,
-                user_id,
-                [row["message_id"] for row in emails_to_store]
-            )
+            schedule_summaries(user_id, [row["message_id"] for row in emails_to_store],
+                               lambda ids: generate_summaries_in_background(user_id, ids, access_token))
+            progress.skip("summarize")
+        elif summarize_inline:
+            progress.begin("summarize")
+            generate_summaries_in_background(user_id, [row["message_id"] for row in inserted], access_token)
+            progress.done("summarize", len(inserted))
+        else:
+            progress.skip("summarize")
 
-        # --- Step 6: Trim old emails ---
-        trim_old_emails(user_id)
+        # --- Step 6: Trim old emails (only inserts can push a user over the cap) ---
+        if inserted:
+            progress.begin("trim")
+            progress.done("trim", trim_old_emails(user_id))
+        else:
+            progress.skip("trim")
 
         return {
             "success": True,
             "emails_synced": len(emails_to_store),
+            "emails_inserted": len(inserted),
             "gmail_ids_seen": len(ids),
         }
 
@@ -500,26 +1016,319 @@ def sync_emails_from_gmail(access_token: str, user_id: str = "demo_user", backgr
 
 
 
-def generate_summaries_in_background(user_id: str, message_ids: list):
-    """Slow background task: generate summaries and update Supabase."""
-    logger.info(f"[BG] Summarizing {len(message_ids)} emails for {user_id}...")
-    for mid in message_ids:
+def coordinated_sync(access_token: str, account: str, background_tasks: BackgroundTasks = None,
+                     progress: Optional[SyncProgress] = None, summarize_inline: bool = False) -> dict:
+    """sync_emails_from_gmail through the sync coordinator"""
+    result = sync_coordinator.run(account, lambda: sync_emails_from_gmail(
+        access_token, account, background_tasks, progress, summarize_inline))
+    if result.get("coalesced") and progress is not None:
+        # Another caller's run was shared, so none of this caller's stages ran
+        for stage in SYNC_STAGES:
+            progress.skip(stage)
+    return result
+
+
+def sync_accounts(user_id: str, access_tokens: Dict[str, Optional[str]], background_tasks: BackgroundTasks = None,
+                  progress: Optional[SyncProgress] = None, summarize_inline: bool = False) -> dict:
+    """Sync every Gmail account of a user at once; takes about as long as the slowest account.
+
+    Each account syncs into its own rows under its own sync lease and Gmail
+    quota. A user with a single account gets that account's result unchanged.
+    """
+    if len(access_tokens) == 1:
+        ((account, token),) = access_tokens.items()
+        return coordinated_sync(token, account, background_tasks, progress, summarize_inline)
+
+    fanned = AccountsProgress(progress or SyncProgress(), list(access_tokens))
+
+    def sync_one(account: str) -> dict:
+        token = access_tokens[account]
+        if not token:
+            return {"error": "Token refresh failed"}
+        return coordinated_sync(token, account, background_tasks, fanned.for_account(account), summarize_inline)
+
+    started = time.perf_counter()
+    results = {account: result or {"error": "Sync crashed"}
+               for account, result in fan_out(account_sync_pool, sync_one, access_tokens).items()}
+    logger.info(f"[ACCOUNTS] Synced {len(results)} accounts for {user_id} in {time.perf_counter() - started:.2f}s")
+    succeeded = [r for r in results.values() if "error" not in r]
+    summary = {
+        "success": bool(succeeded),
+        "accounts": results,
+        "emails_synced": sum(r.get("emails_synced", 0) for r in succeeded),
+        "emails_inserted": sum(r.get("emails_inserted", 0) for r in succeeded),
+    }
+    if not succeeded:
+        summary["error"] = "Sync failed for every account"
+    return summary
+
+
+THREAD_METADATA_QUERY = urlencode(
+    [("format", "metadata")] + [("metadataHeaders", h) for h in METADATA_HEADERS]
+    + [("fields", gmail_fields.THREAD_FIELDS)]
+)
+
+
+def fetch_threads(access_token: str, thread_ids: List[str]) -> List[ThreadRollup]:
+    """threads.get (metadata) for each thread, packed into batch requests"""
+    paths = [f"/gmail/v1/users/me/threads/{tid}?{THREAD_METADATA_QUERY}" for tid in thread_ids]
+    headers = {"Authorization": f"Bearer {access_token}"}
+    rollups = []
+    for tid, (status, data) in zip(thread_ids, batch_get(access_token, paths)):
+        if status != 200 or not data:
+            try:
+                r = http_session.get(f"{gmail_api_base()}/gmail/v1/users/me/threads/{tid}", headers=headers,
+                                     params={"format": "metadata", "metadataHeaders": METADATA_HEADERS,
+                                             "fields": gmail_fields.THREAD_FIELDS}, timeout=10)
+            except UpstreamUnavailable as e:
+                logger.warning(f"[THREADS] Stopping individual fetches: {e}")
+                break
+            if r.status_code != 200:
+                logger.warning(f"[THREADS] Fetch failed for thread {tid}: {r.status_code}")
+                continue
+            data = r.json()
         try:
-            resp = supabase.table("emails").select("*").eq("user_id", user_id).eq("message_id", mid).single().execute()
-            if not resp.data:
+            rollups.append(ThreadRollup.from_gmail(data))
+        except (KeyError, ValueError) as e:
+            logger.error(f"[THREADS] Could not parse thread {tid}: {e}")
+    return rollups
+
+
+@charged_to("user_id")
+def sync_threads_from_gmail(access_token: str, user_id: str, background_tasks: BackgroundTasks = None,
+                            progress: Optional[SyncProgress] = None, summarize_inline: bool = False) -> dict:
+    """Thread-granularity sync: one emails row per conversation, refetched only when the thread changed"""
+    progress = progress or SyncProgress()
+    try:
+        # --- Step 1: List threads (each carries its current historyId) ---
+        progress.begin("list")
+        r = http_session.get(
+            f"{gmail_api_base()}/gmail/v1/users/me/threads",
+            headers={"Authorization": f"Bearer {access_token}"},
+            params={"maxResults": TARGET_FETCH, "q": "in:inbox", "fields": gmail_fields.THREAD_LIST_FIELDS},
+            timeout=10
+        )
+        if r.status_code != 200:
+            return {"error": f"Failed to fetch Gmail threads: {r.text}"}
+        listed = r.json().get("threads", [])
+        progress.done("list", len(listed))
+        if not listed:
+            return {"error": "No emails found"}
+
+        # --- Step 2: Fetch only threads whose revision moved since the last sync ---
+        progress.begin("fetch")
+        stored = thread_store.revisions(user_id, [t["id"] for t in listed])
+        changed = [
+            t["id"] for t in listed
+            if int(t.get("historyId", 0) or 0) > int((stored.get(t["id"]) or {}).get("history_id") or 0)
+        ]
+        threads = fetch_threads(access_token, changed) if changed else []
+        progress.done("fetch", len(threads))
+        logger.info(f"[THREADS] {len(listed)} threads listed, {len(changed)} changed, {len(threads)} fetched")
+
+        # --- Step 3: Normalize to one row per conversation ---
+        progress.begin("normalize")
+        latest_rows = {t.id: t.email_row(user_id) for t in threads}
+        progress.done("normalize", len(latest_rows))
+
+        # --- Step 4: Store rollups, replace each conversation's row with its latest message ---
+        progress.begin("insert")
+        inserted, replaced = [], []
+        if threads:
+            existing = (
+                supabase.table("emails")
+                .select("message_id,thread_id,from_email,subject,snippet,date")
+                .eq("user_id", user_id)
+                .in_("thread_id", list(latest_rows))
+                .execute()
+            ).data or []
+            current = {row["message_id"] for row in existing}
+            replaced = [row for row in existing if row["message_id"] != latest_rows[row["thread_id"]]["message_id"]]
+            inserted, failed = ingest_buffer.submit(
+                [row for row in latest_rows.values() if row["message_id"] not in current])
+            # Record a revision only once its row is stored, so a failed insert is refetched next time
+            failed_ids = {row["message_id"] for row in failed}
+            stored_ids = ({row["message_id"] for row in latest_rows.values()} - failed_ids) | current
+            thread_store.upsert(user_id, [t for t in threads if t.latest.id in stored_ids])
+            if replaced:
+                supabase.table("emails").delete().eq("user_id", user_id).in_(
+                    "message_id", [row["message_id"] for row in replaced]).execute()
+                sender_rollups.apply_deletes(user_id, replaced)
+                change_log.record(user_id, OP_DELETE, [row["message_id"] for row in replaced])
+                live_events.publish(owner_of(user_id), "emails.deleted", {"ids": [row["message_id"] for row in replaced]})
+            if inserted:
+                sender_rollups.apply_inserts(user_id, inserted)
+                change_log.record(user_id, OP_INSERT, [row["message_id"] for row in inserted])
+                publish_new_emails(user_id, inserted)
+            if inserted or replaced:
+                unread_counters.mark_stale(user_id)
+                record_change(user_id, inserted=inserted, deleted=[row["message_id"] for row in replaced])
+        progress.done("insert", len(inserted))
+
+        # --- Step 5: One summary per thread revision ---
+        pending = thread_store.needing_summary(user_id, [t["id"] for t in listed])
+        if pending and background_tasks:
+            schedule_summaries(user_id, pending, lambda ids: generate_thread_summaries(user_id, access_token, ids))
+            progress.skip("summarize")
+        elif pending and summarize_inline:
+            progress.begin("summarize")
+            progress.done("summarize", generate_thread_summaries(user_id, access_token, pending, threads))
+        else:
+            progress.skip("summarize")
+
+        # --- Step 6: Trim old conversations ---
+        if inserted:
+            progress.begin("trim")
+            progress.done("trim", trim_old_emails(user_id))
+        else:
+            progress.skip("trim")
+
+        return {
+            "success": True,
+            "threads_listed": len(listed),
+            "threads_changed": len(changed),
+            "emails_synced": len(latest_rows),
+            "emails_inserted": len(inserted),
+            "emails_replaced": len(replaced),
+        }
+
+    except Exception as e:
+        logger.error(f"[THREADS] Fatal error: {e}")
+        return {"error": f"Sync failed: {str(e)}"}
+
+
+def generate_thread_summaries(user_id: str, access_token: str, thread_ids: List[str],
+                              fetched: Optional[List[ThreadRollup]] = None) -> int:
+    """Summarize each thread's current revision once; the summary also goes on its latest emails row"""
+    by_id = {t.id: t for t in fetched or []}
+    missing = [tid for tid in thread_ids if tid not in by_id]
+    if missing:
+        by_id.update((t.id, t) for t in fetch_threads(access_token, missing))
+    summarized: Dict[str, str] = {}
+    with deadline(SUMMARY_DEADLINE_SECONDS, detach=True):
+        for tid in thread_ids:
+            thread = by_id.get(tid)
+            if thread is None:
                 continue
+            try:
+                SUMMARY_CACHE.inc(result="miss")
+                body = summary_body(access_token, user_id, thread.latest.id)
+                summary = generate_email_summary(thread.messages[0].subject, thread.summary_input(body))
+                thread_store.set_summary(user_id, tid, summary, thread.history_id)
+                supabase.table("emails").update({"summary": summary}).eq("user_id", user_id).eq(
+                    "message_id", thread.latest.id).execute()
+                summarized[thread.latest.id] = summary
+                live_events.publish(owner_of(user_id), "summary.updated", {"id": thread.latest.id, "summary": summary})
+            except UpstreamUnavailable as e:
+                logger.warning(f"[THREADS] Stopping summaries for {user_id}: {e}")
+                break
+            except Exception as e:
+                logger.error(f"[THREADS] Error summarizing thread {tid}: {e}")
+    if summarized:
+        change_log.record(user_id, OP_UPDATE, list(summarized))
+        record_change(user_id, summaries=summarized)
+    return len(summarized)
 
-            email = resp.data
-            summary = generate_email_summary(email["subject"], email["snippet"])
 
-            supabase.table("emails").update({"summary": summary}).eq("message_id", mid).execute()
-            logger.debug(f"[BG] Done: {email['subject'][:40]}...")
-        except Exception as e:
-            logger.error(f"[BG] Error summarizing {mid}: {e}")
+def summary_body(access_token: Optional[str], user_id: str, message_id: str) -> Optional[str]:
+    """Body text for a summary, or None to summarize from the snippet"""
+    if not access_token or not SUMMARIZE_FROM_BODY:
+        return None
+    try:
+        return fetch_email_body(access_token, user_id, message_id)
+    except UpstreamUnavailable:
+        raise
+    except Exception as e:
+        logger.warning(f"[BG] No body for {message_id}, using snippet: {e}")
+        return None
+
+
+def schedule_summaries(user_id: str, ids: List[str], summarize: Callable[[List[str]], object]):
+    """Queue summaries on the fair scheduler in small tasks, so a large backlog takes turns with other users"""
+    for start in range(0, len(ids), SUMMARY_TASK_EMAILS):
+        backfill = start > 0
+        work_scheduler.submit(
+            owner_of(user_id), BACKFILL if backfill else SCHEDULED,
+            run_with_gmail_priority, GMAIL_BACKFILL if backfill else SYNC, summarize, ids[start:start + SUMMARY_TASK_EMAILS]
+        )
+
+
+def run_with_gmail_priority(gmail_class: str, fn: Callable, *args):
+    with priority(gmail_class):
+        return fn(*args)
+
+
+def generate_summaries_in_background(user_id: str, message_ids: list, access_token: Optional[str] = None):
+    """Slow background task: generate summaries and update Supabase.
+
+    With an access token, each email is summarized from its full body (fetched
+    lazily through the body cache) instead of the snippet.
+    """
+    logger.info(f"[BG] Summarizing {len(message_ids)} emails for {user_id}...")
+    updated: Dict[str, str] = {}
+    # Runs after the response has gone out, so it gets its own time budget rather than the request's
+    with deadline(SUMMARY_DEADLINE_SECONDS, detach=True):
+        for mid in message_ids:
+            try:
+                resp = supabase.table("emails").select("*").eq("user_id", user_id).eq("message_id", mid).single().execute()
+                if not resp.data:
+                    continue
+
+                email = resp.data
+                if email.get("summary"):
+                    # Already summarized by an earlier run; skip the inference call
+                    SUMMARY_CACHE.inc(result="hit")
+                    continue
+                SUMMARY_CACHE.inc(result="miss")
+                summary = generate_email_summary(email["subject"], email["snippet"],
+                                                 summary_body(access_token, user_id, mid))
+
+                supabase.table("emails").update({"summary": summary}).eq("message_id", mid).execute()
+                updated[mid] = summary
+                live_events.publish(owner_of(user_id), "summary.updated", {"id": mid, "summary": summary})
+                logger.debug(f"[BG] Done: {email['subject'][:40]}...")
+            except UpstreamUnavailable as e:
+                # The remaining emails stay unsummarized and are picked up by the next sync
+                logger.warning(f"[BG] Stopping summaries for {user_id}: {e}")
+                break
+            except Exception as e:
+                logger.error(f"[BG] Error summarizing {mid}: {e}")
+    if updated:
+        change_log.record(user_id, OP_UPDATE, list(updated))
+        record_change(user_id, summaries=updated)
+
+
+def load_replica(user_id: str, kind: str, version: Optional[int]) -> bool:
+    """Copy a user's emails or keywords from Supabase into the read replica, stamped with `version`"""
+    if version is None or not read_replica.enabled:
+        return False
+    try:
+        if kind == REPLICA_EMAILS:
+            # One row past the cap tells a mailbox too large to replicate from one that fits
+            result = supabase.table("emails").select("*").eq("user_id", user_id).order("date", desc=True).limit(
+                read_replica.max_rows + 1).execute()
+            return read_replica.load_emails(user_id, version, result.data or [])
+        result = supabase.table("keywords").select("keyword").eq("user_id", user_id).execute()
+        return read_replica.load_keywords(user_id, version, [row["keyword"] for row in result.data or []])
+    except Exception as e:
+        logger.warning(f"[REPLICA] Could not load {kind} for {user_id}: {e}")
+        return False
+
+
+def replica_read(user_id: str, kind: str, read: Callable[[Optional[int]], Optional[T]]) -> Optional[T]:
+    """read(version) served by the read replica, loading it first if it is behind; None means ask Supabase"""
+    version = data_versions.get(user_id)
+    result = read(version)
+    if result is None and load_replica(user_id, kind, version):
+        result = read(version)
+    return result
 
 
 def get_emails_from_supabase(user_id: str = "demo_user", limit: int = 5) -> List[Dict]:
-    """Get emails from Supabase database"""
+    """Get emails from the read replica, or from the Supabase database when it is not current"""
+    emails = replica_read(user_id, REPLICA_EMAILS, lambda version: read_replica.recent(user_id, version, limit))
+    if emails is not None:
+        return emails
     try:
         # Get emails ordered by date (actual email date) descending to show newest first
         result = supabase.table("emails").select("*").eq("user_id", user_id).order("date", desc=True).limit(limit).execute()
@@ -536,6 +1345,11 @@ def get_emails_from_supabase(user_id: str = "demo_user", limit: int = 5) -> List
 
 def get_user_keywords(user_id: str = "demo_user") -> List[str]:
     """Get user's keywords from Supabase"""
+    # Linked accounts share their owner's keywords
+    user_id = owner_of(user_id)
+    keywords = replica_read(user_id, REPLICA_KEYWORDS, lambda version: read_replica.keywords(user_id, version))
+    if keywords is not None:
+        return keywords
     try:
         result = supabase.table("keywords").select("keyword").eq("user_id", user_id).execute()
         return [row["keyword"] for row in result.data] if result.data else []
@@ -557,16 +1371,29 @@ def add_user_keyword(user_id: str, keyword: str) -> Dict:
             "user_id": user_id,
             "keyword": keyword.lower().strip()
         }).execute()
+        recount_keyword(user_id, keyword.lower().strip(), present=True)
+        record_change(user_id, keywords_added=[keyword.lower().strip()])
+        live_events.publish(owner_of(user_id), "keywords.changed", {"added": keyword.lower().strip()})
         
         return {"success": True, "message": f"Keyword '{keyword}' added successfully"}
     except Exception as e:
         logger.error(f"Add keyword error: {e}")
         return {"error": f"Failed to add keyword: {str(e)}"}
 
+def recount_keyword(user_id: str, keyword: str, present: bool):
+    """Recount a keyword in the sender rollups of every account of the user"""
+    for account in account_tokens(user_id):
+        sender_rollups.recount_keyword(account, keyword, present=present)
+        if account != user_id:
+            record_change(account)
+
 def remove_user_keyword(user_id: str, keyword: str) -> Dict:
     """Remove a keyword for a user"""
     try:
         result = supabase.table("keywords").delete().eq("user_id", user_id).eq("keyword", keyword.lower().strip()).execute()
+        recount_keyword(user_id, keyword.lower().strip(), present=False)
+        record_change(user_id, keywords_removed=[keyword.lower().strip()])
+        live_events.publish(owner_of(user_id), "keywords.changed", {"removed": keyword.lower().strip()})
         return {"success": True, "message": f"Keyword '{keyword}' removed successfully"}
     except Exception as e:
         logger.error(f"Remove keyword error: {e}")
@@ -617,6 +1444,11 @@ def get_important_emails(user_id: str = "demo_user", limit: int = 3) -> List[Dic
         if not keywords:
             logger.debug("No keywords found for user")
             return []
+
+        matches = replica_read(
+            user_id, REPLICA_EMAILS, lambda version: read_replica.matching(user_id, version, keywords, limit))
+        if matches is not None:
+            return matches
         
         # Get all emails for the user ordered by date (newest first)
         try:
@@ -655,11 +1487,11 @@ def get_important_emails(user_id: str = "demo_user", limit: int = 3) -> List[Dic
         logger.error(f"Important emails query error: {e}")
         return []
 
-def generate_email_summary(subject: str, snippet: str) -> str:
-    """Generate a summary of the email using Hugging Face API"""
+def generate_email_summary(subject: str, snippet: str, body: Optional[str] = None) -> str:
+    """Generate a summary of the email using Hugging Face API (from the body when given, else the snippet)"""
     try:
         # Combine subject and snippet for better context
-        text_to_summarize = f"Subject: {subject}\n\n{snippet}"
+        text_to_summarize = f"Subject: {subject}\n\n{body or snippet}"
         
         # Truncate if too long (API has token limits)
         if len(text_to_summarize) > 1000:
@@ -680,7 +1512,14 @@ def generate_email_summary(subject: str, snippet: str) -> str:
         }
         
         # Make API request
-        response = requests.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=30)
+        started = time.perf_counter()
+        try:
+            response = http_session.post(HUGGINGFACE_API_URL, headers=headers, json=payload, timeout=30)
+        except requests.exceptions.Timeout:
+            SUMMARY_INFERENCE_SECONDS.observe(time.perf_counter() - started, outcome="timeout")
+            raise
+        SUMMARY_INFERENCE_SECONDS.observe(time.perf_counter() - started,
+                                          outcome="ok" if response.status_code == 200 else "error")
         
         if response.status_code == 200:
             result = response.json()
@@ -694,6 +1533,9 @@ def generate_email_summary(subject: str, snippet: str) -> str:
             logger.error(f"Hugging Face API error: {response.status_code} - {response.text}")
             return snippet[:100] + "..." if len(snippet) > 100 else snippet
             
+    except UpstreamUnavailable:
+        # Breaker open or deadline spent: let the caller leave the summary for a later run
+        raise
     except requests.exceptions.Timeout:
         logger.warning("Hugging Face API timeout")
         return snippet[:100] + "..." if len(snippet) > 100 else snippet
@@ -763,10 +1605,7 @@ def generate_daily_summary(todays_emails: List[Dict], weekly_count: int, keyword
                     senders = set()
                     subjects = []
                     for email in emails[:4]:  # Show up to 4 emails for more detail
-                        from_email = email.get("from_email", "Unknown Sender")
-                        if "<" in from_email and ">" in from_email:
-                            from_email = from_email.split("<")[0].strip()
-                        senders.add(from_email)
+                        senders.add(normalize_sender(email.get("from_email")))
                         subjects.append(email.get("subject", "No Subject")[:100])  # Longer subject lines
                     
                     sender_list = list(senders)[:3]  # Show up to 3 senders
@@ -798,9 +1637,7 @@ def generate_daily_summary(todays_emails: List[Dict], weekly_count: int, keyword
             # Get top senders from general emails
             senders = {}
             for email in general_emails:
-                from_email = email.get("from_email", "Unknown Sender")
-                if "<" in from_email and ">" in from_email:
-                    from_email = from_email.split("<")[0].strip()
+                from_email = normalize_sender(email.get("from_email"))
                 senders[from_email] = senders.get(from_email, 0) + 1
             
             # Sort by frequency and take top 6 for more detail
@@ -835,7 +1672,7 @@ def generate_daily_summary(todays_emails: List[Dict], weekly_count: int, keyword
         return f"You received {len(todays_emails) if todays_emails else 0} emails today. {weekly_count} total this week."
 
 
-@app.get("/login")
+@router.get("/login")
 def login():
     flow = create_flow()
     auth_url, _ = flow.authorization_url(prompt="consent", access_type="offline")
@@ -847,8 +1684,36 @@ def login():
 
 
 
-@app.get("/oauth2callback")
-def oauth2callback(request: Request, code: str):
+@router.get("/accounts")
+def list_accounts(user_id: str = Depends(current_user)):
+    """Gmail accounts of the signed-in user: the one they signed in with, then linked ones"""
+    return {"accounts": [{"email": account, "primary": account == user_id} for account in account_tokens(user_id)]}
+
+
+@router.get("/accounts/link")
+def link_account(user_id: str = Depends(current_user)):
+    """Google consent URL for linking another Gmail account to the signed-in user"""
+    flow = create_flow()
+    auth_url, _ = flow.authorization_url(
+        prompt="select_account consent", access_type="offline", state=linked_accounts.start_link(user_id)
+    )
+    return {"auth_url": auth_url}
+
+
+@router.delete("/accounts/{account}")
+def unlink_account(account: str, user_id: str = Depends(current_user)):
+    """Unlink a Gmail account; its synced emails stay stored under the account"""
+    if account == user_id:
+        raise HTTPException(status_code=400, detail="The account you signed in with cannot be unlinked")
+    if not linked_accounts.unlink(user_id, account):
+        raise HTTPException(status_code=404, detail="Account not linked")
+    watch_store.remove(account)
+    record_change(user_id)
+    return {"message": f"Unlinked {account}"}
+
+
+@router.get("/oauth2callback")
+def oauth2callback(request: Request, code: str, state: Optional[str] = None):
     if not code:
         return JSONResponse({"error": "Authorization code not provided"}, status_code=400)
     
@@ -861,8 +1726,7 @@ def oauth2callback(request: Request, code: str):
 
     credentials = flow.credentials
 
-    # Extract user's email from ID token
-    user_id = None
+    # Extract user's email from ID token; without a verified one there is no user to sign in
     try:
         from google.oauth2 import id_token
         from google.auth.transport import requests as google_requests
@@ -875,21 +1739,48 @@ def oauth2callback(request: Request, code: str):
         logger.debug(f"Extracted user email from ID token: {user_id}")
     except Exception as e:
         logger.warning(f"Failed to extract user email from ID token: {e}")
-        user_id = "demo_user"
+        user_id = None
+    if not user_id:
+        return JSONResponse({"error": "Could not verify the Google account"}, status_code=401)
 
-    user_tokens[user_id] = {
+    token_data = {
         "access_token": credentials.token,
         "refresh_token": credentials.refresh_token,
         "expires_at": credentials.expiry.timestamp() if credentials.expiry else None,
         "scopes": credentials.scopes
     }
 
+    # Consent started from /accounts/link adds a mailbox to a signed-in user instead of signing in
+    owner = linked_accounts.finish_link(state)
+    if owner and owner in user_tokens and user_id != owner:
+        linked_accounts.link(owner, user_id, token_data)
+        logger.info(f"[ACCOUNTS] Linked {user_id} to {owner}")
+        try:
+            register_watch(user_id, credentials.token)
+        except Exception as e:
+            logger.warning(f"[WATCH] Could not watch {user_id}: {e}")
+        try:
+            sync_result = sync_coordinator.run(
+                user_id, lambda: sync_emails_from_gmail(credentials.token, user_id, BackgroundTasks())
+            )
+            logger.info(f"Auto-sync result for linked account: {sync_result}")
+        except Exception as e:
+            logger.warning(f"Auto-sync of linked account failed (non-critical): {e}")
+        record_change(owner)
+        return RedirectResponse(f"{FRONTEND_URL}/dashboard#account_linked={user_id}")
+
+    user_tokens[user_id] = token_data
+
     logger.info(f"OAuth successful! Stored token for user: {user_id}")
     logger.debug(f"Token data: {user_tokens[user_id]}")
     
     # Verify token storage before redirecting
     if user_id in user_tokens and user_tokens[user_id].get("access_token"):
         logger.debug("Token storage verified successfully")
+        try:
+            register_watch(user_id, credentials.token)
+        except Exception as e:
+            logger.warning(f"[WATCH] Could not watch {user_id}: {e}")
         
         # Trigger automatic sync after successful login
         try:
@@ -897,7 +1788,9 @@ def oauth2callback(request: Request, code: str):
             # Create a dummy background tasks for auto-sync
             from fastapi import BackgroundTasks
             dummy_background_tasks = BackgroundTasks()
-            sync_result = sync_emails_from_gmail(credentials.token, user_id, dummy_background_tasks)
+            sync_result = sync_coordinator.run(
+                user_id, lambda: sync_emails_from_gmail(credentials.token, user_id, dummy_background_tasks)
+            )
             logger.info(f"Auto-sync result: {sync_result}")
         except Exception as e:
             logger.warning(f"Auto-sync failed (non-critical): {e}")
@@ -906,105 +1799,152 @@ def oauth2callback(request: Request, code: str):
         logger.error("Token storage failed")
         return JSONResponse({"error": "Failed to store authentication tokens"}, status_code=500)
 
-    # Redirect to frontend with success indicator
+    # Redirect to frontend with success indicator; the session rides along as a cookie. Frontends on
+    # another site, where third-party cookies are blocked, trade the single-use code for a bearer token
     redirect_url = f"{FRONTEND_URL}/dashboard#auth_success=true&user_email={user_id}"
     logger.debug(f"Redirecting to: {redirect_url}")
-    return RedirectResponse(redirect_url)
+    response = RedirectResponse(f"{redirect_url}&code={sessions.login_code(user_id, LOGIN_CODE_TTL)}")
+    set_session_cookie(response, sessions.create(user_id))
+    return response
+
+
+@router.post("/auth/exchange")
+def exchange_login_code(body: dict = Body(default={})):
+    """Session token for the single-use code from the sign-in redirect, for use as `Authorization: Bearer`"""
+    token = sessions.exchange_code(body.get("code"))
+    user_id = sessions.resolve(token)
+    if user_id is None or user_id not in user_tokens:
+        raise HTTPException(status_code=401, detail="Invalid or expired login code")
+    return {"session": token, "user_id": user_id}
 
 
-@app.get("/dashboard")
-def get_dashboard(request: Request):
+# Gmail-derived dashboard fields (weekly count, today's emails, unread counts) are not
+# covered by the data version, so dashboard ETags also roll over every DASHBOARD_ETAG_TTL seconds
+DASHBOARD_ETAG_TTL = int(os.getenv("DASHBOARD_ETAG_TTL", "60"))
+CONDITIONAL_CACHE_CONTROL = "private, no-cache"
+
+
+def user_etag(user_id: str, *parts) -> Optional[str]:
+    """ETag for a user's data at its current version, or None if the version is unknown"""
+    version = data_versions.get(user_id)
+    return make_etag(user_id, version, *parts) if version is not None else None
+
+
+def not_modified(request: Request, etag: Optional[str]) -> Optional[Response]:
+    """304 response if the client already has this ETag"""
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers={"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL})
+    return None
+
+
+def conditional_json(content: Dict, etag: Optional[str]) -> ORJSONResponse:
+    headers = {"ETag": etag, "Cache-Control": CONDITIONAL_CACHE_CONTROL} if etag else None
+    return ORJSONResponse(content, headers=headers)
+
+
+def account_gmail_stats(account: str, access_token: str) -> Dict:
+    """Gmail-derived dashboard data for one account"""
+    stats = {"weekly": 0, "unread_counts": None, "todays_emails": []}
+    try:
+        with DASHBOARD_SOURCE_SECONDS.time(source="gmail_weekly_count"), gmail_account(account):
+            stats["weekly"] = get_weekly_email_count(access_token)
+        logger.debug(f"Weekly email count: {stats['weekly']}")
+
+        with DASHBOARD_SOURCE_SECONDS.time(source="unread_counters"):
+            stats["unread_counts"] = unread_counters.get(account, access_token)
+
+        # Get today's emails for better summary
+        with DASHBOARD_SOURCE_SECONDS.time(source="gmail_todays_emails"):
+            stats["todays_emails"] = get_todays_emails(access_token, account)
+        logger.debug(f"Today's emails: {len(stats['todays_emails'])}")
+    except Exception as e:
+        logger.error(f"Error getting email data for {account}: {e}")
+    return stats
+
+
+@router.get("/dashboard")
+def get_dashboard(request: Request, user_id: str = Depends(current_user)):
     # Get the authenticated user ID (should be the email from OAuth)
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
+
+    accounts = account_tokens(user_id)
+
+    # Answer revalidations before any Supabase or Gmail work
+    etag = user_etag(user_id, "dashboard", int(time.time() // DASHBOARD_ETAG_TTL),
+                     *(data_versions.get(account) for account in accounts if account != user_id))
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     
     try:
-        # Get emails from Supabase database
-        emails = get_emails_from_supabase(user_id, limit=5)
+        # Get emails from Supabase database, newest first across all of the user's accounts
+        with DASHBOARD_SOURCE_SECONDS.time(source="supabase_emails"):
+            emails = merge_by_date(fan_out(account_read_pool, lambda a: get_emails_from_supabase(a, limit=5), accounts),
+                                   limit=5)
         logger.debug(f"Retrieved {len(emails)} emails from Supabase for dashboard")
+
+        access_tokens = fan_out(account_read_pool, lambda a: access_token_for(accounts[a]), accounts)
         
         # If no emails in database, trigger a sync
         if not emails:
             logger.debug("No emails found in database, triggering automatic sync...")
             try:
-                token_data = user_tokens[user_id]
-                credentials = Credentials(
-                    token=token_data["access_token"],
-                    refresh_token=token_data["refresh_token"],
-                    token_uri="https://oauth2.googleapis.com/token",
-                    client_id=os.getenv("CLIENT_ID"),
-                    client_secret=os.getenv("CLIENT_SECRET"),
-                    scopes=token_data["scopes"]
-                )
-                
-                access_token = refresh_token_if_needed(credentials)
-                if access_token:
+                if access_tokens[user_id]:
                     # Create a dummy background tasks for auto-sync
                     from fastapi import BackgroundTasks
                     dummy_background_tasks = BackgroundTasks()
-                    sync_result = sync_emails_from_gmail(access_token, user_id, dummy_background_tasks)
+                    sync_result = sync_accounts(user_id, access_tokens, dummy_background_tasks)
                     logger.debug(f"Auto-sync result: {sync_result}")
                     
                     # Re-fetch emails after sync
-                    emails = get_emails_from_supabase(user_id, limit=5)
+                    emails = merge_by_date(
+                        fan_out(account_read_pool, lambda a: get_emails_from_supabase(a, limit=5), accounts), limit=5)
                     logger.debug(f"After sync, retrieved {len(emails)} emails from Supabase")
             except Exception as e:
                 logger.error(f"Auto-sync failed: {e}")
                 # Continue with empty emails list
         
-        # Get weekly email count from Gmail API
-        token_data = user_tokens[user_id]
-        credentials = Credentials(
-            token=token_data["access_token"],
-            refresh_token=token_data["refresh_token"],
-            token_uri="https://oauth2.googleapis.com/token",
-            client_id=os.getenv("CLIENT_ID"),
-            client_secret=os.getenv("CLIENT_SECRET"),
-            scopes=token_data["scopes"]
+        # Weekly count, unread counts and today's emails from the Gmail API, per account at once
+        per_account = fan_out(
+            account_read_pool, lambda a: account_gmail_stats(a, access_tokens[a]) if access_tokens[a] else None, accounts
         )
-
-        access_token = refresh_token_if_needed(credentials)
-        weekly_email_count = 0
-        todays_emails = []
-        if access_token:
-            try:
-                weekly_email_count = get_weekly_email_count(access_token)
-                logger.debug(f"Weekly email count: {weekly_email_count}")
-                
-                # Get today's emails for better summary
-                todays_emails = get_todays_emails(access_token)
-                logger.debug(f"Today's emails: {len(todays_emails)}")
-            except Exception as e:
-                logger.error(f"Error getting email data: {e}")
+        stats = [v for v in per_account.values() if v]
+        weekly_email_count = sum(v["weekly"] for v in stats)
+        unread_emails = sum(v["unread_counts"]["inbox"]["unread"] for v in stats if v["unread_counts"])
+        todays_emails = [email for v in stats for email in v["todays_emails"]]
 
         # Get important emails based on user keywords
-        important_emails = get_important_emails(user_id, limit=3)
-        user_keywords = get_user_keywords(user_id)
+        with DASHBOARD_SOURCE_SECONDS.time(source="important_emails"):
+            important_emails = merge_by_date(
+                fan_out(account_read_pool, lambda a: get_important_emails(a, limit=3), accounts), limit=3)
+        with DASHBOARD_SOURCE_SECONDS.time(source="keywords"):
+            user_keywords = get_user_keywords(user_id)
         
         # Format emails for frontend
         formatted_emails = []
         for email in emails:
             formatted_emails.append({
+                "id": email.get("message_id"),
                 "from": email.get("from_email", "Unknown Sender"),
                 "subject": email.get("subject", "No Subject"),
                 "date": email.get("date", "Unknown Date")[:10] if email.get("date") else "Unknown Date",
-                "summary": email.get("summary", email.get("snippet", ""))
+                "summary": email.get("summary", email.get("snippet", "")),
+                "account": email.get("account")
             })
         
         # Format important emails for frontend
         formatted_important_emails = []
         for email in important_emails:
             formatted_important_emails.append({
+                "id": email.get("message_id"),
                 "from": email.get("from_email", "Unknown Sender"),
                 "subject": email.get("subject", "No Subject"),
                 "date": email.get("date", "Unknown Date")[:10] if email.get("date") else "Unknown Date",
-                "summary": email.get("summary", email.get("snippet", ""))
+                "summary": email.get("summary", email.get("snippet", "")),
+                "account": email.get("account")
             })
 
         # Generate comprehensive daily summary using today's emails and keywords
         total_emails_in_db = len(emails)
-        important_count = len(formatted_important_emails)
         
         if total_emails_in_db == 0 and not todays_emails:
             daily_summary = f"You received {weekly_email_count} emails this week. Sync your emails to see them here."
@@ -1017,33 +1957,311 @@ def get_dashboard(request: Request):
             logger.debug(f"Generated summary: {daily_summary}")
 
         # Get active users from database
-        active_users_data = get_active_users_from_database()
+        with DASHBOARD_SOURCE_SECONDS.time(source="active_users"):
+            active_users_data = get_active_users_from_database()
         
-        return {
-            "unreadEmails": weekly_email_count,
+        return conditional_json({
+            "unreadEmails": unread_emails,
+            "weeklyEmails": weekly_email_count,
             "importantEmails": formatted_important_emails,
             "keywords": user_keywords,
             "dailySummary": daily_summary,
             "activeUsers": active_users_data["activeUsers"],
             "activeAccounts": active_users_data["activeAccounts"],
             "recentEmails": formatted_emails
-        }
+        }, etag)
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
 
-from fastapi import Body
 
+@router.get("/analytics/senders")
+def analytics_senders(request: Request, limit: int = 10, days: Optional[int] = None, include_archived: bool = False,
+                      account: Optional[str] = None, user_id: str = Depends(current_user)):
+    """Top senders of one of the user's accounts, all-time or within the last `days` days, optionally counting archived mail"""
+    user_id = user_account(user_id, account)
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    if days is not None and days < 1:
+        raise HTTPException(status_code=400, detail="days must be positive")
+
+    # Windowed counts move with the calendar day as well as with the data
+    etag = user_etag(user_id, "senders", limit, days, datetime.now(timezone.utc).date() if days else "",
+                     cold_store.generation(user_id) if include_archived else "")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    senders = sender_rollups.top_senders(user_id, limit=limit, days=days, include_archived=include_archived,
+                                         version=data_versions.get(user_id))
+    return conditional_json(
+        {"senders": senders, "limit": limit, "days": days, "includeArchived": include_archived}, etag)
+
+
+def _iso_timestamp(value: Optional[str], name: str) -> Optional[float]:
+    if value is None:
+        return None
+    ts = email_timestamp(value)
+    if not ts:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO 8601 date")
+    return ts
+
+
+@router.get("/emails/archive")
+def search_archive(request: Request, q: Optional[str] = None, after: Optional[str] = None,
+                   before: Optional[str] = None, limit: int = 50, account: Optional[str] = None,
+                   user_id: str = Depends(current_user)):
+    """Archived emails (trimmed from the hot table), newest first, filtered by text and date range"""
+    user_id = user_account(user_id, account)
+    if limit < 1 or limit > 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+    after_ts, before_ts = _iso_timestamp(after, "after"), _iso_timestamp(before, "before")
+
+    etag = user_etag(user_id, "archive", cold_store.generation(user_id), q, after, before, limit)
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
+
+    emails = []
+    for email in cold_store.scan(user_id, after=after_ts, before=before_ts):
+        if q and not match_keywords(email, [q]):
+            continue
+        emails.append(email)
+        if len(emails) >= limit:
+            break
+    return conditional_json({"emails": emails, "archived": cold_store.stats(user_id)}, etag)
+
+
+@router.get("/emails/{message_id}/body")
+def get_email_body(message_id: str, account: Optional[str] = None, user_id: str = Depends(current_user)):
+    """Full text of one email for the detail view, fetched from Gmail on first use and cached on disk.
+
+    `account` is the mailbox the email came from (the `account` field of dashboard rows).
+    """
+    user_id = user_account(user_id, account)
+    access_token = access_token_for(account_token_data(user_id))
+    if not access_token:
+        raise HTTPException(status_code=401, detail="Token refresh failed")
+
+    try:
+        body = fetch_email_body(access_token, user_id, message_id)
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=503, detail=f"Gmail unavailable: {e}")
+    except Exception as e:
+        logger.error(f"[BODY] {e}")
+        raise HTTPException(status_code=502, detail="Could not fetch the email body from Gmail")
+    if body is None:
+        raise HTTPException(status_code=404, detail="Email not found")
+    return {"message_id": message_id, "body": body}
+
+
+@router.get("/threads/{thread_id}")
+def get_thread(thread_id: str, account: Optional[str] = None, user_id: str = Depends(current_user)):
+    """Conversation rollup (participants, counts, thread summary) kept by thread-granularity sync"""
+    user_id = user_account(user_id, account)
+    thread = thread_store.get(user_id, thread_id)
+    if thread is None:
+        raise HTTPException(status_code=404, detail="Thread not found")
+    return thread
+
+
+@router.get("/emails/export")
+async def export_emails(request: Request, format: str = "ndjson", after: Optional[str] = None,
+                        before: Optional[str] = None, keyword: Optional[str] = None,
+                        category: Optional[str] = None, include_archived: bool = True,
+                        account: Optional[str] = None, user_id: str = Depends(current_user)):
+    """Stream every stored email (hot and archived) of one account as NDJSON or CSV, optionally filtered"""
+    user_id = user_account(user_id, account)
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if category is not None and category not in CATEGORY_NAMES.values():
+        raise HTTPException(status_code=400, detail=f"category must be one of {', '.join(CATEGORY_NAMES.values())}")
+    _iso_timestamp(after, "after")
+    _iso_timestamp(before, "before")
+
+    pages = email_exporter.pages(user_id, ExportFilters(after, before, keyword, category), include_archived)
+
+    def next_page() -> Optional[List[Dict]]:
+        # Each page gets its own deadline; the export as a whole may outlast the request budget
+        with deadline(REQUEST_DEADLINE_SECONDS, detach=True):
+            return next(pages, None)
+
+    async def body():
+        formatter = CsvFormatter() if format == "csv" else None
+        exported = 0
+        try:
+            if formatter:
+                yield formatter.chunk([])
+            while True:
+                if await request.is_disconnected():
+                    logger.info(f"[EXPORT] Client left after {exported} rows for {user_id}; stopping")
+                    return
+                page = await asyncio.to_thread(next_page)
+                if page is None:
+                    break
+                exported += len(page)
+                yield formatter.chunk(page) if formatter else ndjson_chunk(page)
+            logger.info(f"[EXPORT] Exported {exported} rows for {user_id}")
+        finally:
+            try:
+                pages.close()
+            except ValueError:
+                pass  # a page read is still running in its thread; the generator is dropped after it
+
+    extension = "csv" if format == "csv" else "ndjson"
+    return StreamingResponse(body(), media_type=EXPORT_FORMATS[format], headers={
+        "Content-Disposition": f'attachment; filename="mailpilot-export.{extension}"',
+        "Cache-Control": "no-store",
+        "X-Accel-Buffering": "no",
+    })
+
+
+@router.get("/emails/changes")
+def email_changes(request: Request, since: Optional[str] = None, limit: int = 100, account: Optional[str] = None,
+                  user_id: str = Depends(current_user)):
+    """Inserts, summary updates and deletes after a cursor, for clients keeping a local copy.
+
+    Without `since` the response only carries the current cursor (with reset=true):
+    load /dashboard in full, then poll with that cursor. reset=true on a later call
+    means the cursor is too old and the client has to reload in full as well.
+    Cursors are per account; a client mirroring linked accounts polls each one.
+    """
+    user_id = user_account(user_id, account)
+    if limit < 1 or limit > 500:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 500")
+
+    try:
+        if not since:
+            return {"changes": [], "cursor": change_log.head(user_id), "has_more": False, "reset": True}
+        return change_log.changes_since(user_id, since, limit)
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except Exception as e:
+        logger.error(f"[CHANGES] Failed to read changes for {user_id}: {e}")
+        raise HTTPException(status_code=500, detail="Failed to read changes")
+
+
+def run_sync_job(access_tokens: Dict[str, Optional[str]], user_id: str, job: SyncJob) -> Dict:
+    # Job threads do not inherit the request context, so the sync gets its own deadline;
+    # its Gmail calls queue behind interactive ones
+    with deadline(SYNC_DEADLINE_SECONDS, detach=True), priority(SYNC):
+        return sync_accounts(user_id, access_tokens, None, progress=job, summarize_inline=True)
+
+
+@router.post("/sync-emails", status_code=202)
+def sync_emails(request: Request, body: dict = Body(default={}), user_id: str = Depends(current_user)):
+    """Queue a Gmail sync for the user and return a job ID to poll"""
+
+    remote_ip = request.client.host if request.client else ""
+    if not verify_recaptcha(body.get("captcha_response", ""), remote_ip):
+        raise HTTPException(status_code=400, detail="Invalid captcha")
+    if not check_sync_rate_limit(user_id):
+        raise HTTPException(status_code=429, detail="Too many sync attempts. Please wait before trying again.")
+
+    accounts = account_tokens(user_id)
+    access_tokens = fan_out(account_read_pool, lambda a: access_token_for(accounts[a]), accounts)
+    if not access_tokens[user_id]:
+        raise HTTPException(status_code=401, detail="Token refresh failed. Please log in again.")
+
+    job = sync_jobs.submit(user_id, lambda job: run_sync_job(access_tokens, user_id, job))
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/sync-jobs/{job.id}",
+        "events_url": f"/sync-jobs/{job.id}/events",
+    }
 
-@app.get("/debug/emails")
-def debug_emails():
+def _get_sync_job(job_id: str, user_id: str):
+    job = sync_jobs.get(job_id)
+    if not job or job.user_id != user_id:
+        raise HTTPException(status_code=404, detail="Sync job not found")
+    return job
+
+@router.get("/sync-jobs/{job_id}")
+def get_sync_job(job_id: str, user_id: str = Depends(current_user)):
+    """Current status and per-stage progress of a sync job"""
+    return _get_sync_job(job_id, user_id).to_dict()
+
+@router.get("/sync-jobs/{job_id}/events")
+async def stream_sync_job(job_id: str, user_id: str = Depends(stream_user)):
+    """Server-Sent Events stream of sync job progress, closed when the job finishes"""
+    job = _get_sync_job(job_id, user_id)
+
+    async def events():
+        sent_version = -1
+        idle = 0.0
+        while True:
+            if job.version != sent_version:
+                sent_version = job.version
+                idle = 0.0
+                yield f"event: progress\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+            elif idle >= 15:
+                idle = 0.0
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(0.25)
+            idle += 0.25
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@router.post("/events/token")
+def create_stream_token(request: Request, user_id: str = Depends(current_user)):
+    """Short-lived token for opening an event stream as `?stream_token=` (EventSource sends no headers)"""
+    return {"token": sessions.stream_token(session_token(request), STREAM_TOKEN_TTL), "expires_in": STREAM_TOKEN_TTL}
+
+
+@router.get("/events")
+async def stream_live_events(request: Request, user_id: str = Depends(stream_user)):
+    """Server-Sent Events stream of new mail, summaries and keyword changes for the user"""
+    try:
+        last_id = int(request.headers.get("last-event-id", "0"))
+    except ValueError:
+        last_id = 0
+
+    def frame(event: Dict) -> str:
+        return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
+
+    async def events():
+        # Subscribed only once the response streams, so a client gone before then leaves nothing behind;
+        # before the replay, so nothing published in between is lost
+        sub = live_events.subscribe(user_id, asyncio.get_running_loop())
+        sent = last_id
+        try:
+            missed = await asyncio.to_thread(live_events.replay, user_id, last_id) if last_id else []
+            yield "retry: 3000\n\n"
+            for event in missed:
+                sent = event["id"]
+                yield frame(event)
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if sub.overflowed:
+                    # Too far behind to catch up event by event; the client reloads instead
+                    sub.overflowed = False
+                    while not sub.queue.empty():
+                        sub.queue.get_nowait()
+                    yield "event: resync\ndata: {}\n\n"
+                    continue
+                if event["id"] <= sent:
+                    continue  # already sent from the replay
+                sent = event["id"]
+                yield frame(event)
+        finally:
+            live_events.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@router.get("/debug/emails")
+def debug_emails(user_id: str = Depends(current_user)):
     """Debug endpoint to check Gmail API response"""
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
     
     token_data = user_tokens[user_id]
-    credentials = Credentials(
+    credentials = google_credentials(
         token=token_data["access_token"],
         refresh_token=token_data["refresh_token"],
         token_uri="https://oauth2.googleapis.com/token",
@@ -1059,8 +2277,8 @@ def debug_emails():
     try:
         # Fetch messages
         logger.debug(f"Testing Gmail API with token: {access_token[:20]}...")
-        messages_resp = requests.get(
-            "https://gmail.googleapis.com/gmail/v1/users/me/messages?maxResults=5",
+        messages_resp = http_session.get(
+            f"{gmail_api_base()}/gmail/v1/users/me/messages?maxResults=5",
             headers={"Authorization": f"Bearer {access_token}"}
         )
         
@@ -1081,8 +2299,8 @@ def debug_emails():
         if "messages" in messages_data and len(messages_data["messages"]) > 0:
             msg_id = messages_data["messages"][0]["id"]
             logger.debug(f"Fetching details for message {msg_id}")
-            msg_resp = requests.get(
-                f"https://gmail.googleapis.com/gmail/v1/users/me/messages/{msg_id}?format=full",
+            msg_resp = http_session.get(
+                f"{gmail_api_base()}/gmail/v1/users/me/messages/{msg_id}?format=full",
                 headers={"Authorization": f"Bearer {access_token}"}
             )
             
@@ -1101,21 +2319,110 @@ def debug_emails():
         logger.error(f"Debug endpoint error: {e}")
         return {"error": str(e), "traceback": str(e.__traceback__)}
 
-@app.get("/keywords")
-def get_keywords(request: Request):
+@router.get("/keywords")
+def get_keywords(request: Request, user_id: str = Depends(current_user)):
     """Get user's keywords"""
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
+    etag = user_etag(user_id, "keywords")
+    cached = not_modified(request, etag)
+    if cached:
+        return cached
     keywords = get_user_keywords(user_id)
-    return {"keywords": keywords}
+    return conditional_json({"keywords": keywords}, etag)
 
-@app.post("/keywords")
-def add_keyword(request: Request, keyword_data: dict):
+@charged_to("account")
+def register_watch(account: str, access_token: str) -> bool:
+    """(Re)start Gmail push notifications for an account; False when push is not configured or Gmail refused"""
+    if not GMAIL_WATCH_TOPIC or not access_token:
+        return False
+    r = http_session.post(
+        f"{gmail_api_base()}/gmail/v1/users/me/watch",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"fields": gmail_fields.WATCH_FIELDS},
+        json={"topicName": GMAIL_WATCH_TOPIC, "labelIds": ["INBOX"], "labelFilterBehavior": "include"},
+        timeout=15
+    )
+    if r.status_code != 200:
+        logger.warning(f"[WATCH] users.watch failed for {account}: {r.status_code} {r.text[:200]}")
+        return False
+    data = r.json()
+    watch_store.watched(account, int(data["historyId"]), int(data["expiration"]) / 1000)
+    logger.info(f"[WATCH] Watching {account} from historyId {data['historyId']}")
+    return True
+
+
+def renew_watch(account: str) -> bool:
+    token_data = account_token_data(account)
+    if token_data is None:
+        # Signed out or unlinked: let the watch lapse and ignore its pushes
+        watch_store.remove(account)
+        return False
+    return register_watch(account, access_token_for(token_data))
+
+
+def run_push_sync(account: str, history_id: int):
+    """Incremental sync triggered by a push; runs on the scheduler once the account's burst has settled"""
+    token_data = account_token_data(account)
+    if token_data is None:
+        return
+    access_token = access_token_for(token_data)
+    if not access_token:
+        logger.warning(f"[PUSH] No usable token for {account}")
+        return
+    with deadline(SYNC_DEADLINE_SECONDS, detach=True), priority(SYNC):
+        # Fresh: a sync already running may have listed the mailbox before this push arrived
+        result = sync_coordinator.run(
+            account, lambda: sync_emails_from_gmail(access_token, account, BackgroundTasks()), fresh=True
+        )
+    if result.get("coalesced") == "lease":
+        # Another worker is syncing and may have started too early; try again once it is done
+        logger.info(f"[PUSH] {account} is syncing in another worker, retrying historyId {history_id}")
+        push_debouncer.notify(account, history_id)
+        return
+    if "error" in result:
+        logger.warning(f"[PUSH] Sync of {account} for historyId {history_id} failed: {result['error']}")
+        return
+    # Only a sync this call ran, started after the push, covers history_id
+    watch_store.synced(account, history_id)
+    logger.info(f"[PUSH] Synced {account} up to historyId {history_id}: {result.get('emails_inserted', 0)} new")
+
+
+def handle_push(body: bytes, headers) -> str:
+    """Outcome of one push notification; raises PushRejected for pushes that fail verification"""
+    verify_push(body, headers, PUSH_SHARED_SECRET, PUSH_AUDIENCE, PUSH_SERVICE_ACCOUNT)
+    try:
+        account, history_id = parse_push(body)
+    except (ValueError, KeyError, TypeError) as e:
+        logger.warning(f"[PUSH] Malformed notification: {e}")
+        return "malformed"
+    synced = watch_store.synced_history_id(account)
+    if synced is None:
+        return "unknown"
+    if history_id <= synced:
+        # Redelivered, or already covered by a sync that ran after it was published
+        return "stale"
+    return "queued" if push_debouncer.notify(account, history_id) else "coalesced"
+
+
+@router.post("/gmail/push", status_code=204)
+async def gmail_push(request: Request):
+    """Pub/Sub push endpoint for Gmail watch notifications.
+
+    Anything verified is acknowledged with 204, even when it is ignored, so
+    Pub/Sub does not redeliver it.
+    """
+    body = await request.body()
+    try:
+        outcome = await asyncio.to_thread(handle_push, body, request.headers)
+    except PushRejected as e:
+        PUSH_NOTIFICATIONS.inc(outcome="rejected")
+        logger.warning(f"[PUSH] Rejected notification: {e}")
+        raise HTTPException(status_code=403, detail="Push verification failed")
+    PUSH_NOTIFICATIONS.inc(outcome=outcome)
+    return Response(status_code=204)
+
+@router.post("/keywords")
+def add_keyword(request: Request, keyword_data: dict, user_id: str = Depends(current_user)):
     """Add a keyword for the user"""
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
     keyword = keyword_data.get("keyword", "").strip()
     if not keyword:
         raise HTTPException(status_code=400, detail="Keyword cannot be empty")
@@ -1124,23 +2431,36 @@ def add_keyword(request: Request, keyword_data: dict):
         raise HTTPException(status_code=400, detail=result["error"])
     return result
 
-@app.delete("/keywords/{keyword}")
-def remove_keyword(request: Request, keyword: str):
+@router.delete("/keywords/{keyword}")
+def remove_keyword(request: Request, keyword: str, user_id: str = Depends(current_user)):
     """Remove a keyword for the user"""
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
     result = remove_user_keyword(user_id, keyword)
     if "error" in result:
         raise HTTPException(status_code=400, detail=result["error"])
     return result
 
-@app.get("/auth/status")
-def auth_status():
+@router.get("/unread-counts")
+def get_unread_counts(request: Request, account: Optional[str] = None, user_id: str = Depends(current_user)):
+    """Unread/total counts for INBOX, Gmail categories and user labels of one of the user's accounts"""
+    user_id = user_account(user_id, account)
+
+    # Serve from cache without touching credentials when possible
+    counts = unread_counters.get(user_id, None)
+    if counts is None or counts.get("stale"):
+        access_token = access_token_for(account_token_data(user_id))
+        if not access_token:
+            raise HTTPException(status_code=401, detail="Token refresh failed")
+        counts = unread_counters.get(user_id, access_token)
+
+    if counts is None:
+        raise HTTPException(status_code=502, detail="Could not fetch label counts from Gmail")
+    return counts
+
+@router.get("/auth/status")
+def auth_status(request: Request):
     """Check authentication status"""
-    # Get the first (and should be only) authenticated user
-    if user_tokens:
-        user_id = list(user_tokens.keys())[0]  # Get the first user
+    user_id = session_user(request)
+    if user_id is not None:
         return {
             "authenticated": True,
             "user_id": user_id,
@@ -1150,14 +2470,23 @@ def auth_status():
     else:
         return {"authenticated": False, "user_id": None}
 
-@app.get("/logout")
-def logout():
-    """Clear stored tokens"""
-    # Clear all stored tokens (in case there are multiple users)
-    user_tokens.clear()
-    return {"message": "Logged out successfully"}
-
-@app.get("/captcha/config")
+@router.get("/logout")
+def logout(request: Request):
+    """End this session (bearer and cookie); the user's tokens are dropped once their last session ends"""
+    user_id = sessions.revoke(session_token(request))
+    cookie = request.cookies.get(SESSION_COOKIE)
+    if cookie and sessions.resolve(cookie) == user_id:
+        sessions.revoke(cookie)
+    if user_id and sessions.active_sessions(user_id) == 0:
+        user_tokens.pop(user_id, None)
+        linked_accounts.drop_owner(user_id)
+        unread_counters.clear(user_id)
+        logger.info(f"[SESSION] {user_id} signed out")
+    response = JSONResponse({"message": "Logged out successfully"})
+    response.delete_cookie(SESSION_COOKIE, path="/", secure=SESSION_COOKIE_SECURE, samesite=SESSION_COOKIE_SAMESITE)
+    return response
+
+@router.get("/captcha/config")
 def get_captcha_config():
     """Get reCAPTCHA site key for frontend"""
     site_key = os.getenv("RECAPTCHA_SITE_KEY")
@@ -1172,14 +2501,11 @@ def get_captcha_config():
             "site_key_length": len(site_key) if site_key else 0
         }
     }
-@app.get("/debug/primary-sample")
-def debug_primary_sample():
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
+@router.get("/debug/primary-sample")
+def debug_primary_sample(user_id: str = Depends(current_user)):
 
     token_data = user_tokens[user_id]
-    creds = Credentials(
+    creds = google_credentials(
         token=token_data["access_token"],
         refresh_token=token_data["refresh_token"],
         token_uri="https://oauth2.googleapis.com/token",
@@ -1192,10 +2518,10 @@ def debug_primary_sample():
         raise HTTPException(status_code=401, detail="Token refresh failed")
 
     headers = {"Authorization": f"Bearer {access_token}"}
-    r = requests.get(
-        "https://gmail.googleapis.com/gmail/v1/users/me/messages",
+    r = http_session.get(
+        f"{gmail_api_base()}/gmail/v1/users/me/messages",
         headers=headers,
-        params={"maxResults": 10, "q": "in:inbox"}
+        params={"maxResults": 10, "q": "in:inbox", "fields": gmail_fields.MESSAGE_IDS_FIELDS}
     )
     if r.status_code != 200:
         return {"error": r.text}
@@ -1203,26 +2529,17 @@ def debug_primary_sample():
     if not ids:
         return {"ids": []}
 
-    r2 = requests.post(
-        "https://gmail.googleapis.com/gmail/v1/users/me/messages/batchGet",
-        headers={**headers, "Content-Type": "application/json"},
-        json={"ids": ids, "format": "metadata", "metadataHeaders": ["From", "Subject", "Date"]},
-    )
     sample = []
-    for m in r2.json().get("messages", []):
-        h = {hh["name"]: hh["value"] for hh in m.get("payload", {}).get("headers", [])}
-        sample.append({"id": m.get("id"), "from": h.get("From"), "subject": h.get("Subject"), "date": h.get("Date")})
-    return {"sample": sample}
+    for meta in fetch_message_metadata(access_token, user_id, ids):
+        sample.append({"id": meta.id, "from": meta.from_header, "subject": meta.subject, "date": meta.date_header})
+    return {"sample": sample, "cache": metadata_cache.stats()}
 
-@app.get("/debug/search-secret-email")
-def debug_search_secret_email():
+@router.get("/debug/search-secret-email")
+def debug_search_secret_email(user_id: str = Depends(current_user)):
     """Debug endpoint to specifically search for the 'secret to adulthood' email"""
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
 
     token_data = user_tokens[user_id]
-    creds = Credentials(
+    creds = google_credentials(
         token=token_data["access_token"],
         refresh_token=token_data["refresh_token"],
         token_uri="https://oauth2.googleapis.com/token",
@@ -1247,10 +2564,10 @@ def debug_search_secret_email():
     results = {}
     for query in search_queries:
         try:
-            r = requests.get(
-                "https://gmail.googleapis.com/gmail/v1/users/me/messages",
+            r = http_session.get(
+                f"{gmail_api_base()}/gmail/v1/users/me/messages",
                 headers=headers,
-                params={"maxResults": 10, "q": query}
+                params={"maxResults": 10, "q": query, "fields": gmail_fields.MESSAGE_IDS_FIELDS}
             )
             if r.status_code == 200:
                 messages = r.json().get("messages", [])
@@ -1265,15 +2582,12 @@ def debug_search_secret_email():
     
     return {"search_results": results}
 
-@app.post("/debug/force-sync")
-def debug_force_sync():
+@router.post("/debug/force-sync")
+def debug_force_sync(user_id: str = Depends(current_user)):
     """Debug endpoint to force a fresh sync without rate limiting"""
-    if not user_tokens:
-        raise HTTPException(status_code=401, detail="User not authenticated")
-    user_id = list(user_tokens.keys())[0]  # Get the first authenticated user
     
     token_data = user_tokens[user_id]
-    credentials = Credentials(
+    credentials = google_credentials(
         token=token_data["access_token"],
         refresh_token=token_data["refresh_token"],
         token_uri="https://oauth2.googleapis.com/token",
@@ -1289,14 +2603,17 @@ def debug_force_sync():
     # Force sync emails from Gmail to Supabase
     from fastapi import BackgroundTasks
     dummy_background_tasks = BackgroundTasks()
-    result = sync_emails_from_gmail(access_token, user_id, dummy_background_tasks)
+    with priority(SYNC):
+        result = sync_coordinator.run(
+            user_id, lambda: sync_emails_from_gmail(access_token, user_id, dummy_background_tasks)
+        )
     
     if "error" in result:
         raise HTTPException(status_code=500, detail=result["error"])
     
     return result
 
-@app.get("/debug/captcha")
+@router.get("/debug/captcha")
 def debug_captcha():
     """Debug endpoint to check captcha configuration"""
     site_key = os.getenv("RECAPTCHA_SITE_KEY")
@@ -1319,7 +2636,7 @@ def debug_captcha():
         }
     }
 
-@app.get("/debug/active-users")
+@router.get("/debug/active-users")
 def debug_active_users():
     """Debug endpoint to check active users from database"""
     try:
@@ -1342,13 +2659,13 @@ def debug_active_users():
     except Exception as e:
         return {"error": str(e)}
 
-@app.get("/debug/current-user")
-def debug_current_user():
+@router.get("/debug/current-user")
+def debug_current_user(request: Request):
     """Debug endpoint to show current authenticated user information"""
-    if not user_tokens:
+    user_id = session_user(request)
+    if user_id is None:
         return {"authenticated": False, "message": "No users authenticated"}
     
-    user_id = list(user_tokens.keys())[0]
     user_data = user_tokens[user_id]
     
     return {
@@ -1361,3 +2678,103 @@ def debug_current_user():
         "scopes": user_data.get("scopes", []),
         "total_authenticated_users": len(user_tokens)
     }
+
+
+# Captures hold every user's request paths and IDs, so only these signed-in users may read them
+PROFILE_ADMINS = {email.strip() for email in os.getenv("PROFILE_ADMINS", "").split(",") if email.strip()}
+
+
+def profile_admin(user_id: str = Depends(current_user)) -> str:
+    """Dependency for the profile routes: a signed-in user listed in PROFILE_ADMINS"""
+    if user_id not in PROFILE_ADMINS:
+        raise HTTPException(status_code=403, detail="Not a profile admin")
+    return user_id
+
+
+if PROFILING_ENABLED:
+    @router.get("/debug/profiles", dependencies=[Depends(profile_admin)])
+    def list_profiles():
+        """Stored request profiles, newest first"""
+        return {"profiles": profile_store.list()}
+
+    @router.get("/debug/profiles/{capture_id}", dependencies=[Depends(profile_admin)])
+    def get_profile(capture_id: str):
+        """Span breakdown and top functions for one profiled request"""
+        report = profile_store.get(capture_id)
+        if report is None:
+            raise HTTPException(status_code=404, detail="Profile not found")
+        return report
+
+    @router.get("/debug/profiles/{capture_id}/pstats", dependencies=[Depends(profile_admin)])
+    def download_profile(capture_id: str):
+        """Raw cProfile output, for snakeviz or python -m pstats"""
+        path = profile_store.profile_path(capture_id)
+        if path is None:
+            raise HTTPException(status_code=404, detail="CPU profile not found")
+        return FileResponse(path, media_type="application/octet-stream", filename=f"{capture_id}.prof")
+
+
+
+def warm_clients():
+    """Create the lazily built clients ahead of the first request that needs them"""
+    try:
+        supabase.instance()
+        import google.oauth2.credentials  # noqa: F401
+        import google.auth.transport.requests  # noqa: F401
+    except Exception as e:
+        logger.warning(f"[STARTUP] Client warm-up failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # /healthz is served straight away; clients are built by the first request that uses
+    # them, or in the background here when WARM_CLIENTS is set
+    if os.getenv("WARM_CLIENTS", "").lower() in ("1", "true", "yes"):
+        threading.Thread(target=warm_clients, name="warm-clients", daemon=True).start()
+    if GMAIL_WATCH_TOPIC:
+        watch_renewer.start()
+    yield
+    watch_renewer.stop()
+    push_debouncer.close()
+    work_scheduler.shutdown()
+    account_sync_pool.shutdown(wait=False, cancel_futures=True)
+    account_read_pool.shutdown(wait=False, cancel_futures=True)
+    ingest_buffer.close()
+    http_session.close()
+    if cold_store.built():
+        cold_store.close()
+
+
+def create_app() -> FastAPI:
+    """Build the FastAPI app; Supabase and Google clients are created on first use"""
+    validate_env()
+    app = FastAPI(title="MailPilot Backend", lifespan=lifespan, default_response_class=ORJSONResponse)
+    app.state.limiter = limiter
+    app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
+    app.include_router(router)
+
+    if PROFILING_ENABLED:
+        app.add_middleware(ProfilingMiddleware, store=profile_store,
+                           sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")))
+        # After every route is registered, so all sync handlers get wrapped
+        instrument_routes(app)
+        logger.info(f"[PROFILE] Request profiling enabled, writing to {profile_store.directory}")
+
+    app.add_middleware(DeadlineMiddleware, seconds=REQUEST_DEADLINE_SECONDS)
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv("COMPRESSION_MIN_BYTES", "500")))
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=CORS_ORIGINS,
+        allow_credentials=True,
+        allow_methods=["*"],   # allow all HTTP methods, including OPTIONS
+        allow_headers=["*"],   # allow all headers
+    )
+    return app
+
+
+def __getattr__(name: str):
+    # `uvicorn main:app` builds the app on first access rather than at import
+    if name == "app":
+        globals()["app"] = create_app()
+        return globals()["app"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,166 @@
+# metadata_cache.py
+"""Shared LRU cache of parsed Gmail message metadata, keyed by user and message ID."""
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Rough per-record overhead on top of the string payloads (object, slots, OrderedDict node)
+_RECORD_OVERHEAD = 200
+
+# Inbox tab of a message, by the category label Gmail puts on it
+CATEGORY_NAMES = {
+    "CATEGORY_PERSONAL": "primary",
+    "CATEGORY_SOCIAL": "social",
+    "CATEGORY_PROMOTIONS": "promotions",
+    "CATEGORY_UPDATES": "updates",
+    "CATEGORY_FORUMS": "forums",
+}
+
+
+class MessageMeta:
+    """Compact metadata record for one Gmail message.
+
+    Everything except label_ids is immutable for a given message ID. A message
+    whose labels change is dropped from the cache whole, so the next read
+    refetches it with current labels rather than serving it without a category.
+    """
+    __slots__ = ("id", "thread_id", "from_header", "subject", "date_header",
+                 "snippet", "internal_date", "label_ids", "size")
+
+    def __init__(self, id: str, thread_id: Optional[str], from_header: str, subject: str,
+                 date_header: str, snippet: str, internal_date: int,
+                 label_ids: Optional[Tuple[str, ...]] = None):
+        self.id = id
+        self.thread_id = thread_id
+        self.from_header = from_header
+        self.subject = subject
+        self.date_header = date_header
+        self.snippet = snippet
+        self.internal_date = internal_date
+        self.label_ids = label_ids
+        self.size = _RECORD_OVERHEAD + sum(
+            len(s) for s in (id, thread_id or "", from_header, subject, date_header, snippet)
+        ) + (8 * len(label_ids) if label_ids else 0)
+
+    @property
+    def category(self) -> Optional[str]:
+        """Inbox tab (primary, social, ...), or None when the message has no category label"""
+        for label in self.label_ids or ():
+            name = CATEGORY_NAMES.get(label)
+            if name:
+                return name
+        return None
+
+    @classmethod
+    def from_gmail(cls, msg: Dict) -> "MessageMeta":
+        """Parse a messages.get response in format=metadata"""
+        from_header, subject, date_header = "Unknown Sender", "No Subject", ""
+        for h in msg.get("payload", {}).get("headers", []):
+            name = h.get("name")
+            if name == "From":
+                from_header = h.get("value", from_header)
+            elif name == "Subject":
+                subject = h.get("value", subject)
+            elif name == "Date":
+                date_header = h.get("value", date_header)
+        label_ids = msg.get("labelIds")
+        return cls(
+            sys.intern(msg["id"]),
+            msg.get("threadId"),
+            from_header,
+            subject,
+            date_header,
+            msg.get("snippet", ""),
+            int(msg.get("internalDate", 0)),
+            tuple(label_ids) if label_ids is not None else None,
+        )
+
+
+class MessageMetadataCache:
+    """Thread-safe LRU bounded by both entry count and approximate bytes"""
+
+    def __init__(self, max_entries: int = 5000, max_bytes: int = 8 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[Tuple[str, str], MessageMeta]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_many(self, user_id: str, message_ids: Iterable[str]) -> Tuple[Dict[str, MessageMeta], List[str]]:
+        """Split message IDs into cached records and IDs that still need fetching"""
+        found: Dict[str, MessageMeta] = {}
+        missing: List[str] = []
+        with self._lock:
+            for mid in message_ids:
+                key = (user_id, mid)
+                meta = self._entries.get(key)
+                if meta is None:
+                    missing.append(mid)
+                    continue
+                self._entries.move_to_end(key)
+                found[mid] = meta
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, user_id: str, records: Iterable[MessageMeta]):
+        with self._lock:
+            for meta in records:
+                key = (user_id, meta.id)
+                old = self._entries.pop(key, None)
+                if old is not None:
+                    self._bytes -= old.size
+                self._entries[key] = meta
+                self._bytes += meta.size
+            self._evict()
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, meta = self._entries.popitem(last=False)
+            self._bytes -= meta.size
+            self.evictions += 1
+
+    def discard(self, user_id: str, message_ids: Iterable[str]):
+        with self._lock:
+            for mid in message_ids:
+                meta = self._entries.pop((user_id, mid), None)
+                if meta is not None:
+                    self._bytes -= meta.size
+
+    def apply_history(self, user_id: str, history: List[Dict]) -> int:
+        """Apply users.history.list records; returns how many messages were touched"""
+        deleted, relabeled = set(), set()
+        for record in history:
+            for item in record.get("messagesDeleted", []):
+                deleted.add(item["message"]["id"])
+            for kind in ("labelsAdded", "labelsRemoved"):
+                for item in record.get(kind, []):
+                    relabeled.add(item["message"]["id"])
+        # Relabeled messages go too: the next read refetches them through a batch
+        if deleted or relabeled:
+            self.discard(user_id, deleted | relabeled)
+        return len(deleted) + len(relabeled)
+
+    def clear_user(self, user_id: str):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == user_id]:
+                self._bytes -= self._entries.pop(key).size
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
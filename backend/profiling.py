@@ -0,0 +1,255 @@
+# profiling.py
+"""Opt-in per-request profiling: a CPU profile plus a wall-clock breakdown of outbound calls.
+
+Nothing here runs unless PROFILING_ENABLED is set: the middleware is not
+installed, routes are not wrapped and record_span() is a single context
+variable lookup that finds nothing.
+"""
+import asyncio
+import cProfile
+import functools
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-mailpilot-profile"
+TOP_FUNCTIONS = 25
+
+_current: ContextVar[Optional["Capture"]] = ContextVar("mailpilot_profile", default=None)
+
+
+class Capture:
+    """Everything recorded for one profiled request"""
+
+    def __init__(self, method: str, path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.status: Optional[int] = None
+        self.duration_ms: Optional[float] = None
+        self.spans: List[Dict] = []
+        self.profile: Optional[cProfile.Profile] = None
+        self._lock = threading.Lock()
+
+    def add_span(self, kind: str, method: str, host: str, path: str, status: Optional[int], duration: float):
+        end = time.perf_counter() - self.t0
+        span = {
+            "kind": kind,
+            "method": method,
+            "host": host,
+            "path": path,
+            "status": status,
+            "start_ms": round((end - duration) * 1000, 2),
+            "duration_ms": round(duration * 1000, 2),
+        }
+        with self._lock:
+            self.spans.append(span)
+
+    def breakdown(self) -> Dict[str, Dict]:
+        """Outbound time and call count per upstream host"""
+        totals: Dict[str, Dict] = {}
+        for span in self.spans:
+            entry = totals.setdefault(span["host"], {"calls": 0, "total_ms": 0.0})
+            entry["calls"] += 1
+            entry["total_ms"] = round(entry["total_ms"] + span["duration_ms"], 2)
+        return totals
+
+    def top_functions(self) -> List[Dict]:
+        if self.profile is None:
+            return []
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        rows = []
+        for (filename, line, name), (cc, nc, tt, ct, _) in stats.stats.items():
+            rows.append({
+                "function": f"{os.path.basename(filename)}:{line}({name})",
+                "calls": nc,
+                "tottime_ms": round(tt * 1000, 3),
+                "cumtime_ms": round(ct * 1000, 3),
+            })
+        rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+        return rows[:TOP_FUNCTIONS]
+
+    def summary(self) -> Dict:
+        outbound_ms = round(sum(s["duration_ms"] for s in self.spans), 2)
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "created_at": datetime.fromtimestamp(self.started_at, tz=timezone.utc).isoformat(),
+            "duration_ms": self.duration_ms,
+            "outbound_calls": len(self.spans),
+            "outbound_ms": outbound_ms,
+            "has_cpu_profile": self.profile is not None,
+        }
+
+
+def record_span(kind: str, method: str, host: str, path: str, status: Optional[int], duration: float):
+    """Attach an outbound call to the request being profiled, if any"""
+    capture = _current.get()
+    if capture is not None:
+        capture.add_span(kind, method, host, path, status, duration)
+
+
+class ProfileStore:
+    """Profiles on disk as <stamp>-<id>.json (report) and .prof (pstats), oldest removed past max_bytes"""
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _files(self) -> List[str]:
+        names = [n for n in os.listdir(self.directory) if n.endswith((".json", ".prof"))]
+        return sorted(os.path.join(self.directory, n) for n in names)
+
+    def write(self, capture: Capture):
+        stem = os.path.join(self.directory, f"{int(capture.started_at * 1000)}-{capture.id}")
+        report = {
+            **capture.summary(),
+            "outbound_by_host": capture.breakdown(),
+            "spans": capture.spans,
+            "top_functions": capture.top_functions(),
+        }
+        with self._lock:
+            if capture.profile is not None:
+                capture.profile.dump_stats(stem + ".prof")
+            with open(stem + ".json", "w") as f:
+                json.dump(report, f)
+            self._rotate()
+
+    def _rotate(self):
+        # File names start with a millisecond timestamp, so sorted order is oldest first
+        files = [(p, os.path.getsize(p)) for p in self._files()]
+        total = sum(size for _, size in files)
+        for path, size in files:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def list(self) -> List[Dict]:
+        """Summaries of stored captures, newest first"""
+        captures = []
+        for path in reversed(self._files()):
+            if not path.endswith(".json"):
+                continue
+            try:
+                with open(path) as f:
+                    report = json.load(f)
+            except (OSError, ValueError):
+                continue
+            captures.append({k: report.get(k) for k in (
+                "id", "method", "path", "status", "created_at", "duration_ms",
+                "outbound_calls", "outbound_ms", "has_cpu_profile",
+            )})
+        return captures
+
+    def _path(self, capture_id: str, suffix: str) -> Optional[str]:
+        for path in self._files():
+            if path.endswith(f"-{capture_id}{suffix}"):
+                return path
+        return None
+
+    def get(self, capture_id: str) -> Optional[Dict]:
+        path = self._path(capture_id, ".json")
+        if not path:
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def profile_path(self, capture_id: str) -> Optional[str]:
+        return self._path(capture_id, ".prof")
+
+
+class ProfilingMiddleware:
+    """ASGI middleware that profiles requests carrying the profile header, or a random sample"""
+
+    def __init__(self, app, store: ProfileStore, sample_rate: float = 0.0):
+        self.app = app
+        self.store = store
+        self.sample_rate = sample_rate
+
+    def _wanted(self, scope) -> bool:
+        for name, value in scope.get("headers", []):
+            if name == PROFILE_HEADER.encode():
+                return value not in (b"0", b"false")
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        capture = Capture(scope.get("method", ""), scope.get("path", ""))
+        token = _current.set(capture)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                capture.status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"x-mailpilot-profile-id", capture.id.encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            capture.duration_ms = round((time.perf_counter() - capture.t0) * 1000, 2)
+            try:
+                await run_in_threadpool(self.store.write, capture)
+                logger.info(f"[PROFILE] {capture.method} {capture.path} took {capture.duration_ms}ms "
+                            f"({len(capture.spans)} outbound calls), saved as {capture.id}")
+            except Exception as e:
+                logger.error(f"[PROFILE] Could not save profile {capture.id}: {e}")
+
+
+def _profiled(func):
+    # Sync handlers run in a threadpool worker, and cProfile only sees the thread it
+    # was enabled on, so the profiler has to be switched on inside the handler call
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        capture = _current.get()
+        if capture is None:
+            return func(*args, **kwargs)
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profile.disable()
+            capture.profile = profile
+    return wrapper
+
+
+def instrument_routes(app):
+    """Wrap every synchronous route handler so profiled requests get a CPU profile"""
+    for route in app.routes:
+        if isinstance(route, APIRoute) and not getattr(route.dependant.call, "__mailpilot_profiled__", False):
+            call = route.dependant.call
+            if call is None or asyncio.iscoroutinefunction(call):
+                continue
+            wrapped = _profiled(call)
+            wrapped.__mailpilot_profiled__ = True
+            route.dependant.call = wrapped
@@ -0,0 +1,274 @@
+# quota.py
+"""Gmail quota budgeting: per-user and per-project token buckets in quota units, plus an AIMD concurrency limit.
+
+Every Gmail call is admitted here before it goes out. Its quota-unit cost is
+taken from the user's bucket and the project's bucket. It then waits for a
+concurrency slot. The limit on slots grows by one per window of successful
+calls and halves when Gmail answers rateLimitExceeded / 429. Callers run in a
+priority class:
+- interactive: dashboard requests
+- sync: sync jobs
+- backfill: bulk catch-up work
+Lower classes leave part of each bucket untouched and queue behind higher
+classes for slots, so background traffic cannot starve a user waiting on the
+dashboard. Calls are charged to the Gmail account set with `gmail_account()`
+(or `charged_to`), so a refreshed access token keeps the account's bucket.
+"""
+import functools
+import hashlib
+import inspect
+import heapq
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from metrics import registry
+from resilience import DEADLINE_EXCEEDED, DeadlineExceeded, remaining
+
+INTERACTIVE, SYNC, BACKFILL = "interactive", "sync", "backfill"
+PRIORITY_RANK = {INTERACTIVE: 0, SYNC: 1, BACKFILL: 2}
+# Share of each bucket a class may not dip into, kept for the classes above it
+RESERVED_FRACTION = {INTERACTIVE: 0.0, SYNC: 0.2, BACKFILL: 0.5}
+
+OK, THROTTLED, FAILED = "ok", "throttled", "failed"
+
+RATE_LIMIT_REASONS = frozenset({"rateLimitExceeded", "userRateLimitExceeded"})
+
+QUOTA_WAIT_SECONDS = registry.histogram(
+    "mailpilot_gmail_quota_wait_seconds", "Time Gmail calls waited for quota units and a concurrency slot",
+    ["priority"])
+GMAIL_THROTTLED = registry.counter(
+    "mailpilot_gmail_throttled_total", "Gmail responses signalling rate limiting", ["reason"])
+
+_priority: ContextVar[str] = ContextVar("mailpilot_gmail_priority", default=INTERACTIVE)
+
+
+@contextmanager
+def priority(name: str):
+    """Run the Gmail calls in this context in the given priority class"""
+    if name not in PRIORITY_RANK:
+        raise ValueError(f"Unknown priority class: {name}")
+    token = _priority.set(name)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+_account: ContextVar[Optional[str]] = ContextVar("mailpilot_gmail_account", default=None)
+
+
+@contextmanager
+def gmail_account(account: Optional[str]):
+    """Charge the Gmail calls in this context to the given account's per-user bucket"""
+    token = _account.set(account)
+    try:
+        yield
+    finally:
+        _account.reset(token)
+
+
+def charged_to(param: str):
+    """Decorator: charge the function's Gmail calls to the account passed as its `param` argument"""
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            with gmail_account(bound.arguments[param]):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def _sleep_within_deadline(wait: float):
+    left = remaining()
+    if left is not None and wait >= left:
+        DEADLINE_EXCEEDED.inc(dependency="gmail")
+        raise DeadlineExceeded("gmail")
+    time.sleep(wait)
+
+
+class TokenBucket:
+    """Refills at `rate` units per second up to `capacity`; takes may go into debt for calls bigger than the bucket"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, units: float, floor: float = 0.0) -> float:
+        """Take `units` if that keeps the bucket above `floor`; otherwise the seconds to wait before retrying"""
+        with self._lock:
+            self._refill(time.monotonic())
+            # A call costing more than the bucket holds goes once the bucket is full
+            needed = min(units + floor, self.capacity)
+            if self.level >= needed:
+                self.level -= units
+                return 0.0
+            return (needed - self.level) / self.rate
+
+    def drain(self):
+        """Gmail says this budget is spent; let it refill from empty"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.level = min(self.level, 0.0)
+
+
+class AimdLimiter:
+    """Concurrency limit that grows additively on success and shrinks multiplicatively on throttling.
+
+    Waiters are served in priority order, then in arrival order.
+    """
+
+    def __init__(self, initial: float = 8, minimum: float = 1, maximum: float = 32,
+                 decrease: float = 0.5, cooldown: float = 1.0):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.decrease = decrease
+        # A burst of throttled calls that were already in flight counts as one signal
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def acquire(self, rank: int):
+        with self._cond:
+            entry = (rank, next(self._seq))
+            heapq.heappush(self._waiters, entry)
+            try:
+                while self._waiters[0] != entry or self.in_flight >= int(self.limit):
+                    left = remaining()
+                    if left is not None and left <= 0.05:
+                        DEADLINE_EXCEEDED.inc(dependency="gmail")
+                        raise DeadlineExceeded("gmail")
+                    self._cond.wait(left)
+            finally:
+                # Leave the queue whether we got the slot or gave up
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+            self.in_flight += 1
+
+    def release(self, outcome: str):
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == OK:
+                self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            elif outcome == THROTTLED:
+                self._decrease()
+            self._cond.notify_all()
+
+    def throttled(self):
+        """Throttling reported outside an admitted call, e.g. by a part of a batch response"""
+        with self._cond:
+            self._decrease()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            self._last_decrease = now
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "waiting": len(self._waiters)}
+
+
+class QuotaController:
+    """Admits Gmail calls against per-user and per-project quota and an adaptive concurrency limit"""
+
+    def __init__(self, user_rate: float = 250.0, project_rate: float = 20000.0, max_concurrency: int = 32,
+                 initial_concurrency: int = 8, max_users: int = 10000):
+        self.user_rate = user_rate
+        self.project = TokenBucket(project_rate)
+        self.limiter = AimdLimiter(initial=min(initial_concurrency, max_concurrency), maximum=max_concurrency)
+        self.max_users = max_users
+        self._users: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _user_bucket(self, user_key: str) -> TokenBucket:
+        with self._lock:
+            bucket = self._users.get(user_key)
+            if bucket is None:
+                bucket = self._users[user_key] = TokenBucket(self.user_rate)
+                if len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_key)
+            return bucket
+
+    def acquire(self, user_key: str, units: float):
+        """Block until the call fits the quota and a slot is free; must be paired with release()"""
+        cls = current_priority()
+        started = time.monotonic()
+        user = self._user_bucket(user_key)
+        reserve = RESERVED_FRACTION[cls]
+        for bucket in (user, self.project):
+            while True:
+                wait = bucket.try_take(units, bucket.capacity * reserve)
+                if not wait:
+                    break
+                _sleep_within_deadline(wait)
+        self.limiter.acquire(PRIORITY_RANK[cls])
+        QUOTA_WAIT_SECONDS.observe(time.monotonic() - started, priority=cls)
+
+    def release(self, user_key: str, outcome: str):
+        if outcome == THROTTLED:
+            self._user_bucket(user_key).drain()
+        self.limiter.release(outcome)
+
+    def throttled(self, user_key: str, reason: str):
+        """Throttling seen outside a single admitted call (e.g. inside a batch response)"""
+        GMAIL_THROTTLED.inc(reason=reason)
+        self._user_bucket(user_key).drain()
+        self.limiter.throttled()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            users = len(self._users)
+        return {"concurrency": self.limiter.snapshot(), "tracked_users": users,
+                "project_units_available": round(self.project.level, 1)}
+
+
+def user_key(authorization: Optional[str]) -> str:
+    """Per-user bucket key: the Gmail account the calls are charged to.
+
+    Outside gmail_account() it falls back to a hash of the bearer token, which
+    changes whenever the token is refreshed.
+    """
+    account = _account.get()
+    if account:
+        return account
+    return hashlib.sha1((authorization or "").encode()).hexdigest()[:16]
+
+
+def rate_limit_reason(status: int, payload: Optional[dict]) -> Optional[str]:
+    """The rate-limit reason for a Gmail error response, or None if it is not throttling"""
+    if status == 429:
+        return "429"
+    if status != 403 or not isinstance(payload, dict):
+        return None
+    for error in (payload.get("error") or {}).get("errors") or []:
+        if error.get("reason") in RATE_LIMIT_REASONS:
+            return error["reason"]
+    return None
@@ -0,0 +1,240 @@
+# read_replica.py
+"""Per-worker read replica of active users' hot data: recent emails, keywords and a keyword match index.
+
+Each worker process keeps an in-memory SQLite copy of the `emails` and
+`keywords` rows of the users it serves. Each user's copy is stamped with the
+data version (data_versions.py) it reflects. A read is served locally only when
+its stamp equals the user's current version; otherwise the caller falls back to
+Supabase and reloads the copy.
+
+Writes made by this worker are replayed into the replica as the version is
+bumped. That works only when the copy was at exactly the version before the
+bump. A gap means another worker wrote in between, so the copy is dropped and
+reloaded on the next read. Replayed inserts lack the columns Postgres fills in
+(the numeric `id`) until that reload; readers key rows by `message_id`.
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+EMAILS, KEYWORDS = "emails", "keywords"
+
+READ_REPLICA = registry.counter(
+    "mailpilot_read_replica_total", "Read replica lookups by data kind and result", ["kind", "result"])
+
+
+def match_text(row: Dict) -> str:
+    """Lowercased subject, snippet and sender a keyword is matched against"""
+    return "\n".join((row.get(field) or "").lower() for field in ("subject", "snippet", "from_email"))
+
+
+class ReadReplica:
+    """In-memory SQLite copy of up to `max_users` users' rows, each with at most `max_rows` emails"""
+
+    def __init__(self, max_users: int = 200, max_rows: int = 1000):
+        self.max_users = max_users
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+        self._db.execute(
+            "CREATE TABLE stamps ("
+            " user_id TEXT NOT NULL, kind TEXT NOT NULL, version INTEGER NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (user_id, kind))"
+        )
+        # match_text is the match index: keyword lookups are instr() scans over it, never a Python loop
+        self._db.execute(
+            "CREATE TABLE emails ("
+            " user_id TEXT NOT NULL, message_id TEXT NOT NULL, date TEXT, match_text TEXT NOT NULL,"
+            " row TEXT NOT NULL, PRIMARY KEY (user_id, message_id))"
+        )
+        self._db.execute("CREATE INDEX emails_user_date_idx ON emails (user_id, date DESC)")
+        self._db.execute(
+            "CREATE TABLE keywords (user_id TEXT NOT NULL, seq INTEGER NOT NULL, keyword TEXT NOT NULL,"
+            " PRIMARY KEY (user_id, keyword))"
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_users > 0
+
+    def _current(self, user_id: str, kind: str, version: Optional[int]) -> bool:
+        if version is None or not self.enabled:
+            return False
+        row = self._db.execute(
+            "SELECT version FROM stamps WHERE user_id = ? AND kind = ?", (user_id, kind)).fetchone()
+        if row is None or row[0] != version:
+            READ_REPLICA.inc(kind=kind, result="miss" if row is None else "stale")
+            return False
+        self._db.execute(
+            "UPDATE stamps SET last_used = ? WHERE user_id = ? AND kind = ?", (time.time(), user_id, kind))
+        READ_REPLICA.inc(kind=kind, result="hit")
+        return True
+
+    # --- Reads: None means "not replicated at this version", so the caller asks Supabase ---
+
+    def recent(self, user_id: str, version: Optional[int], limit: int) -> Optional[List[Dict]]:
+        """Newest emails first, like `select * ... order by date desc limit n`"""
+        with self._lock:
+            if not self._current(user_id, EMAILS, version):
+                return None
+            rows = self._db.execute(
+                "SELECT row FROM emails WHERE user_id = ? ORDER BY date DESC LIMIT ?", (user_id, limit)).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def matching(self, user_id: str, version: Optional[int], keywords: List[str], limit: int) -> Optional[List[Dict]]:
+        """Newest emails whose subject, snippet or sender contains any of the keywords"""
+        needles = [k.lower() for k in keywords if k]
+        with self._lock:
+            if not self._current(user_id, EMAILS, version):
+                return None
+            if not needles:
+                return []
+            where = " OR ".join("instr(match_text, ?) > 0" for _ in needles)
+            rows = self._db.execute(
+                f"SELECT row FROM emails WHERE user_id = ? AND ({where}) ORDER BY date DESC LIMIT ?",
+                (user_id, *needles, limit),
+            ).fetchall()
+        return [json.loads(r[0]) for r in rows]
+
+    def keywords(self, user_id: str, version: Optional[int]) -> Optional[List[str]]:
+        with self._lock:
+            if not self._current(user_id, KEYWORDS, version):
+                return None
+            rows = self._db.execute("SELECT keyword FROM keywords WHERE user_id = ? ORDER BY seq", (user_id,)).fetchall()
+        return [r[0] for r in rows]
+
+    # --- Loads from Supabase ---
+
+    def load_emails(self, user_id: str, version: Optional[int], rows: List[Dict]) -> bool:
+        """Replace a user's emails with rows read at `version`; False if there are too many to replicate"""
+        if version is None or not self.enabled or len(rows) > self.max_rows:
+            return False
+        with self._lock:
+            if not self._stamp(user_id, EMAILS, version):
+                return False
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM emails WHERE user_id = ?", (user_id,))
+            self._insert_emails(user_id, rows)
+            self._db.execute("COMMIT")
+            self._evict()
+        return True
+
+    def load_keywords(self, user_id: str, version: Optional[int], keywords: List[str]) -> bool:
+        if version is None or not self.enabled:
+            return False
+        with self._lock:
+            if not self._stamp(user_id, KEYWORDS, version):
+                return False
+            self._db.execute("BEGIN")
+            self._db.execute("DELETE FROM keywords WHERE user_id = ?", (user_id,))
+            self._add_keywords(user_id, keywords)
+            self._db.execute("COMMIT")
+            self._evict()
+        return True
+
+    def _stamp(self, user_id: str, kind: str, version: int) -> bool:
+        row = self._db.execute(
+            "SELECT version FROM stamps WHERE user_id = ? AND kind = ?", (user_id, kind)).fetchone()
+        if row is not None and row[0] > version:
+            # A newer copy landed while these rows were being read
+            return False
+        self._db.execute(
+            "INSERT OR REPLACE INTO stamps (user_id, kind, version, last_used) VALUES (?, ?, ?, ?)",
+            (user_id, kind, version, time.time()),
+        )
+        return True
+
+    def _insert_emails(self, user_id: str, rows: Iterable[Dict]):
+        self._db.executemany(
+            "INSERT OR REPLACE INTO emails (user_id, message_id, date, match_text, row) VALUES (?, ?, ?, ?, ?)",
+            [(user_id, r["message_id"], r.get("date"), match_text(r), json.dumps(r, default=str)) for r in rows],
+        )
+
+    def _add_keywords(self, user_id: str, keywords: Iterable[str]):
+        seq = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM keywords WHERE user_id = ?", (user_id,)).fetchone()[0]
+        for keyword in keywords:
+            seq += 1
+            self._db.execute(
+                "INSERT OR IGNORE INTO keywords (user_id, seq, keyword) VALUES (?, ?, ?)", (user_id, seq, keyword))
+
+    def _evict(self):
+        users = self._db.execute("SELECT COUNT(DISTINCT user_id) FROM stamps").fetchone()[0]
+        if users <= self.max_users:
+            return
+        victims = self._db.execute(
+            "SELECT user_id FROM stamps GROUP BY user_id ORDER BY MAX(last_used) LIMIT ?",
+            (users - self.max_users,),
+        ).fetchall()
+        for (user_id,) in victims:
+            self._drop(user_id)
+
+    # --- Writes replayed from this worker ---
+
+    def apply(self, user_id: str, version: Optional[int], inserted: Iterable[Dict] = (),
+              deleted: Iterable[str] = (), summaries: Optional[Dict[str, str]] = None,
+              keywords_added: Iterable[str] = (), keywords_removed: Iterable[str] = ()):
+        """Replay a write that moved the user to `version`.
+
+        Every replicated kind of the user moves along, changed or not, since
+        they share one version. A kind that was not at `version - 1` is dropped.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if version is None:
+                self._drop(user_id)
+                return
+            stamps = dict(self._db.execute("SELECT kind, version FROM stamps WHERE user_id = ?", (user_id,)).fetchall())
+            self._db.execute("BEGIN")
+            for kind, stamp in stamps.items():
+                if stamp != version - 1:
+                    self._drop(user_id, kind)
+                    continue
+                if kind == EMAILS:
+                    self._apply_emails(user_id, list(inserted), list(deleted), summaries or {})
+                else:
+                    self._add_keywords(user_id, keywords_added)
+                    self._db.executemany("DELETE FROM keywords WHERE user_id = ? AND keyword = ?",
+                                         [(user_id, k) for k in keywords_removed])
+                self._db.execute(
+                    "UPDATE stamps SET version = ? WHERE user_id = ? AND kind = ?", (version, user_id, kind))
+            self._db.execute("COMMIT")
+
+    def _apply_emails(self, user_id: str, inserted: List[Dict], deleted: List[str], summaries: Dict[str, str]):
+        self._insert_emails(user_id, inserted)
+        self._db.executemany("DELETE FROM emails WHERE user_id = ? AND message_id = ?",
+                             [(user_id, mid) for mid in deleted])
+        for mid, summary in summaries.items():
+            row = self._db.execute(
+                "SELECT row FROM emails WHERE user_id = ? AND message_id = ?", (user_id, mid)).fetchone()
+            if row:
+                updated = {**json.loads(row[0]), "summary": summary}
+                self._db.execute("UPDATE emails SET row = ? WHERE user_id = ? AND message_id = ?",
+                                 (json.dumps(updated, default=str), user_id, mid))
+        count = self._db.execute("SELECT COUNT(*) FROM emails WHERE user_id = ?", (user_id,)).fetchone()[0]
+        if count > self.max_rows:
+            # Grown past what a load would accept; let the next read decide from Supabase
+            self._drop(user_id, EMAILS)
+
+    def _drop(self, user_id: str, kind: Optional[str] = None):
+        kinds = [kind] if kind else [EMAILS, KEYWORDS]
+        for k in kinds:
+            self._db.execute("DELETE FROM stamps WHERE user_id = ? AND kind = ?", (user_id, k))
+            self._db.execute(f"DELETE FROM {k} WHERE user_id = ?", (user_id,))
+
+    def drop(self, user_id: str):
+        with self._lock:
+            self._drop(user_id)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            users = self._db.execute("SELECT COUNT(DISTINCT user_id) FROM stamps").fetchone()[0]
+            emails = self._db.execute("SELECT COUNT(*) FROM emails").fetchone()[0]
+        return {"users": users, "emails": emails, "max_users": self.max_users, "max_rows": self.max_rows}
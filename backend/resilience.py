@@ -0,0 +1,226 @@
+# resilience.py
+"""Retries with jittered backoff, per-dependency circuit breakers and per-request deadlines."""
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+
+from metrics import registry
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+RETRIES = registry.counter(
+    "mailpilot_upstream_retries_total", "Retried upstream calls by dependency and reason", ["dependency", "reason"])
+BREAKER_REJECTIONS = registry.counter(
+    "mailpilot_circuit_breaker_rejections_total", "Calls failed fast by an open circuit breaker", ["dependency"])
+DEADLINE_EXCEEDED = registry.counter(
+    "mailpilot_deadline_exceeded_total", "Upstream calls skipped because the request deadline had passed",
+    ["dependency"])
+
+
+class UpstreamUnavailable(Exception):
+    """Raised instead of calling an upstream that cannot answer in time"""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    def __init__(self, dependency: str, retry_in: float):
+        super().__init__(f"{dependency} circuit open, retry in {retry_in:.1f}s")
+        self.dependency = dependency
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    def __init__(self, dependency: str):
+        super().__init__(f"request deadline exceeded before calling {dependency}")
+        self.dependency = dependency
+
+
+# --- Deadlines ---
+
+_deadline: ContextVar[Optional[float]] = ContextVar("mailpilot_deadline", default=None)
+
+
+@contextmanager
+def deadline(seconds: Optional[float], detach: bool = False):
+    """Bound every upstream call in this context to finish within `seconds`.
+
+    Nested deadlines can only shorten the current one, unless `detach` is set, which
+    starts a fresh budget (or none, for seconds=None); background work that outlives
+    the request that scheduled it uses that.
+    """
+    new = time.monotonic() + seconds if seconds is not None else None
+    current = _deadline.get()
+    if not detach and current is not None and (new is None or current < new):
+        new = current
+    token = _deadline.set(new)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one"""
+    current = _deadline.get()
+    return None if current is None else current - time.monotonic()
+
+
+def bounded_timeout(timeout: Optional[float], dependency: str) -> Optional[float]:
+    """The smaller of a call's own timeout and the time left; raises once nothing is left"""
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0.05:
+        DEADLINE_EXCEEDED.inc(dependency=dependency)
+        raise DeadlineExceeded(dependency)
+    return left if timeout is None else min(timeout, left)
+
+
+class DeadlineMiddleware:
+    """ASGI middleware giving every HTTP request a deadline for its upstream calls"""
+
+    def __init__(self, app, seconds: float):
+        self.app = app
+        self.seconds = seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.seconds <= 0:
+            await self.app(scope, receive, send)
+            return
+        with deadline(self.seconds, detach=True):
+            await self.app(scope, receive, send)
+
+
+# --- Circuit breakers ---
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures, then lets one probe through after `reset_timeout`"""
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset_timeout:
+                    BREAKER_REJECTIONS.inc(dependency=self.name)
+                    raise CircuitOpenError(self.name, self.reset_timeout - waited)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    BREAKER_REJECTIONS.inc(dependency=self.name)
+                    raise CircuitOpenError(self.name, 0.0)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def release(self):
+        """End a call that says nothing about upstream health (it never reached the dependency,
+        or failed on our side), freeing the half-open probe slot it may hold"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._probe_in_flight = False
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def snapshot(self) -> Dict:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+# --- Retry policy ---
+
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class RetryPolicy:
+    """How one dependency is retried; `retry_methods` lists the verbs that are safe to repeat"""
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.2, max_delay: float = 5.0,
+                 retry_methods: Iterable[str] = IDEMPOTENT_METHODS, timeout: Optional[float] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_methods = frozenset(retry_methods)
+        self.timeout = timeout
+
+    def can_retry(self, method: str, attempt: int) -> bool:
+        return attempt < self.max_attempts and method.upper() in self.retry_methods
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Full-jitter exponential backoff, or the server's Retry-After when it sent one"""
+        if retry_after is not None:
+            return min(max(retry_after, 0.0), self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError):
+        return None
+
+
+def sleep_before_retry(delay: float) -> bool:
+    """Sleep for a retry unless that would run past the deadline; returns whether it slept"""
+    left = remaining()
+    if left is not None and delay >= left:
+        return False
+    time.sleep(delay)
+    return True
+
+
+class Dependency:
+    """Breaker plus retry policy for one upstream"""
+
+    def __init__(self, name: str, policy: RetryPolicy, breaker: CircuitBreaker):
+        self.name = name
+        self.policy = policy
+        self.breaker = breaker
+
+
+dependencies: Dict[str, Dependency] = {}
+
+
+def register_dependency(name: str, policy: RetryPolicy, failure_threshold: int = 5,
+                        reset_timeout: float = 30.0) -> Dependency:
+    dep = Dependency(name, policy, CircuitBreaker(name, failure_threshold, reset_timeout))
+    dependencies[name] = dep
+    return dep
+
+
+def breaker_states() -> Dict[str, Dict]:
+    return {name: dep.breaker.snapshot() for name, dep in dependencies.items()}
+
+
+registry.gauge(
+    "mailpilot_circuit_breaker_state", "Circuit breaker state per dependency (0 closed, 1 half-open, 2 open)",
+    ["dependency"],
+    callback=lambda: {(name,): _STATE_VALUES[dep.breaker.state] for name, dep in dependencies.items()},
+)
@@ -0,0 +1,180 @@
+# scheduler.py
+"""Fair-share scheduler for background work (sync jobs, summaries), so no single user can starve the rest.
+
+Work is queued per tenant (MailPilot user) inside a priority class:
+- interactive: work a user is actively waiting on (a sync they started)
+- scheduled: follow-up work (summaries of newly synced mail)
+- backfill: bulk catch-up (the long tail of a large summary backlog)
+
+Workers serve the highest class that has queued work and is under its
+concurrency cap. Within a class, tenants take turns by deficit round-robin:
+each turn adds the tenant's weight to its deficit, and it runs tasks while the
+deficit covers their cost. A user with a thousand queued tasks therefore gets
+the same share as a user with one, and the light user's wait stays bounded by
+the number of active tenants rather than the length of the heavy user's queue.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Dict, List, Optional
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE, SCHEDULED, BACKFILL = "interactive", "scheduled", "backfill"
+CLASSES = (INTERACTIVE, SCHEDULED, BACKFILL)
+
+QUEUE_WAIT_SECONDS = registry.histogram(
+    "mailpilot_scheduler_queue_wait_seconds", "Time background tasks waited in the fair scheduler", ["priority"])
+
+
+class _Task:
+    __slots__ = ("tenant", "fn", "args", "cost", "future", "enqueued")
+
+    def __init__(self, tenant: str, fn: Callable, args: tuple, cost: float):
+        self.tenant = tenant
+        self.fn = fn
+        self.args = args
+        self.cost = cost
+        self.future: Future = Future()
+        self.enqueued = time.monotonic()
+
+
+class _ClassQueue:
+    """Per-tenant FIFO queues of one class, served by deficit round-robin"""
+
+    def __init__(self, cap: int):
+        self.cap = cap
+        self.running = 0
+        self.queued = 0
+        self.tenants: Dict[str, Deque[_Task]] = {}
+        self.ring: Deque[str] = deque()  # tenants with queued work, in turn order
+        self.deficit: Dict[str, float] = {}
+
+    def push(self, task: _Task):
+        tasks = self.tenants.get(task.tenant)
+        if tasks is None:
+            tasks = self.tenants[task.tenant] = deque()
+            self.ring.append(task.tenant)
+            self.deficit[task.tenant] = 0.0
+        tasks.append(task)
+        self.queued += 1
+
+    def pop(self, weight_for: Callable[[str], float]) -> _Task:
+        while True:
+            tenant = self.ring[0]
+            tasks = self.tenants[tenant]
+            if self.deficit[tenant] >= tasks[0].cost:
+                task = tasks.popleft()
+                self.deficit[tenant] -= task.cost
+                self.queued -= 1
+                if not tasks:
+                    # An idle tenant keeps no credit, as in DRR
+                    del self.tenants[tenant]
+                    del self.deficit[tenant]
+                    self.ring.popleft()
+                    if self.ring:
+                        self.deficit[self.ring[0]] += max(weight_for(self.ring[0]), 0.01)
+                return task
+            # Turn over: the next tenant in the ring gets its quantum
+            self.ring.rotate(-1)
+            front = self.ring[0]
+            self.deficit[front] += max(weight_for(front), 0.01)
+
+    def drain(self) -> List[_Task]:
+        tasks = [t for queue in self.tenants.values() for t in queue]
+        self.tenants.clear()
+        self.ring.clear()
+        self.deficit.clear()
+        self.queued = 0
+        return tasks
+
+
+class FairScheduler:
+    """Runs submitted tasks on `workers` threads, fairly across tenants and by priority class"""
+
+    def __init__(self, workers: int = 8, caps: Optional[Dict[str, int]] = None, name: str = "scheduler"):
+        self.workers = workers
+        self.name = name
+        caps = caps or {}
+        self._queues = {cls: _ClassQueue(max(1, min(caps.get(cls, workers), workers))) for cls in CLASSES}
+        self._weights: Dict[str, float] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._closing = False
+
+    def set_weight(self, tenant: str, weight: float):
+        """Share of a tenant relative to others (default 1); 1.0 drops the override"""
+        with self._cond:
+            if weight == 1.0:
+                self._weights.pop(tenant, None)
+            else:
+                self._weights[tenant] = weight
+
+    def _weight(self, tenant: str) -> float:
+        return self._weights.get(tenant, 1.0)
+
+    def submit(self, tenant: str, cls: str, fn: Callable, *args, cost: float = 1.0) -> Future:
+        """Queue fn(*args) for a tenant in a priority class; cost is in task units (default 1)"""
+        if cls not in self._queues:
+            raise ValueError(f"Unknown scheduler class: {cls}")
+        task = _Task(tenant, fn, args, max(cost, 0.01))
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("Scheduler is shut down")
+            self._queues[cls].push(task)
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name=f"{self.name}-{len(self._threads)}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+        return task.future
+
+    def _next(self):
+        with self._cond:
+            while True:
+                if self._closing:
+                    return None, None
+                for cls in CLASSES:
+                    queue = self._queues[cls]
+                    if queue.queued and queue.running < queue.cap:
+                        queue.running += 1
+                        return cls, queue.pop(self._weight)
+                self._cond.wait()
+
+    def _work(self):
+        while True:
+            cls, task = self._next()
+            if task is None:
+                return
+            QUEUE_WAIT_SECONDS.observe(time.monotonic() - task.enqueued, priority=cls)
+            try:
+                if task.future.set_running_or_notify_cancel():
+                    try:
+                        task.future.set_result(task.fn(*task.args))
+                    except Exception as e:
+                        logger.error(f"[SCHED] {cls} task for {task.tenant} failed: {e}")
+                        task.future.set_exception(e)
+            finally:
+                with self._cond:
+                    self._queues[cls].running -= 1
+                    self._cond.notify_all()
+
+    def snapshot(self) -> Dict:
+        with self._cond:
+            return {
+                cls: {"queued": q.queued, "running": q.running, "cap": q.cap, "tenants": len(q.ring)}
+                for cls, q in self._queues.items()
+            }
+
+    def shutdown(self):
+        """Stop taking tasks; queued ones are cancelled, running ones finish in the background"""
+        with self._cond:
+            self._closing = True
+            dropped = [t for q in self._queues.values() for t in q.drain()]
+            self._cond.notify_all()
+        for task in dropped:
+            task.future.cancel()
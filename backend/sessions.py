@@ -0,0 +1,224 @@
+# sessions.py
+"""Login sessions: signed tokens that identify the caller of each request.
+
+A session token is `<id>.<signature>`. The id is random and the signature is an
+HMAC of it under the server's session secret, so forged or mangled tokens are
+rejected before any lookup. Tokens arrive as an HttpOnly cookie (browsers) or
+as `Authorization: Bearer` (API clients, benchmarks). EventSource can send
+neither header, so a session can also mint short-lived stream tokens that go
+in an event stream's query string. Session tokens themselves never go in a
+URL: a frontend that cannot rely on the cookie gets a single-use login code
+in the sign-in redirect and exchanges it for a token of its own.
+
+Sessions live in SQLite under STATE_DIR, shared by all workers on a host and
+kept across restarts. Only a SHA-256 of each id is stored, so the database
+alone cannot be replayed as cookies. Lookups go through a bounded in-memory
+cache whose entries expire after `cache_ttl` seconds. A session revoked in
+another worker therefore stops working here within that time.
+"""
+import hashlib
+import hmac
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from metrics import registry
+
+logger = logging.getLogger(__name__)
+
+SESSION_LOOKUPS = registry.counter(
+    "mailpilot_session_lookups_total", "Session token lookups by result", ["result"])
+
+
+def load_secret(path: str) -> bytes:
+    """Session signing key kept in a file, created on first use so every worker on the host shares it"""
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as f:
+            return f.read().strip()
+    secret = secrets.token_hex(32).encode()
+    with os.fdopen(fd, "wb") as f:
+        f.write(secret)
+    return secret
+
+
+class SessionStore:
+    """Session token -> user ID, persisted in SQLite with a bounded TTL cache in front"""
+
+    def __init__(self, path: str, secret: bytes, ttl: float = 30 * 86400, cache_size: int = 10000,
+                 cache_ttl: float = 60.0):
+        self.path = path
+        self.secret = secret
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self._cache: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()  # key -> (user_id, valid_until)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                " key TEXT PRIMARY KEY, user_id TEXT NOT NULL, created_at REAL NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_user_idx ON sessions (user_id)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_expiry_idx ON sessions (expires_at)")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS login_codes (key TEXT PRIMARY KEY, user_id TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def _sign(self, value: str) -> str:
+        return hmac.new(self.secret, value.encode(), hashlib.sha256).hexdigest()[:32]
+
+    def _key(self, token: Optional[str]) -> Optional[str]:
+        """Storage key of a token with a valid signature, else None"""
+        if not token or "." not in token:
+            return None
+        session_id, _, signature = token.rpartition(".")
+        if not hmac.compare_digest(signature, self._sign(session_id)):
+            return None
+        return hashlib.sha256(session_id.encode()).hexdigest()
+
+    def create(self, user_id: str) -> str:
+        """New session for user_id; returns the token to hand to the client"""
+        session_id = secrets.token_urlsafe(32)
+        token = f"{session_id}.{self._sign(session_id)}"
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE expires_at < ?", (now,))
+            conn.execute(
+                "INSERT INTO sessions (key, user_id, created_at, expires_at) VALUES (?, ?, ?, ?)",
+                (self._key(token), user_id, now, now + self.ttl),
+            )
+        return token
+
+    def login_code(self, user_id: str, ttl: float = 60.0) -> str:
+        """Single-use code, valid for `ttl` seconds, that exchange_code() trades for a new session"""
+        code = secrets.token_urlsafe(32)
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("DELETE FROM login_codes WHERE expires_at < ?", (now,))
+            conn.execute("INSERT INTO login_codes (key, user_id, expires_at) VALUES (?, ?, ?)",
+                         (hashlib.sha256(code.encode()).hexdigest(), user_id, now + ttl))
+        return code
+
+    def exchange_code(self, code: Optional[str]) -> Optional[str]:
+        """New session token for an unused, unexpired login code; the code is spent either way"""
+        if not code:
+            return None
+        key = hashlib.sha256(code.encode()).hexdigest()
+        with self._connect() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT user_id, expires_at FROM login_codes WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM login_codes WHERE key = ?", (key,))
+            conn.execute("COMMIT")
+        if row is None or row[1] < time.time():
+            SESSION_LOOKUPS.inc(result="invalid" if row is None else "expired")
+            return None
+        return self.create(row[0])
+
+    def resolve(self, token: Optional[str]) -> Optional[str]:
+        """User ID of a live session, or None for a missing, forged, expired or revoked token"""
+        key = self._key(token)
+        if key is None:
+            if token:
+                SESSION_LOOKUPS.inc(result="invalid")
+            return None
+        return self._resolve_key(key)
+
+    def stream_token(self, token: Optional[str], ttl: float = 60.0) -> Optional[str]:
+        """Token standing in for a session on event stream URLs, valid for `ttl` seconds.
+
+        It names the session rather than the user, so revoking the session revokes it too.
+        """
+        key = self._key(token)
+        if key is None:
+            return None
+        payload = f"{key}.{int(time.time() + ttl)}"
+        return f"{payload}.{self._sign('stream:' + payload)}"
+
+    def resolve_stream(self, stream_token: Optional[str]) -> Optional[str]:
+        """User ID behind an unexpired stream token whose session is still live"""
+        key, _, rest = (stream_token or "").partition(".")
+        expires, _, signature = rest.partition(".")
+        if not (key and expires.isdigit() and signature) or not hmac.compare_digest(
+                signature, self._sign(f"stream:{key}.{expires}")):
+            if stream_token:
+                SESSION_LOOKUPS.inc(result="invalid")
+            return None
+        if int(expires) < time.time():
+            SESSION_LOOKUPS.inc(result="expired")
+            return None
+        return self._resolve_key(key)
+
+    def _resolve_key(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None and cached[1] > now:
+                self._cache.move_to_end(key)
+                SESSION_LOOKUPS.inc(result="hit")
+                return cached[0]
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT user_id, expires_at FROM sessions WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"[SESSION] Session store unavailable: {e}")
+            return None
+        if row is None or row[1] <= now:
+            SESSION_LOOKUPS.inc(result="unknown")
+            with self._lock:
+                self._cache.pop(key, None)
+            return None
+        SESSION_LOOKUPS.inc(result="miss")
+        with self._lock:
+            self._cache[key] = (row[0], min(now + self.cache_ttl, row[1]))
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return row[0]
+
+    def revoke(self, token: Optional[str]) -> Optional[str]:
+        """End one session; returns its user ID"""
+        key = self._key(token)
+        if key is None:
+            return None
+        with self._lock:
+            self._cache.pop(key, None)
+        with self._connect() as conn:
+            row = conn.execute("SELECT user_id FROM sessions WHERE key = ?", (key,)).fetchone()
+            conn.execute("DELETE FROM sessions WHERE key = ?", (key,))
+        return row[0] if row else None
+
+    def revoke_user(self, user_id: str):
+        """End every session of a user"""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+        with self._lock:
+            for key in [k for k, (uid, _) in self._cache.items() if uid == user_id]:
+                del self._cache[key]
+
+    def active_sessions(self, user_id: str) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM sessions WHERE user_id = ? AND expires_at > ?", (user_id, time.time())
+            ).fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._cache)
+        try:
+            with self._connect() as conn:
+                stored = conn.execute("SELECT COUNT(*) FROM sessions WHERE expires_at > ?", (time.time(),)).fetchone()[0]
+        except sqlite3.Error:
+            stored = None
+        return {"sessions": stored, "cached": cached, "cache_size": self.cache_size}
@@ -0,0 +1,175 @@
+-- MailPilot Supabase schema
+
+create table if not exists emails (
+  id bigint generated by default as identity primary key,
+  message_id text not null,
+  from_email text,
+  subject text,
+  date timestamptz,
+  snippet text,
+  summary text,
+  user_id text not null,
+  created_at timestamptz default now(),
+  updated_at timestamptz default now()
+);
+
+create index if not exists emails_user_date_idx on emails (user_id, date desc);
+create unique index if not exists emails_user_message_idx on emails (user_id, message_id);
+
+-- Inbox tab (primary, social, promotions, updates, forums) from Gmail's category labels
+alter table emails add column if not exists category text;
+-- Keyset pagination for GET /emails/export
+create index if not exists emails_user_id_idx on emails (user_id, id);
+-- Gmail conversation of each email
+alter table emails add column if not exists thread_id text;
+create index if not exists emails_user_thread_idx on emails (user_id, thread_id);
+
+-- One rollup per conversation for SYNC_GRANULARITY=thread; history_id is the thread's revision
+create table if not exists email_threads (
+  user_id text not null,
+  thread_id text not null,
+  history_id bigint not null,
+  subject text,
+  participants jsonb not null default '[]'::jsonb,
+  message_count integer not null default 0,
+  unread_count integer not null default 0,
+  first_date timestamptz,
+  last_date timestamptz,
+  last_message_id text,
+  snippet text,
+  category text,
+  summary text,
+  summary_history_id bigint,  -- revision the summary was written for
+  updated_at timestamptz default now(),
+  primary key (user_id, thread_id)
+);
+
+create index if not exists email_threads_user_last_idx on email_threads (user_id, last_date desc);
+
+create table if not exists keywords (
+  id bigint generated by default as identity primary key,
+  user_id text not null,
+  keyword text not null,
+  created_at timestamptz default now()
+);
+
+create index if not exists keywords_user_idx on keywords (user_id);
+
+-- Per-user sender analytics, updated incrementally by sync and trim
+create table if not exists sender_rollups (
+  user_id text not null,
+  sender text not null,
+  email_count integer not null default 0,
+  last_seen timestamptz,
+  keywords jsonb not null default '{}'::jsonb,      -- keyword -> matching email count
+  daily_counts jsonb not null default '{}'::jsonb,  -- YYYY-MM-DD -> email count
+  primary key (user_id, sender)
+);
+
+create index if not exists sender_rollups_user_count_idx on sender_rollups (user_id, email_count desc);
+
+-- Append-only change log behind GET /emails/changes; pruned after CHANGE_LOG_RETENTION_DAYS
+create table if not exists email_changes (
+  id bigint generated always as identity primary key,
+  user_id text not null,
+  message_id text not null,
+  op text not null check (op in ('insert', 'update', 'delete')),
+  created_at timestamptz not null default now()
+);
+
+create index if not exists email_changes_user_id_idx on email_changes (user_id, id);
+create index if not exists email_changes_user_created_idx on email_changes (user_id, created_at);
+
+-- Highest change id pruned per user; cursors below it have missed changes
+create table if not exists email_change_horizons (
+  user_id text primary key,
+  pruned_through bigint not null default 0
+);
+
+-- A page of changes after p_after, stopping p_settle_seconds short of now() on the database
+-- clock, so rows whose identity id was taken by a transaction still committing are not skipped
+create or replace function email_changes_since(p_user_id text, p_after bigint, p_limit integer,
+                                               p_settle_seconds double precision)
+returns setof email_changes
+language sql stable as $$
+  select * from email_changes
+  where user_id = p_user_id and id > p_after
+    and created_at < now() - make_interval(secs => p_settle_seconds)
+  order by id
+  limit p_limit
+$$;
+
+-- Deletes a user's changes older than the retention window and records the highest id deleted
+create or replace function prune_email_changes(p_user_id text, p_retention_seconds double precision)
+returns integer
+language plpgsql as $$
+declare
+  pruned integer;
+  last_id bigint;
+begin
+  with deleted as (
+    delete from email_changes
+    where user_id = p_user_id and created_at < now() - make_interval(secs => p_retention_seconds)
+    returning id
+  )
+  select count(*), max(id) into pruned, last_id from deleted;
+  if last_id is not null then
+    insert into email_change_horizons (user_id, pruned_through) values (p_user_id, last_id)
+    on conflict (user_id) do update
+      set pruned_through = greatest(email_change_horizons.pruned_through, excluded.pruned_through);
+  end if;
+  return pruned;
+end;
+$$;
+
+-- Adds two {key: count} objects, dropping keys whose count falls to zero
+create or replace function jsonb_add_counts(a jsonb, b jsonb) returns jsonb
+language sql immutable as $$
+  select coalesce(jsonb_object_agg(key, n), '{}'::jsonb)
+  from (
+    select key, sum(value::int) as n
+    from (
+      select * from jsonb_each_text(coalesce(a, '{}'::jsonb))
+      union all
+      select * from jsonb_each_text(coalesce(b, '{}'::jsonb))
+    ) counts
+    group by key
+  ) totals
+  where n > 0
+$$;
+
+-- Adds per-sender deltas (negative for deleted emails) to sender_rollups in place, so workers
+-- writing at once never overwrite each other. p_deltas: [{sender, count, last_seen, keywords, days}]
+create or replace function apply_sender_deltas(p_user_id text, p_deltas jsonb) returns void
+language plpgsql as $$
+declare
+  d jsonb;
+begin
+  for d in select value from jsonb_array_elements(p_deltas) loop
+    insert into sender_rollups (user_id, sender) values (p_user_id, d->>'sender')
+    on conflict (user_id, sender) do nothing;
+    update sender_rollups r set
+      email_count = greatest(r.email_count + (d->>'count')::int, 0),
+      last_seen = greatest(r.last_seen, (d->>'last_seen')::timestamptz),
+      keywords = jsonb_add_counts(r.keywords, d->'keywords'),
+      daily_counts = jsonb_add_counts(r.daily_counts, d->'days')
+    where r.user_id = p_user_id and r.sender = d->>'sender';
+  end loop;
+  -- A delete may have taken the sender's latest email; look up the one now latest
+  update sender_rollups r set
+    last_seen = (select max(e.date) from emails e where e.user_id = p_user_id and trim(e.from_email) = r.sender)
+  where r.user_id = p_user_id
+    and r.sender in (select value->>'sender' from jsonb_array_elements(p_deltas) where (value->>'count')::int < 0);
+  delete from sender_rollups where user_id = p_user_id and email_count <= 0;
+end
+$$;
+
+-- Replaces one keyword's per-sender match counts (p_counts: {sender: count}; {} drops the keyword)
+create or replace function set_sender_keyword(p_user_id text, p_keyword text, p_counts jsonb) returns void
+language sql as $$
+  update sender_rollups set keywords = case
+    when p_counts ? sender then jsonb_set(keywords, array[p_keyword], p_counts->sender)
+    else keywords - p_keyword
+  end
+  where user_id = p_user_id;
+$$;
@@ -0,0 +1,169 @@
+# sync_coordinator.py
+"""Per-user sync coalescing: single-flight within a worker, SQLite leases across workers."""
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SyncLeaseStore:
+    """Sync leases and last committed results in a SQLite file shared by all workers on a host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_leases ("
+                " user_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sync_results ("
+                " user_id TEXT PRIMARY KEY, result TEXT NOT NULL, committed_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=5, isolation_level=None)
+
+    def acquire(self, user_id: str, owner: str, ttl: float) -> bool:
+        """Take the lease if it is free, expired, or already ours"""
+        now = time.time()
+        with self._connect() as conn:
+            cur = conn.execute(
+                "INSERT INTO sync_leases (user_id, owner, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+                "WHERE sync_leases.expires_at < ? OR sync_leases.owner = excluded.owner",
+                (user_id, owner, now + ttl, now),
+            )
+            return cur.rowcount == 1
+
+    def release(self, user_id: str, owner: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sync_leases WHERE user_id = ? AND owner = ?", (user_id, owner))
+
+    def holder(self, user_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT owner, expires_at FROM sync_leases WHERE user_id = ? AND expires_at >= ?",
+                (user_id, time.time()),
+            ).fetchone()
+        return {"owner": row[0], "expires_at": row[1]} if row else None
+
+    def record_result(self, user_id: str, result: Dict):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sync_results (user_id, result, committed_at) VALUES (?, ?, ?)",
+                (user_id, json.dumps(result), time.time()),
+            )
+
+    def last_result(self, user_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT result, committed_at FROM sync_results WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {**json.loads(row[0]), "committed_at": row[1]}
+
+
+class _Flight:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Optional[Dict] = None
+        self.error: Optional[BaseException] = None
+
+
+class SyncCoordinator:
+    """Ensures one sync per user at a time.
+
+    Concurrent callers in this process wait for the run already in flight and
+    share its result, marked `"coalesced": "in-process"`, or the exception it
+    raised. Their own `sync` is never called, so anything it would have done
+    for them alone (progress reporting, inline summaries) is up to the caller.
+    Across processes, whoever holds the user's lease syncs and everyone else
+    returns the last committed result, marked `"coalesced": "lease"`, instead
+    of syncing again.
+    """
+
+    def __init__(self, store: SyncLeaseStore, lease_ttl: float = 300.0):
+        self.store = store
+        self.lease_ttl = lease_ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def in_flight(self) -> int:
+        """Number of users with a sync running in this process"""
+        with self._lock:
+            return len(self._flights)
+
+    def run(self, user_id: str, sync: Callable[[], Dict], fresh: bool = False) -> Dict:
+        """Sync the user, or share the sync already running.
+
+        With `fresh`, a sync already running may have started too early for the
+        caller (e.g. before a push it is answering arrived), so it is waited out
+        and a new one is run rather than shared.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(user_id)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[user_id] = _Flight()
+            if leader or not fresh:
+                break
+            flight.done.wait()
+
+        if not leader:
+            logger.debug(f"[SYNC] Joining in-flight sync for {user_id}")
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return {**flight.result, "coalesced": "in-process"}
+
+        try:
+            flight.result = self._run_with_lease(user_id, sync)
+            return flight.result
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(user_id, None)
+            flight.done.set()
+
+    def _run_with_lease(self, user_id: str, sync: Callable[[], Dict]) -> Dict:
+        try:
+            acquired = self.store.acquire(user_id, self.owner, self.lease_ttl)
+        except sqlite3.Error as e:
+            # A broken lease store should not stop syncing altogether
+            logger.warning(f"[SYNC] Lease store unavailable, syncing without lease: {e}")
+            return sync()
+
+        if not acquired:
+            logger.info(f"[SYNC] Another worker holds the sync lease for {user_id}, serving last result")
+            last = self.store.last_result(user_id)
+            if last is None:
+                return {"success": True, "in_progress": True, "emails_synced": 0, "coalesced": "lease"}
+            return {**last, "coalesced": "lease"}
+
+        try:
+            result = sync()
+            if "error" not in result:
+                self.store.record_result(user_id, result)
+            return result
+        finally:
+            try:
+                self.store.release(user_id, self.owner)
+            except sqlite3.Error as e:
+                logger.warning(f"[SYNC] Could not release sync lease for {user_id}: {e}")
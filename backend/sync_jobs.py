@@ -0,0 +1,243 @@
+# sync_jobs.py
+"""Background sync jobs with per-stage progress, run off the request thread pool."""
+import logging
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from metrics import SYNC_STAGE_SECONDS
+from scheduler import INTERACTIVE, FairScheduler
+
+logger = logging.getLogger(__name__)
+
+SYNC_STAGES = ["list", "fetch", "normalize", "insert", "summarize", "trim"]
+
+# How long finished jobs stay queryable
+JOB_RETENTION_SECONDS = 3600
+MAX_RETAINED_JOBS = 1000
+
+
+class SyncProgress:
+    """Progress sink passed to sync_emails_from_gmail; the base class only records stage metrics"""
+
+    def __init__(self):
+        self._stage_started: Dict[str, float] = {}
+
+    def begin(self, stage: str):
+        self._stage_started[stage] = time.monotonic()
+
+    def done(self, stage: str, count: Optional[int] = None) -> float:
+        elapsed = time.monotonic() - self._stage_started.pop(stage, time.monotonic())
+        SYNC_STAGE_SECONDS.observe(elapsed, stage=stage)
+        return elapsed
+
+    def skip(self, stage: str):
+        pass
+
+
+class SyncJob(SyncProgress):
+    def __init__(self, user_id: str):
+        super().__init__()
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.status = "queued"
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.result: Optional[Dict] = None
+        self.error: Optional[str] = None
+        self.stages: Dict[str, Dict] = {name: {"status": "pending", "count": None, "duration_ms": None}
+                                        for name in SYNC_STAGES}
+        # Bumped on every change so streaming readers only send real updates
+        self.version = 0
+
+    def _touch(self):
+        self.version += 1
+
+    def begin(self, stage: str):
+        super().begin(stage)
+        if stage in self.stages:
+            self.stages[stage]["status"] = "running"
+            self._touch()
+
+    def done(self, stage: str, count: Optional[int] = None) -> float:
+        elapsed = super().done(stage, count)
+        # Sub-stages (e.g. dedup) only feed metrics; jobs report the top-level stages
+        if stage in self.stages:
+            self.stages[stage].update(status="done", count=count, duration_ms=round(elapsed * 1000, 1))
+            self._touch()
+        return elapsed
+
+    def skip(self, stage: str):
+        if stage in self.stages:
+            self.stages[stage]["status"] = "skipped"
+            self._touch()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("succeeded", "failed")
+
+    def to_dict(self) -> Dict:
+        return {
+            "job_id": self.id,
+            "user_id": self.user_id,
+            "status": self.status,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "stages": [{"stage": name, **self.stages[name]} for name in SYNC_STAGES],
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class SyncJobManager:
+    """Runs sync jobs on the fair scheduler, one share per user, and keeps recent jobs for status queries"""
+
+    def __init__(self, scheduler: FairScheduler, priority_class: str = INTERACTIVE):
+        self._scheduler = scheduler
+        self._priority_class = priority_class
+        self._jobs: Dict[str, SyncJob] = {}
+        self._active: Dict[str, str] = {}  # user_id -> job_id of queued/running job
+        self._lock = threading.Lock()
+
+    def submit(self, user_id: str, run: Callable[[SyncJob], Dict]) -> SyncJob:
+        """Queue run(job) for a user; a user with a job in flight gets that job back"""
+        with self._lock:
+            self._prune()
+            active_id = self._active.get(user_id)
+            if active_id and not self._jobs[active_id].finished:
+                return self._jobs[active_id]
+            job = SyncJob(user_id)
+            self._jobs[job.id] = job
+            self._active[user_id] = job.id
+        try:
+            future = self._scheduler.submit(user_id, self._priority_class, self._run, job, run)
+        except RuntimeError as e:  # the scheduler is shutting down
+            self._fail_unstarted(job, str(e))
+            return job
+        # Jobs still queued when the scheduler shuts down are cancelled without ever running
+        future.add_done_callback(
+            lambda f: f.cancelled() and self._fail_unstarted(job, "Server shut down before the job started"))
+        return job
+
+    def _fail_unstarted(self, job: SyncJob, reason: str):
+        job.status = "failed"
+        job.error = reason
+        self._finish(job)
+
+    def _run(self, job: SyncJob, run: Callable[[SyncJob], Dict]):
+        job.status = "running"
+        job.started_at = time.time()
+        job._touch()
+        try:
+            result = run(job)
+            if "error" in result:
+                job.status = "failed"
+                job.error = result["error"]
+            else:
+                job.status = "succeeded"
+            job.result = result
+        except Exception as e:
+            logger.error(f"[JOB] Sync job {job.id} crashed: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        finally:
+            self._finish(job)
+
+    def _finish(self, job: SyncJob):
+        job.finished_at = time.time()
+        with self._lock:
+            if self._active.get(job.user_id) == job.id:
+                del self._active[job.user_id]
+        job._touch()
+        logger.info(f"[JOB] Sync job {job.id} for {job.user_id} {job.status}")
+
+    def get(self, job_id: str) -> Optional[SyncJob]:
+        return self._jobs.get(job_id)
+
+    def counts(self) -> Dict[str, int]:
+        """Number of unfinished jobs by status (queued, running)"""
+        counts = {"queued": 0, "running": 0}
+        with self._lock:
+            for job_id in self._active.values():
+                status = self._jobs[job_id].status
+                if status in counts:
+                    counts[status] += 1
+        return counts
+
+    def _prune(self):
+        cutoff = time.time() - JOB_RETENTION_SECONDS
+        finished = [j for j in self._jobs.values() if j.finished]
+        for job in finished:
+            if job.finished_at < cutoff:
+                del self._jobs[job.id]
+        if len(self._jobs) > MAX_RETAINED_JOBS:
+            for job in sorted((j for j in self._jobs.values() if j.finished), key=lambda j: j.finished_at):
+                del self._jobs[job.id]
+                if len(self._jobs) <= MAX_RETAINED_JOBS:
+                    break
+
+
+class AccountsProgress:
+    """Folds the stage progress of concurrent per-account syncs into one progress sink.
+
+    A stage shows as running once any account starts it. It shows as done once
+    every account has finished or skipped it, with counts summed and the slowest
+    account's duration.
+    """
+
+    def __init__(self, progress: SyncProgress, accounts: List[str]):
+        self.progress = progress
+        self.accounts = list(accounts)
+        self._remaining = {stage: set(self.accounts) for stage in SYNC_STAGES}
+        self._counts: Dict[str, int] = {}
+        self._durations: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def for_account(self, account: str) -> SyncProgress:
+        return _AccountProgress(self, account)
+
+    def _update(self, stage: str, account: str, status: str, count: Optional[int] = None, elapsed: float = 0.0):
+        stages = getattr(self.progress, "stages", None)
+        if stages is None or stage not in stages:
+            return
+        with self._lock:
+            if status == "running":
+                if stages[stage]["status"] == "pending":
+                    stages[stage]["status"] = "running"
+                    self.progress._touch()
+                return
+            self._remaining[stage].discard(account)
+            if status == "done":
+                self._counts[stage] = self._counts.get(stage, 0) + (count or 0)
+                self._durations[stage] = max(self._durations.get(stage, 0.0), elapsed)
+            if not self._remaining[stage]:
+                if stage in self._durations:
+                    stages[stage].update(status="done", count=self._counts[stage],
+                                         duration_ms=round(self._durations[stage] * 1000, 1))
+                else:
+                    stages[stage]["status"] = "skipped"
+            self.progress._touch()
+
+
+class _AccountProgress(SyncProgress):
+    """One account's view of an AccountsProgress; records stage metrics per account as usual"""
+
+    def __init__(self, parent: AccountsProgress, account: str):
+        super().__init__()
+        self.parent = parent
+        self.account = account
+
+    def begin(self, stage: str):
+        super().begin(stage)
+        self.parent._update(stage, self.account, "running")
+
+    def done(self, stage: str, count: Optional[int] = None) -> float:
+        elapsed = super().done(stage, count)
+        self.parent._update(stage, self.account, "done", count, elapsed)
+        return elapsed
+
+    def skip(self, stage: str):
+        self.parent._update(stage, self.account, "skipped")
@@ -0,0 +1,134 @@
+# unread_counters.py
+"""Per-user unread/total counters for INBOX, categories and user labels, cached with a short TTL."""
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import quote
+
+from gmail_batch import batch_get, gmail_api_base
+from gmail_fields import LABEL_COUNT_FIELDS, LABEL_LIST_FIELDS
+from http_client import http_session
+from quota import gmail_account
+
+logger = logging.getLogger(__name__)
+
+CATEGORY_LABELS = [
+    "CATEGORY_PERSONAL",
+    "CATEGORY_SOCIAL",
+    "CATEGORY_PROMOTIONS",
+    "CATEGORY_UPDATES",
+    "CATEGORY_FORUMS",
+]
+
+
+def fetch_label_counts(access_token: str) -> Dict:
+    """Fetch messagesUnread/messagesTotal for every label we show, in two round trips.
+
+    labels.list does not include counts, so the counts come from labels.get
+    calls packed into a single batch request.
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    labels_url = f"{gmail_api_base()}/gmail/v1/users/me/labels"
+    r = http_session.get(labels_url, headers=headers, params={"fields": LABEL_LIST_FIELDS}, timeout=10)
+    if not r.ok:
+        raise RuntimeError(f"Gmail API error {r.status_code}: {r.text}")
+
+    labels = r.json().get("labels", [])
+    wanted = ["INBOX"] + CATEGORY_LABELS
+    user_labels = {l["id"]: l.get("name", l["id"]) for l in labels if l.get("type") == "user"}
+    existing = {l["id"] for l in labels}
+    label_ids = [lid for lid in wanted if lid in existing] + list(user_labels)
+
+    fields = quote(LABEL_COUNT_FIELDS, safe=",")
+    results = batch_get(access_token, [f"/gmail/v1/users/me/labels/{lid}?fields={fields}" for lid in label_ids])
+
+    counts: Dict[str, Dict] = {}
+    for lid, (status, data) in zip(label_ids, results):
+        if status != 200 or not data:
+            # Retry anything the batch dropped on its own
+            try:
+                one = http_session.get(f"{labels_url}/{lid}", headers=headers,
+                                       params={"fields": LABEL_COUNT_FIELDS}, timeout=10)
+                if not one.ok:
+                    logger.warning(f"[UNREAD] Label fetch failed for {lid}: {one.status_code}")
+                    continue
+                data = one.json()
+            except Exception as e:
+                logger.warning(f"[UNREAD] Label fetch error for {lid}: {e}")
+                continue
+        counts[lid] = {
+            "name": data.get("name", lid),
+            "unread": int(data.get("messagesUnread", 0)),
+            "total": int(data.get("messagesTotal", 0)),
+        }
+
+    return {
+        "inbox": counts.get("INBOX", {"name": "INBOX", "unread": 0, "total": 0}),
+        "categories": {lid: counts[lid] for lid in CATEGORY_LABELS if lid in counts},
+        "labels": {lid: counts[lid] for lid in user_labels if lid in counts},
+    }
+
+
+class UnreadCounters:
+    """TTL cache of label counts; syncs that see label changes mark a user stale"""
+
+    def __init__(self, ttl: float = 60.0):
+        self.ttl = ttl
+        self._entries: Dict[str, tuple] = {}  # user_id -> (fetched_at, counts)
+        self._stale: set = set()
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _user_lock(self, user_id: str) -> threading.Lock:
+        with self._guard:
+            lock = self._locks.get(user_id)
+            if lock is None:
+                lock = self._locks[user_id] = threading.Lock()
+            return lock
+
+    def _fresh(self, user_id: str) -> Optional[Dict]:
+        entry = self._entries.get(user_id)
+        if entry and user_id not in self._stale and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        return None
+
+    def get(self, user_id: str, access_token: Optional[str]) -> Optional[Dict]:
+        """Cached counts for a user, refetching when expired or marked stale"""
+        counts = self._fresh(user_id)
+        if counts is not None:
+            return {**counts, "cached": True}
+
+        # One refresh per user at a time; concurrent callers reuse its result
+        with self._user_lock(user_id):
+            counts = self._fresh(user_id)
+            if counts is not None:
+                return {**counts, "cached": True}
+            if not access_token:
+                return self._last(user_id)
+            try:
+                with gmail_account(user_id):
+                    counts = fetch_label_counts(access_token)
+            except Exception as e:
+                logger.error(f"[UNREAD] Could not refresh counters for {user_id}: {e}")
+                return self._last(user_id)
+            counts["fetched_at"] = time.time()
+            self._entries[user_id] = (time.monotonic(), counts)
+            self._stale.discard(user_id)
+            return {**counts, "cached": False}
+
+    def _last(self, user_id: str) -> Optional[Dict]:
+        # Serve the last known counts rather than nothing when Gmail is unavailable
+        entry = self._entries.get(user_id)
+        return {**entry[1], "cached": True, "stale": True} if entry else None
+
+    def mark_stale(self, user_id: str):
+        self._stale.add(user_id)
+
+    def clear(self, user_id: Optional[str] = None):
+        if user_id is None:
+            self._entries.clear()
+            self._stale.clear()
+        else:
+            self._entries.pop(user_id, None)
+            self._stale.discard(user_id)
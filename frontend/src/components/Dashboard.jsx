@@ -2,6 +2,17 @@
 import React, { useState, useEffect } from "react";
 const API_URL = (import.meta.env.VITE_API_URL || '').trim();
 
+// Requests carry the session both as the cookie set at sign-in and as a bearer token,
+// since browsers that block third-party cookies drop the cookie when API_URL is another site
+const apiFetch = (path, options = {}) => {
+  const session = sessionStorage.getItem("mailpilot_session");
+  const headers = { ...(options.headers || {}) };
+  if (session) {
+    headers.Authorization = `Bearer ${session}`;
+  }
+  return fetch(`${API_URL}${path}`, { ...options, headers, credentials: "include" });
+};
+
 
 const Dashboard = () => {
   const [data, setData] = useState(null);
@@ -31,6 +42,8 @@ const Dashboard = () => {
     const authSuccess = params.get("auth_success") || hashParams.get("auth_success");
     const userEmailFromHash = hashParams.get("user_email");
 
+    const loginCode = hashParams.get("code");
+
     if (userEmailFromHash) {
       sessionStorage.setItem("mailpilot_user_email", userEmailFromHash);
     }
@@ -40,10 +53,11 @@ const Dashboard = () => {
       window.history.replaceState({}, document.title, window.location.pathname);
       setIsAuthenticated(true);
 
-      setTimeout(() => {
+      // The single-use login code buys a bearer session for when the cookie is blocked
+      exchangeLoginCode(loginCode).finally(() => {
         fetchDashboard();
         fetchCaptchaConfig();
-      }, 1000);
+      });
     } else {
       const storedAuth = sessionStorage.getItem("mailpilot_authenticated");
       if (storedAuth === "true") {
@@ -59,13 +73,31 @@ const Dashboard = () => {
   }, []);
 
 
+  const exchangeLoginCode = async (code) => {
+    if (!code) return;
+    try {
+      const res = await fetch(`${API_URL}/auth/exchange`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ code }),
+        credentials: "include",
+      });
+      if (res.ok) {
+        const { session } = await res.json();
+        sessionStorage.setItem("mailpilot_session", session);
+      }
+    } catch (err) {
+      console.error("Login code exchange error:", err);
+    }
+  };
+
   const fetchDashboard = async () => {
     try {
       setLoading(true);
       setError(null);
       
       // First check if backend has our auth tokens
-  const authStatusRes = await fetch(`${API_URL}/auth/status`);
+  const authStatusRes = await apiFetch(`/auth/status`);
       const authStatus = await authStatusRes.json();
       
       if (!authStatus.authenticated) {
@@ -75,7 +107,7 @@ const Dashboard = () => {
         return;
       }
       
-  const res = await fetch(`${API_URL}/dashboard`);
+  const res = await apiFetch(`/dashboard`);
       
       if (res.status === 401) {
         // Token expired or invalid, redirect to login
@@ -107,9 +139,85 @@ const Dashboard = () => {
     }
   };
 
+  // Refetch without the loading state; an unchanged dashboard is answered with a 304
+  const refreshDashboard = async () => {
+    try {
+      const res = await apiFetch(`/dashboard`);
+      if (res.ok) {
+        setData(await res.json());
+      }
+    } catch (err) {
+      console.error("Dashboard refresh error:", err);
+    }
+  };
+
+  // Live updates pushed by the server: new mail, summaries and keyword changes
+  useEffect(() => {
+    if (!isAuthenticated || typeof EventSource === "undefined") {
+      return;
+    }
+    let source = null;
+    let refreshTimer = null;
+    let reconnectTimer = null;
+    let stopped = false;
+    const scheduleRefresh = () => {
+      clearTimeout(refreshTimer);
+      refreshTimer = setTimeout(refreshDashboard, 500);
+    };
+
+    // EventSource cannot send the Authorization header, so the stream is opened with a
+    // short-lived token in its URL (the cookie still works where the browser sends it)
+    const connect = async (reconnecting) => {
+      let url = `${API_URL}/events`;
+      try {
+        const res = await apiFetch(`/events/token`, { method: "POST" });
+        if (res.ok) {
+          const { token } = await res.json();
+          url += `?stream_token=${encodeURIComponent(token)}`;
+        }
+      } catch (err) {
+        console.error("Event stream token error:", err);
+      }
+      if (stopped) {
+        return;
+      }
+      source = new EventSource(url, { withCredentials: true });
+      ["emails.inserted", "emails.deleted", "keywords.matched", "keywords.changed", "resync"].forEach((type) =>
+        source.addEventListener(type, scheduleRefresh)
+      );
+      source.addEventListener("summary.updated", (event) => {
+        const { id, summary } = JSON.parse(event.data);
+        const withSummary = (emails) => (emails || []).map((email) => (email.id === id ? { ...email, summary } : email));
+        setData((prev) => prev && {
+          ...prev,
+          recentEmails: withSummary(prev.recentEmails),
+          importantEmails: withSummary(prev.importantEmails),
+        });
+      });
+      // A new stream does not replay what the old one missed, so catch up once it is open
+      source.onopen = () => reconnecting && scheduleRefresh();
+      // The browser would retry with the same, soon expired, token; reconnect with a fresh one instead
+      source.onerror = () => {
+        source.close();
+        clearTimeout(reconnectTimer);
+        reconnectTimer = setTimeout(() => connect(true), 3000);
+      };
+    };
+    connect(false);
+
+    return () => {
+      stopped = true;
+      clearTimeout(refreshTimer);
+      clearTimeout(reconnectTimer);
+      if (source) {
+        source.close();
+      }
+    };
+  }, [isAuthenticated]);
+
   const fetchCaptchaConfig = async () => {
     try {
-      const res = await fetch(`${API_URL}/captcha/config`);
+      const res = await apiFetch(`/captcha/config`);
       if (!res.ok) {
         setCaptchaConfig({ enabled: false, site_key: null });
         return;
@@ -219,11 +327,12 @@ const Dashboard = () => {
 
   const handleLogout = async () => {
     try {
-  await fetch(`${API_URL}/logout`);
+  await apiFetch(`/logout`);
     } catch (err) {
       console.error("Logout error:", err);
     } finally {
       sessionStorage.removeItem("mailpilot_authenticated");
+      sessionStorage.removeItem("mailpilot_session");
       setIsAuthenticated(false);
       setData(null);
       setError("Logged out successfully.");
@@ -232,7 +341,7 @@ const Dashboard = () => {
 
   const handleLogin = async () => {
     try {
-  const response = await fetch(`${API_URL}/login`);
+  const response = await apiFetch(`/login`);
       if (!response.ok) {
         throw new Error("Failed to get login URL");
       }
@@ -253,6 +362,24 @@ const Dashboard = () => {
     setShowCaptcha(true);
   };
 
+  const waitForSyncJob = async (jobId) => {
+    for (;;) {
+      await new Promise((resolve) => setTimeout(resolve, 1000));
+      const res = await apiFetch(`/sync-jobs/${jobId}`, { headers: getHeaders() });
+      if (!res.ok) {
+        const errorData = await res.json().catch(() => ({}));
+        throw new Error(errorData.detail || "Failed to check sync status");
+      }
+      const job = await res.json();
+      if (job.status === "succeeded") {
+        return job.result || {};
+      }
+      if (job.status === "failed") {
+        throw new Error(job.error || "Sync failed");
+      }
+    }
+  };
+
   const performSync = async () => {
     try {
       setLoading(true);
@@ -260,7 +387,7 @@ const Dashboard = () => {
       // Prepare request body
       const requestBody = captchaResponse ? { captcha_response: captchaResponse } : {};
       
-      const response = await fetch(`${API_URL}/sync-emails`, {
+      const response = await apiFetch(`/sync-emails`, {
         method: "POST",
         headers: getHeaders(),
         body: JSON.stringify(requestBody)
@@ -277,7 +404,11 @@ const Dashboard = () => {
         throw new Error(errorData.detail || "Failed to sync emails");
       }
       
-      const result = await response.json();
+      // Sync runs as a background job; poll until it finishes
+      let result = await response.json();
+      if (response.status === 202 && result.job_id) {
+        result = await waitForSyncJob(result.job_id);
+      }
       
       // Reset captcha after successful sync
       setCaptchaResponse(null);
@@ -304,7 +435,7 @@ const Dashboard = () => {
     if (!newKeyword.trim()) return;
     
     try {
-  const response = await fetch(`${API_URL}/keywords`, {
+  const response = await apiFetch(`/keywords`, {
         method: "POST",
         headers: {
           "Content-Type": "application/json"
@@ -329,7 +460,7 @@ const Dashboard = () => {
 
   const handleRemoveKeyword = async (keyword) => {
     try {
-  const response = await fetch(`${API_URL}/keywords/${encodeURIComponent(keyword)}`, {
+  const response = await apiFetch(`/keywords/${encodeURIComponent(keyword)}`, {
         method: "DELETE"
       });
       